@@ -0,0 +1,994 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import pickle
+import resource
+import signal
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import psycopg2 as pg
+from dotenv import load_dotenv
+import pre_processing as prep
+import data_fetch
+import lean_model
+import model_store
+import score_writer
+import synthetic_data
+import scalable_model
+import window_pushdown
+import tick_pipeline
+import migrations
+import replicas
+# The throwaway databases of the PostgreSQL benchmarks, shared with the tests
+from tests import helpers
+
+# Load environment variables from the .env file
+load_dotenv()
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST")
+POSTGRES_USER = os.environ.get("POSTGRES_USER")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+POSTGRES_DB = os.environ.get("POSTGRES_DB")
+POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+# Throwaway database of the pipeline benchmark's writes (e.g. "dbname=bench user=postgres"), never production
+BENCHMARK_DSN = os.environ.get("BENCHMARK_DSN")
+BENCHMARK_SCHEMA = 'anomaly_monitor_benchmark'
+
+
+def get_db_config():
+    return {
+        'database': POSTGRES_DB ,
+        'user': POSTGRES_USER,
+        'password': POSTGRES_PASSWORD,
+        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
+        'port': POSTGRES_PORT       # Default PostgreSQL port
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_isolated(target, *args):
+    """
+    Runs target(*args) in a fresh process and returns what it returns, so every
+    measurement gets its own peak RSS.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_isolated_entry, args=(queue, target, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def _isolated_entry(queue, target, args):
+    try:
+        queue.put(target(*args))
+    except Exception as e:
+        queue.put(e)
+
+
+def print_table(rows, columns):
+    cells = [[f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column]) for column in columns]
+             for row in rows]
+    widths = [max([14, len(column)] + [len(line[index]) for line in cells]) for index, column in enumerate(columns)]
+    print(' | '.join(f'{column:>{width}}' for column, width in zip(columns, widths)))
+    for line in cells:
+        print(' | '.join(f'{cell:>{width}}' for cell, width in zip(line, widths)))
+
+
+""" ******************* Fetch: row-by-row vs typed columnar ******************* """
+
+def legacy_fetch(cursor, tag_name, start_date, end_date):
+    """
+    The original fetch path (train.get_training_data): fetchall() of Decimal rows into an object DataFrame.
+    """
+    cursor.execute(f"""
+        select dt as "Timestamp"
+    ,p.description as "Variable"
+    ,AVG(value) as "Value"
+    from {VARIABLES_SCHEMA}.inspections i
+    inner join {VARIABLES_SCHEMA}.params p on i.id_param_fk = p.id
+    WHERE (p.description like %s or p.description = 'II113RC001\\U')
+    and dt between %s::Timestamptz and %s::Timestamptz
+    GROUP BY "Timestamp", "Variable"
+    ORDER BY "Timestamp" asc;
+    """, (f'%{tag_name}%', start_date, end_date))
+    results = cursor.fetchall()
+    return pd.DataFrame(results, columns=[desc[0] for desc in cursor.description])
+
+
+def typed_fetch(cursor, tag_name, start_date, end_date):
+    return data_fetch.fetch_tag_range(cursor, data_fetch.ParamResolver(), tag_name, start_date, end_date)
+
+
+FETCH_PATHS = {'legacy': legacy_fetch, 'typed': typed_fetch}
+
+
+def measure_fetch(path, tag_name, start_date, end_date):
+    conn = pg.connect(**get_db_config())
+    try:
+        cursor = conn.cursor()
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        df = FETCH_PATHS[path](cursor, tag_name, start_date, end_date)
+        fetched = time.perf_counter()
+        prep.pivot_dataframe_column(df, 'Timestamp', 'Variable', 'Value')
+        pivoted = time.perf_counter()
+        return {
+            'path': path,
+            'rows': len(df),
+            'fetch_s': fetched - started,
+            'pivot_s': pivoted - fetched,
+            'rows_per_s': len(df) / (pivoted - started),
+            'peak_rss_mb': peak_rss_mb() - baseline,
+        }
+    finally:
+        conn.close()
+
+
+def benchmark_fetch(args):
+    results = []
+    for _ in range(args.repeat):
+        for path in FETCH_PATHS:
+            results.append(run_isolated(measure_fetch, path, args.tag, args.start, args.end))
+    print_table(results, ['path', 'rows', 'fetch_s', 'pivot_s', 'rows_per_s', 'peak_rss_mb'])
+    return results
+
+
+""" ******************* Training data: one-shot vs streamed ******************* """
+
+def measure_training_data(mode, tag_name, start_date, end_date, batch_rows):
+    conn = pg.connect(**get_db_config())
+    try:
+        resolver = data_fetch.ParamResolver()
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        if mode == 'stream':
+            chunks = data_fetch.stream_tag_range(conn, resolver, tag_name, start_date, end_date, batch_rows=batch_rows)
+            features = prep.treat_data_streaming(chunks, tag_name)
+        else:
+            dataset = data_fetch.fetch_tag_range(conn.cursor(), resolver, tag_name, start_date, end_date)
+            features = prep.treat_data(dataset, tag_name)
+        return {
+            'mode': mode,
+            'feature_rows': len(features),
+            'seconds': time.perf_counter() - started,
+            'peak_rss_mb': peak_rss_mb() - baseline,
+        }
+    finally:
+        conn.close()
+
+
+def benchmark_training_data(args):
+    results = []
+    for _ in range(args.repeat):
+        for mode in ('columnar', 'stream'):
+            results.append(run_isolated(measure_training_data, mode, args.tag, args.start, args.end, args.batch_rows))
+    print_table(results, ['mode', 'feature_rows', 'seconds', 'peak_rss_mb'])
+    return results
+
+
+""" ******************* End-to-end pipeline on synthetic data ******************* """
+
+class StageTimer:
+    """
+    Collects the wall time, input rows and (optionally) peak traced allocation of each stage run.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.samples = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, rows):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        self.samples.setdefault(name, []).append((seconds, rows, peak))
+
+    def summary(self):
+        stages = {}
+        for name, samples in self.samples.items():
+            seconds = np.array([sample[0] for sample in samples])
+            rows = sum(sample[1] for sample in samples)
+            stages[name] = {
+                'runs': len(samples),
+                'rows': rows,
+                'total_s': float(seconds.sum()),
+                'rows_per_s': rows / seconds.sum() if seconds.sum() else None,
+                'p50_ms': float(np.percentile(seconds, 50) * 1000),
+                'p95_ms': float(np.percentile(seconds, 95) * 1000),
+                'p99_ms': float(np.percentile(seconds, 99) * 1000),
+                'max_ms': float(seconds.max() * 1000),
+            }
+            if self.trace_memory:
+                stages[name]['peak_alloc_mb'] = max(sample[2] for sample in samples) / 2 ** 20
+        return stages
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def scores_database(dsn):
+    """
+    Yields a connection to the throwaway BENCHMARK_SCHEMA with an empty inspections_calc
+    (and its unique index) the write stage writes to, dropped afterwards.
+    """
+    with helpers.empty_schema(dsn, BENCHMARK_SCHEMA) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE UNIQUE INDEX ON {BENCHMARK_SCHEMA}.inspections_calc (id_param_fk, dt);")
+        conn.commit()
+        yield conn
+
+
+def run_pipeline_stages(timer, tag_anomaly_id, tag_name, dataset, model, conn):
+    """
+    Runs treat_data, filter_columns, scoring and the score write of one tag, timing each stage.
+    """
+    with timer.stage('total', len(dataset)):
+        with timer.stage('pivot_dataframe_column', len(dataset)):
+            dataset = dataset.copy()
+            dataset['Timestamp'] = pd.to_datetime(dataset['Timestamp'], unit='ms', utc=True)
+            pivoted = prep.pivot_dataframe_column(dataset, 'Timestamp', 'Variable', 'Value')
+        with timer.stage('create_aggregated_df', len(pivoted)):
+            aggregated = prep.create_aggregated_df(pivoted, prep.get_columns_to_aggregate(tag_name), prep.WINDOW_SIZES)
+        with timer.stage('filter_columns', len(aggregated)):
+            filtered = prep.filter_columns(aggregated)
+        with timer.stage('score', len(filtered)):
+            predictions = model.predict(filtered.drop(columns=['Timestamp']))
+            predictions['Timestamp'] = aggregated['Timestamp']
+        if conn is not None:
+            with timer.stage('write_scores', len(predictions)):
+                with conn.cursor() as cursor:
+                    score_writer.write_scores(cursor, tag_anomaly_id, predictions, mode='replace', tag_name=tag_name)
+                conn.commit()
+
+
+def print_baseline_comparison(stages, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    print(f"Compared with {baseline_path} (commit {baseline.get('commit')}):")
+    for name, stats in stages.items():
+        previous = baseline['stages'].get(name)
+        if previous:
+            change = 100 * (stats['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] if previous['p50_ms'] else 0
+            print(f"{name:>24}: p50 {previous['p50_ms']:.1f} -> {stats['p50_ms']:.1f} ms ({change:+.0f}%)")
+
+
+def benchmark_pipeline(args):
+    tag_names = synthetic_data.get_tag_names(args.tags)
+    print(f"Generating {args.tags} tag(s) x {args.days} day(s) of synthetic data...")
+    datasets = synthetic_data.generate_dataset(tag_names, args.days, seed=args.seed)
+    with tempfile.TemporaryDirectory() as models_dir:
+        models = {tag_name: helpers.fit_synthetic_model(tag_name, dataset, os.path.join(models_dir, f'{tag_name}.npz'))
+                  for tag_name, dataset in datasets.items()}
+
+    timer = StageTimer(trace_memory=args.trace_memory)
+    if args.trace_memory:
+        tracemalloc.start()
+    baseline_rss = peak_rss_mb()
+    with (scores_database(args.dsn) if args.dsn else contextlib.nullcontext()) as conn:
+        if conn is None:
+            print("No --dsn/BENCHMARK_DSN, the write stage is skipped")
+        for _ in range(args.repeat):
+            if conn is not None:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"TRUNCATE {BENCHMARK_SCHEMA}.inspections_calc;")
+                conn.commit()
+            for tag_anomaly_id, tag_name in enumerate(tag_names, start=1):
+                run_pipeline_stages(timer, tag_anomaly_id, tag_name, datasets[tag_name], models[tag_name], conn)
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    stages = timer.summary()
+    rows = [dict(stage=name, **{key: stats[key] for key in ('rows_per_s', 'p50_ms', 'p95_ms', 'max_ms')})
+            for name, stats in stages.items()]
+    print_table(rows, ['stage', 'rows_per_s', 'p50_ms', 'p95_ms', 'max_ms'])
+    result = {
+        'commit': get_git_commit(),
+        'generated_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'parameters': {'tags': args.tags, 'days': args.days, 'seed': args.seed, 'repeat': args.repeat,
+                       'writes': conn is not None},
+        'long_rows': int(sum(len(dataset) for dataset in datasets.values())),
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_growth_mb': peak_rss_mb() - baseline_rss,
+    }
+    print(f"Peak RSS {result['peak_rss_mb']:.0f} MB")
+    if args.baseline:
+        print_baseline_comparison(stages, args.baseline)
+    return result
+
+
+""" ******************* Scalable models ******************* """
+
+def get_model_data(args):
+    """
+    Returns the tag's training features: training_data/<tag>.csv, or --synthetic-days of synthetic data.
+    """
+    if args.synthetic_days:
+        print(f"Generating {args.synthetic_days} day(s) of synthetic data...")
+        long = synthetic_data.generate_dataset([args.tag], args.synthetic_days, seed=args.seed)[args.tag]
+    else:
+        long = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'training_data', f'{args.tag}.csv'))
+    return prep.filter_columns(prep.treat_data(long, args.tag))
+
+
+def measure_model(kind, features, fill_values, X, subsample_rows, components):
+    """
+    Fits one model on the rows of X the pipeline's outlier removal keeps, as train.py does,
+    and scores every row of X with its lean form. 'exact' is the OCSVM of the pycaret
+    pipeline, fitted on all of those rows.
+    """
+    from sklearn.svm import OneClassSVM
+
+    started = time.perf_counter()
+    X_train = scalable_model.remove_outliers(X)
+    if kind == 'exact':
+        detector = OneClassSVM(nu=scalable_model.NU, gamma='auto').fit(X_train)
+        threshold = np.percentile(-detector.decision_function(X_train), 100 * (1 - scalable_model.CONTAMINATION))
+        parameters = (detector.support_vectors_, np.ravel(detector.dual_coef_), detector.intercept_[0], detector._gamma,
+                      threshold)
+    else:
+        # Measured even below the agreement train.py requires, that's what the table shows
+        parameters = scalable_model.fit_scalable_model(kind, features, fill_values, X_train,
+                                                       subsample_rows=subsample_rows, components=components,
+                                                       min_agreement=0)
+    fit_seconds = time.perf_counter() - started
+    model = lean_model.LeanModel.from_arrays(features, fill_values, *parameters)
+    started = time.perf_counter()
+    scores = model.decision_scores(X)
+    score_seconds = time.perf_counter() - started
+    return {
+        'model': kind,
+        'fit_s': fit_seconds,
+        'centres': len(parameters[0]),
+        'score_rows_per_s': len(X) / score_seconds,
+        'threshold': float(model.threshold),
+        'peak_rss_mb': peak_rss_mb(),
+        'scores': scores,
+    }
+
+
+def compare_flags(scores, threshold, reference_scores, reference_threshold):
+    flags = scores > threshold
+    reference_flags = reference_scores > reference_threshold
+    both = np.sum(flags & reference_flags)
+    return {
+        'flagged_pct': 100 * flags.mean(),
+        # Share of the reference's anomalies also flagged, and of the flags the reference agrees with
+        'recall_pct': 100 * both / max(reference_flags.sum(), 1),
+        'precision_pct': 100 * both / max(flags.sum(), 1),
+        'score_corr': float(np.corrcoef(scores, reference_scores)[0, 1]),
+    }
+
+
+def benchmark_models(args):
+    dftrain_filtered = get_model_data(args)
+    features, fill_values, X = scalable_model.get_training_matrix(dftrain_filtered)
+    print(f"{args.tag}: {len(X)} training rows x {len(features)} features")
+
+    kinds = (['exact'] if not args.skip_exact else []) + ['subsample', 'nystroem']
+    measured = [run_isolated(measure_model, kind, features, fill_values, X, args.subsample_rows, args.components)
+                for kind in kinds]
+    if args.model:
+        # Agreement with the deployed model's flags
+        current = lean_model.LeanModel(args.model)
+        reference_name = args.model
+        reference_scores = current.decision_scores(dftrain_filtered[current.features].to_numpy(dtype=np.float64, na_value=np.nan))
+        reference_threshold = current.threshold
+    elif not args.skip_exact:
+        reference_name = 'exact'
+        reference_scores, reference_threshold = measured[0]['scores'], measured[0]['threshold']
+    else:
+        reference_name = None
+
+    results = []
+    for result in measured:
+        scores = result.pop('scores')
+        if reference_name is not None:
+            result.update(compare_flags(scores, result['threshold'], reference_scores, reference_threshold))
+        results.append(result)
+    columns = ['model', 'fit_s', 'centres', 'score_rows_per_s', 'threshold', 'peak_rss_mb']
+    if reference_name is not None:
+        print(f"Agreement with {reference_name}:")
+        columns += ['flagged_pct', 'recall_pct', 'precision_pct', 'score_corr']
+    print_table(results, columns)
+    return {'tag': args.tag, 'rows': len(X), 'reference': reference_name, 'models': results}
+
+
+""" ******************* Shared plant-wide signals ******************* """
+
+def get_synthetic_tick(tag_count, days, seed, tick_minutes=15):
+    """
+    Returns the tick_data of a synthetic tick: every tag checkpointed up to the last
+    tick_minutes, whose rows are the new data.
+    """
+    tag_names = synthetic_data.get_tag_names(tag_count)
+    datasets = synthetic_data.generate_dataset(tag_names, days, seed=seed)
+    cut = max(dataset['Timestamp'].max() for dataset in datasets.values()) - tick_minutes * 60 * 1000
+    tick_data = {}
+    for tag_name, dataset in datasets.items():
+        _, checkpoint = prep.treat_data_incremental(dataset[dataset['Timestamp'] <= cut].copy(), tag_name)
+        tick_data[tag_name] = (dataset[dataset['Timestamp'] > cut], checkpoint)
+    return tick_data
+
+
+def measure_shared_features(tick_data, shared_column, use_shared, repeat):
+    """
+    Best time over repeat runs of a tick's shared_column features for every tag, per tag or from SharedFeatures.
+    """
+    wanted = {window_size: prep.rolling_kernel.STATISTICS + ([prep.CROSSINGS] if window_size == 6 else [])
+              for window_size in prep.WINDOW_SIZES}
+    rows = []
+    for tag_name, (dataset, checkpoint) in tick_data.items():
+        dataset = dataset.copy()
+        dataset['Timestamp'] = pd.to_datetime(dataset['Timestamp'], unit='ms')
+        pivoted = prep.pivot_dataframe_column(dataset, 'Timestamp', 'Variable', 'Value')
+        pivoted = pd.concat([checkpoint['raw_tail'], pivoted], ignore_index=True).sort_values('Timestamp')
+        timestamps = pd.DatetimeIndex(pivoted['Timestamp'])
+        nanoseconds = timestamps.asi8
+        rows.append((nanoseconds, pivoted[shared_column].to_numpy(dtype=np.float64, na_value=np.nan),
+                     prep.rolling_kernel.get_window_bounds(nanoseconds, prep.WINDOW_SIZES),
+                     timestamps.searchsorted(checkpoint['last_timestamp'], side='right')))
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        shared = prep.SharedFeatures(tick_data) if use_shared else None
+        for nanoseconds, values, window_bounds, first_output in rows:
+            statistics = shared.get_statistics(shared_column, nanoseconds, values, wanted, first_output) if shared else None
+            prep.aggregate_column(shared_column, nanoseconds, values, wanted, window_bounds, statistics)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, shared
+
+
+def benchmark_shared_signals(args):
+    shared_column = prep.SHARED_COLUMNS[0]
+    rows = []
+    for tag_count in args.tags:
+        tick_data = get_synthetic_tick(tag_count, args.days, args.seed)
+        per_tag, _ = measure_shared_features(tick_data, shared_column, False, args.repeat)
+        shared_time, shared = measure_shared_features(tick_data, shared_column, True, args.repeat)
+        rows.append({'tags': tag_count, 'per_tag_ms': per_tag * 1000, 'shared_ms': shared_time * 1000,
+                     'reused': shared.hits, 'recomputed': shared.misses})
+    print(f"{shared_column} features of one tick:")
+    print_table(rows, ['tags', 'per_tag_ms', 'shared_ms', 'reused', 'recomputed'])
+    return {'parameters': {'days': args.days, 'seed': args.seed, 'repeat': args.repeat}, 'results': rows}
+
+""" ******************* Window aggregates in PostgreSQL ******************* """
+
+class CopyByteCounter:
+    """
+    Cursor proxy adding up the bytes every COPY ... TO STDOUT writes (the transfer size).
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.bytes = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def copy_expert(self, sql, file, *args):
+        start = file.tell()
+        self.cursor.copy_expert(sql, file, *args)
+        self.bytes += file.tell() - start
+
+
+def measure_feature_paths(cursor, resolver, tag_name, start_date, end_date, tick_minutes, repeat):
+    """
+    Times the current path (raw typed fetch + rolling kernel) and window_pushdown, on the
+    whole range and on a tick (the last tick_minutes after a checkpoint), with the bytes received.
+    """
+    since = pd.Timestamp(end_date) - pd.Timedelta(minutes=tick_minutes)
+    _, checkpoint = prep.treat_data_incremental(data_fetch.fetch_tag_range(cursor, resolver, tag_name, start_date, since),
+                                                tag_name)
+    raw_tail = checkpoint['raw_tail']
+
+    def current_range(counter):
+        prep.treat_data(data_fetch.fetch_tag_range(counter, resolver, tag_name, start_date, end_date), tag_name)
+
+    def pushdown_range(counter):
+        window_pushdown.fetch_window_features(counter, resolver, tag_name, start_date, end_date)
+
+    def current_tick(counter):
+        # The current tick fetches the minutes after the checkpoint (typed path, lower bound excluded)
+        new = data_fetch.fetch_tag_range(counter, resolver, tag_name, checkpoint['last_timestamp'] + pd.Timedelta(microseconds=1),
+                                         end_date)
+        prep.treat_data_incremental(new, tag_name, checkpoint)
+
+    def pushdown_tick(counter):
+        window_pushdown.fetch_window_features(counter, resolver, tag_name, raw_tail['Timestamp'].iloc[0], end_date,
+                                              checkpoint['last_timestamp'], raw_history=raw_tail)
+
+    rows = []
+    for scenario, path, run in [('range', 'current', current_range), ('range', 'pushdown', pushdown_range),
+                                ('tick', 'current', current_tick), ('tick', 'pushdown', pushdown_tick)]:
+        seconds = []
+        for _ in range(repeat):
+            counter = CopyByteCounter(cursor)
+            started = time.perf_counter()
+            run(counter)
+            seconds.append(time.perf_counter() - started)
+        rows.append({'scenario': scenario, 'path': path, 'p50_ms': float(np.median(seconds) * 1000),
+                     'min_ms': float(min(seconds) * 1000), 'kib': counter.bytes / 1024})
+    return rows
+
+
+def benchmark_window_pushdown(args):
+    if args.synthetic_days:
+        if not args.dsn:
+            raise SystemExit("--synthetic-days loads the data into a throwaway database: pass --dsn or set BENCHMARK_DSN")
+        context = helpers.synthetic_inspections(args.dsn, [args.tag], args.synthetic_days, args.seed, BENCHMARK_SCHEMA)
+    else:
+        context = contextlib.closing(pg.connect(**get_db_config()))
+    with context as conn:
+        with conn.cursor() as cursor:
+            resolver = data_fetch.ParamResolver()
+            if args.synthetic_days:
+                cursor.execute(f"SELECT min(dt), max(dt) FROM {data_fetch.VARIABLES_SCHEMA}.inspections;")
+                start_date, end_date = (pd.Timestamp(value) for value in cursor.fetchone())
+            else:
+                start_date, end_date = pd.Timestamp(args.start), pd.Timestamp(args.end)
+
+            timings = measure_feature_paths(cursor, resolver, args.tag, start_date, end_date, args.tick_minutes, args.repeat)
+            print_table(timings, ['scenario', 'path', 'p50_ms', 'min_ms', 'kib'])
+            conn.rollback()
+    return {'parameters': {'tag': args.tag, 'start': str(start_date), 'end': str(end_date), 'repeat': args.repeat,
+                           'synthetic_days': args.synthetic_days}, 'timings': timings}
+
+""" ******************* Pipelined tick ******************* """
+
+def measure_tick(tick_data, model_cache, fetch_ms, write_ms, depth):
+    """
+    Scores a synthetic tick with simulated query and write latencies, one tag after the
+    other (depth 0) or through tick_pipeline.
+
+    Returns:
+        tuple: ({tag_name: predictions}, seconds, most tags fetched but not yet written at once).
+    """
+    import predict
+
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+    scores = {}
+
+    def fetch(tag_name, _):
+        # The database works while this thread waits, like psycopg2 waiting on the socket
+        time.sleep(fetch_ms / 1000)
+        with lock:
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+        dataset, checkpoint = tick_data[tag_name]
+        return dataset.copy(), checkpoint
+
+    def score(tag_name, fetched):
+        return predict.compute_tag_scores(tag_name, *fetched, model_cache)
+
+    def write(tag_name, scored):
+        time.sleep(write_ms / 1000)
+        scores[tag_name] = scored[0]
+        with lock:
+            in_flight['now'] -= 1
+        return len(scored[0])
+
+    stages = [('fetch', fetch), ('score', score), ('write', write)]
+    started = time.perf_counter()
+    if depth == 0:
+        for tag_name in tick_data:
+            output = None
+            for _, function in stages:
+                output = function(tag_name, output)
+    else:
+        results = tick_pipeline.run_pipeline([(tag_name, tag_name) for tag_name in tick_data], stages, depth)
+        failed = {tag_name: result for tag_name, result in results.items() if result[0] != 'ok'}
+        if failed:
+            raise RuntimeError(f"Pipelined tick failed: {failed}")
+    return scores, time.perf_counter() - started, in_flight['max']
+
+
+def benchmark_tick_pipeline(args):
+    import predict
+
+    tick_data = get_synthetic_tick(args.tags, args.days, args.seed, args.tick_minutes)
+    with tempfile.TemporaryDirectory() as models_dir:
+        datasets = synthetic_data.generate_dataset(list(tick_data), args.days, seed=args.seed)
+        for tag_name, dataset in datasets.items():
+            helpers.fit_synthetic_model(tag_name, dataset, os.path.join(models_dir, f'{tag_name}.npz'))
+        model_cache = predict.ModelCache(models_dir)
+        for tag_name in tick_data:
+            model_cache.get_plan(tag_name)
+
+        rows = []
+        reference = None
+        for fetch_ms in args.fetch_ms:
+            for depth in [0] + args.depth:
+                seconds = []
+                for _ in range(args.repeat):
+                    scores, elapsed, in_flight = measure_tick(tick_data, model_cache, fetch_ms, args.write_ms, depth)
+                    seconds.append(elapsed)
+                if reference is None:
+                    reference = scores
+                same = all(scores[tag_name]['Anomaly_Score'].equals(reference[tag_name]['Anomaly_Score'])
+                           for tag_name in tick_data)
+                rows.append({'fetch_ms': fetch_ms, 'depth': depth, 'tick_ms': float(np.median(seconds) * 1000),
+                             'max_in_flight': in_flight, 'same_scores': same})
+            serial = rows[-1 - len(args.depth)]['tick_ms']
+            for row in rows[-len(args.depth):]:
+                row['speedup'] = serial / row['tick_ms']
+            rows[-1 - len(args.depth)]['speedup'] = 1.0
+    print(f"{args.tags} tags, {args.tick_minutes} new minutes each, writes of {args.write_ms} ms (depth 0 = serial):")
+    print_table(rows, ['fetch_ms', 'depth', 'tick_ms', 'speedup', 'max_in_flight', 'same_scores'])
+    return {'parameters': {'tags': args.tags, 'days': args.days, 'seed': args.seed, 'repeat': args.repeat,
+                           'tick_minutes': args.tick_minutes, 'write_ms': args.write_ms}, 'results': rows}
+
+
+""" ******************* Event-driven scoring ******************* """
+
+def benchmark_events(args):
+    import predict
+    import event_predictor
+
+    if not args.dsn:
+        raise SystemExit("The event benchmark replays inserts into a throwaway database: pass --dsn or set BENCHMARK_DSN")
+    debounce = event_predictor.EVENT_DEBOUNCE_SECONDS if args.debounce is None else args.debounce
+    max_delay = event_predictor.EVENT_MAX_DELAY_SECONDS if args.max_delay is None else args.max_delay
+    tag_names = synthetic_data.get_tag_names(args.tags)
+    scorings = []
+    with helpers.scoring_database(args.dsn, tag_names, args.days, args.seed, args.minutes,
+                                  BENCHMARK_SCHEMA) as (conn, models_dir, _):
+        migrations.set_notify_trigger(conn, BENCHMARK_SCHEMA, True)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT dt FROM {BENCHMARK_SCHEMA}.held ORDER BY dt;")
+            minutes = [row[0] for row in cursor.fetchall()]
+            resolver = data_fetch.ParamResolver()
+            resolver.refresh(cursor)
+        conn.commit()
+        tag_params = {tag_name: resolver.get_tag_params(tag_name) for tag_name in tag_names}
+
+        predictor = event_predictor.EventPredictor({'dsn': args.dsn}, debounce, max_delay,
+                                                   on_scored=lambda *scoring: scorings.append(scoring))
+        predictor.model_cache = predict.ModelCache(models_dir)
+        listener = threading.Thread(target=predictor.run_once)
+        listener.start()
+        try:
+            if not predictor.ready.wait(300):
+                raise RuntimeError("The event predictor did not finish its first sweep")
+            print(f"Replaying {len(minutes)} minutes of {args.tags} tags, one every {args.minute_seconds}s...")
+            arrivals = helpers.replay_minutes(conn, minutes, tag_params, resolver.get_shared_params(), args.minute_seconds,
+                                      predictor.stop_event, BENCHMARK_SCHEMA)
+            time.sleep(max_delay + 2)
+        finally:
+            predictor.stop_event.set()
+            listener.join()
+
+    # An inserted minute waits for the first scoring of its tag that ends after its commit
+    latencies = []
+    for tag_name, dt, committed in arrivals:
+        done = [scored_at for scoring_tag, _, scored_at, result in scorings
+                if scoring_tag == tag_name and result[0] == 'ok' and scored_at >= committed]
+        if done:
+            latencies.append(min(done) - committed)
+    rows = [dict(latency='insert_to_score', **event_predictor.get_latency_percentiles(latencies)),
+            dict(latency='notify_to_score', **event_predictor.get_latency_percentiles(predictor.latencies))]
+    print(f"{len(arrivals)} tag-minutes replayed, {len(scorings)} scorings (debounce {debounce}s, max delay {max_delay}s):")
+    print_table(rows, ['latency', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+    print(f"For comparison a '*/15 * * * *' tick leaves a new minute waiting 7.5 min on average, up to 15 min plus the run.")
+    return {'parameters': {'tags': args.tags, 'days': args.days, 'minutes': args.minutes, 'seed': args.seed,
+                           'minute_seconds': args.minute_seconds, 'debounce': debounce, 'max_delay': max_delay},
+            'replayed_minutes': len(arrivals), 'scorings': len(scorings), 'latency': rows}
+
+
+""" ******************* Replicas sharing the tags ******************* """
+
+def _replica_entry(replica_id, dsn, models_dir, tick_times, tick_seconds, heartbeat_seconds, ttl):
+    import predict
+
+    # Forked with the parent's schemas and checkpoint directory, the output would only interleave
+    sys.stdout = open(os.devnull, 'w')
+    heartbeat = replicas.Heartbeat({'dsn': dsn}, replica_id, heartbeat_seconds)
+    heartbeat.start()
+    conn = pg.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            model_cache = predict.ModelCache(models_dir)
+            for tick_at in tick_times:
+                time.sleep(max(tick_at.timestamp() - time.time(), 0))
+                # Like the daemon, nothing starts after the next tick is due (the catch-up neither)
+                predict.run_predictions(conn, cursor, model_cache, deadline=tick_at.timestamp() + tick_seconds,
+                                        claims=replicas.TagClaims(tick_at, replica_id, ttl))
+    finally:
+        heartbeat.stop()
+        conn.close()
+
+
+def benchmark_replicas(args):
+    if not args.dsn:
+        raise SystemExit("The replicas share a throwaway database: pass --dsn or set BENCHMARK_DSN")
+    tag_names = synthetic_data.get_tag_names(args.tags)
+    held_minutes = args.ticks * args.minutes_per_tick
+    with helpers.scoring_database(args.dsn, tag_names, args.days, args.seed, held_minutes,
+                                  BENCHMARK_SCHEMA) as (conn, work_dir, held_from):
+        first_tick = pd.Timestamp.now(tz='UTC').floor('s') + pd.Timedelta(seconds=args.tick_seconds)
+        tick_times = [(first_tick + index * pd.Timedelta(seconds=args.tick_seconds)).to_pydatetime()
+                      for index in range(args.ticks)]
+        replica_ids = [f'replica-{index}' for index in range(args.replicas)]
+        # The last replica joins at --join-tick, the first one is killed during --kill-tick
+        joins = {replica_ids[-1]: args.join_tick} if args.join_tick else {}
+        context = multiprocessing.get_context('fork')
+        processes = {replica_id: context.Process(target=_replica_entry,
+                                                 args=(replica_id, args.dsn, work_dir, tick_times[joins.get(replica_id, 0):],
+                                                       args.tick_seconds, args.heartbeat_seconds, args.ttl))
+                     for replica_id in replica_ids}
+        for replica_id, process in processes.items():
+            if replica_id not in joins:
+                process.start()
+        print(f"{args.replicas} replicas, {args.tags} tags, {args.ticks} ticks of {args.minutes_per_tick} new minutes "
+              f"every {args.tick_seconds}s" + (f", {replica_ids[-1]} joins at tick {args.join_tick}" if joins else "")
+              + (f", {replica_ids[0]} killed during tick {args.kill_tick}" if args.kill_tick else ""))
+        with conn.cursor() as cursor:
+            for index, tick_at in enumerate(tick_times):
+                # The minutes of this tick land just before it
+                time.sleep(max(tick_at.timestamp() - 0.5 * args.tick_seconds - time.time(), 0))
+                cursor.execute(f"INSERT INTO {BENCHMARK_SCHEMA}.inspections SELECT * FROM {BENCHMARK_SCHEMA}.held "
+                               f"WHERE dt > %(from)s + %(index)s * %(minutes)s * interval '1 minute' "
+                               f"AND dt <= %(from)s + (%(index)s + 1) * %(minutes)s * interval '1 minute';",
+                               {'from': held_from, 'index': index, 'minutes': args.minutes_per_tick})
+                conn.commit()
+                for replica_id, join_tick in joins.items():
+                    if index == join_tick - 1:
+                        processes[replica_id].start()
+                if args.kill_tick and index == args.kill_tick:
+                    time.sleep(max(tick_at.timestamp() + args.kill_after - time.time(), 0))
+                    os.kill(processes[replica_ids[0]].pid, signal.SIGKILL)
+        for process in processes.values():
+            process.join()
+
+        with conn.cursor() as cursor:
+            load = replicas.get_replica_load(cursor, tick_times[0])
+
+    print("Per-replica load:")
+    print_table(load, ['replica_id', 'ticks', 'tags', 'unfinished', 'minutes', 'busy_s'])
+    return {'parameters': vars(args), 'load': load}
+
+
+""" ******************* Shared model store ******************* """
+
+def get_memory_mb():
+    """
+    Returns the process' RSS, PSS (shared pages divided between the processes mapping them)
+    and USS (its private pages) in MB.
+    """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss_mb': fields['Rss'], 'pss_mb': fields['Pss'],
+            'uss_mb': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def _model_store_worker(mode, models_dir, tag_names, rows, barrier, queue):
+    baseline = get_memory_mb()
+    started = time.perf_counter()
+    models = {}
+    for tag_name in tag_names:
+        model_path = os.path.join(models_dir, tag_name)
+        if mode == 'pickle':
+            with open(f'{model_path}.pkl', 'rb') as f:
+                models[tag_name] = pickle.load(f)
+        elif mode == 'npz':
+            models[tag_name] = lean_model.LeanModel(lean_model.get_artifact_path(model_path))
+        else:
+            models[tag_name] = model_store.load_artifact(model_path)
+    load_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    # Scoring reads every page of the models, which the mapped ones only fault in now
+    checksum = 0.0
+    for model in models.values():
+        X = np.random.default_rng(0).normal(size=(rows, len(model.features)))
+        checksum += float(model.decision_scores(X).sum())
+    score_ms = (time.perf_counter() - started) * 1000
+    # Measured while every worker holds its models, so PSS splits the shared pages between them
+    barrier.wait()
+    memory = get_memory_mb()
+    barrier.wait()
+    queue.put({'load_ms': load_ms, 'first_score_ms': score_ms, 'checksum': checksum,
+               **{key: memory[key] - baseline[key] for key in memory}})
+
+
+def benchmark_model_store(args):
+    rng = np.random.default_rng(args.seed)
+    tag_names = [f'TAG{index:03d}' for index in range(args.tags)]
+    features = [f'feature_{index}' for index in range(args.features)]
+    results = []
+    with tempfile.TemporaryDirectory() as models_dir:
+        for tag_name in tag_names:
+            model_path = os.path.join(models_dir, tag_name)
+            # A kernel expansion the size of an OCSVM fitted on a few months of minutes
+            lean_model.write_artifact(lean_model.get_artifact_path(model_path), features, rng.normal(size=args.features),
+                                      rng.normal(size=(args.support_vectors, args.features)),
+                                      rng.random(args.support_vectors), -1.0, 1 / args.features, 0.0)
+            # The whole model unpickled by every worker, like the .pkl pipelines
+            with open(f'{model_path}.pkl', 'wb') as f:
+                pickle.dump(lean_model.LeanModel(lean_model.get_artifact_path(model_path)), f)
+        started = time.perf_counter()
+        for tag_name in tag_names:
+            model_store.publish_artifact(os.path.join(models_dir, tag_name))
+        publish_s = time.perf_counter() - started
+        size_mb = args.tags * args.support_vectors * args.features * 8 / 2 ** 20
+        print(f"{args.tags} models of {args.support_vectors} support vectors x {args.features} features "
+              f"({size_mb:.0f} MB of support vectors), published to the store in {publish_s:.2f}s; "
+              f"{args.workers} worker processes")
+
+        context = multiprocessing.get_context('spawn')
+        checksums = {}
+        for mode in ('pickle', 'npz', 'mmap'):
+            barrier = context.Barrier(args.workers)
+            queue = context.Queue()
+            processes = [context.Process(target=_model_store_worker,
+                                         args=(mode, models_dir, tag_names, args.rows, barrier, queue))
+                         for _ in range(args.workers)]
+            for process in processes:
+                process.start()
+            workers = [queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+            checksums[mode] = workers[0]['checksum']
+            row = {'mode': mode}
+            for key in ('load_ms', 'first_score_ms', 'rss_mb', 'pss_mb', 'uss_mb'):
+                row[key] = float(np.median([worker[key] for worker in workers]))
+            # What the workers cost the machine together
+            row['total_pss_mb'] = sum(worker['pss_mb'] for worker in workers)
+            results.append(row)
+
+    print("Per worker (median), memory beyond the worker's imports:")
+    print_table(results, ['mode', 'load_ms', 'first_score_ms', 'rss_mb', 'pss_mb', 'uss_mb', 'total_pss_mb'])
+    same = len(set(checksums.values())) == 1
+    print(f"Scores identical across the modes: {same}")
+    return {'parameters': vars(args), 'modes': results, 'publish_s': publish_s, 'identical_scores': same}
+
+
+COMMANDS = {
+    'fetch': benchmark_fetch,
+    'training-data': benchmark_training_data,
+    'pipeline': benchmark_pipeline,
+    'models': benchmark_models,
+    'shared-signals': benchmark_shared_signals,
+    'window-pushdown': benchmark_window_pushdown,
+    'tick-pipeline': benchmark_tick_pipeline,
+    'events': benchmark_events,
+    'replicas': benchmark_replicas,
+    'model-store': benchmark_model_store,
+}
+
+
+def add_synthetic_arguments(subparser, tags, days):
+    """
+    Adds the --tags, --days and --seed of the synthetic data to a subcommand.
+    """
+    subparser.add_argument('--tags', type=int, default=tags)
+    subparser.add_argument('--days', type=float, default=days, help="History of the synthetic data")
+    subparser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anomaly monitor benchmarks")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help="Row-by-row vs typed columnar fetch (needs PostgreSQL)")
+    fetch_parser.add_argument('--tag', default='PIC11151A')
+    fetch_parser.add_argument('--start', default='2025-03-12 12:20:00')
+    fetch_parser.add_argument('--end', default='2025-04-01 00:00:00')
+    fetch_parser.add_argument('--repeat', type=int, default=3)
+
+    training_parser = subparsers.add_parser('training-data', help="Features of a training range, one-shot vs streamed (needs PostgreSQL)")
+    training_parser.add_argument('--tag', default='PIC11151A')
+    training_parser.add_argument('--start', default='2025-03-12 12:20:00')
+    training_parser.add_argument('--end', default='2025-04-01 00:00:00')
+    training_parser.add_argument('--batch-rows', type=int, default=data_fetch.STREAM_BATCH_ROWS)
+    training_parser.add_argument('--repeat', type=int, default=3)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="Every stage of scoring on synthetic data")
+    add_synthetic_arguments(pipeline_parser, tags=3, days=7)
+    pipeline_parser.add_argument('--repeat', type=int, default=3)
+    pipeline_parser.add_argument('--dsn', default=BENCHMARK_DSN, help="Throwaway PostgreSQL for the write stage")
+    pipeline_parser.add_argument('--trace-memory', action='store_true', help="Peak allocation per stage (slower)")
+    pipeline_parser.add_argument('--baseline', help="Results JSON of a previous run to compare with")
+
+    models_parser = subparsers.add_parser('models', help="Fit time, scoring speed and agreement of the scalable models")
+    models_parser.add_argument('--tag', default='PIC11151A')
+    models_parser.add_argument('--synthetic-days', type=float, help="Use this many days of synthetic data instead of training_data/")
+    models_parser.add_argument('--seed', type=int, default=0)
+    models_parser.add_argument('--subsample-rows', type=int, default=scalable_model.SUBSAMPLE_ROWS)
+    models_parser.add_argument('--components', type=int, default=scalable_model.NYSTROEM_COMPONENTS)
+    models_parser.add_argument('--model', help="Lean artifact (.npz) of the deployed model to compare the flags with")
+    models_parser.add_argument('--skip-exact', action='store_true', help="Don't fit the exact OCSVM (long ranges)")
+
+    shared_parser = subparsers.add_parser('shared-signals', help="Plant-wide signal features of a tick, per tag vs shared")
+    shared_parser.add_argument('--tags', type=lambda value: [int(count) for count in value.split(',')], default=[1, 4, 16, 64],
+                               help="Comma-separated tag counts")
+    shared_parser.add_argument('--days', type=float, default=1.2, help="History of the synthetic data")
+    shared_parser.add_argument('--seed', type=int, default=0)
+    shared_parser.add_argument('--repeat', type=int, default=5)
+
+    pushdown_parser = subparsers.add_parser('window-pushdown', help="Window aggregates in PostgreSQL vs the rolling kernel: latency and transfer (needs PostgreSQL)")
+    pushdown_parser.add_argument('--tag', default='PIC11151A')
+    pushdown_parser.add_argument('--start', default='2025-03-29 00:00:00')
+    pushdown_parser.add_argument('--end', default='2025-04-01 00:00:00')
+    pushdown_parser.add_argument('--synthetic-days', type=float, help="Load this many days of synthetic data into --dsn instead")
+    pushdown_parser.add_argument('--dsn', default=BENCHMARK_DSN, help="Throwaway PostgreSQL for --synthetic-days")
+    pushdown_parser.add_argument('--seed', type=int, default=0)
+    pushdown_parser.add_argument('--tick-minutes', type=int, default=15)
+    pushdown_parser.add_argument('--repeat', type=int, default=5)
+
+    tick_parser = subparsers.add_parser('tick-pipeline', help="Tick time with simulated database latency, serial vs pipelined fetch/score/write")
+    add_synthetic_arguments(tick_parser, tags=8, days=1.2)
+    tick_parser.add_argument('--tick-minutes', type=int, default=15)
+    tick_parser.add_argument('--fetch-ms', type=lambda value: [float(ms) for ms in value.split(',')], default=[20, 100, 300],
+                             help="Comma-separated simulated query latencies")
+    tick_parser.add_argument('--write-ms', type=float, default=50, help="Simulated write and commit latency")
+    tick_parser.add_argument('--depth', type=lambda value: [int(depth) for depth in value.split(',')], default=[1, 2],
+                             help="Comma-separated queue depths of the pipelined runs")
+    tick_parser.add_argument('--repeat', type=int, default=3)
+
+    events_parser = subparsers.add_parser('events', help="Insert-to-score latency of the event-driven predictor (needs PostgreSQL)")
+    events_parser.add_argument('--dsn', default=BENCHMARK_DSN, help="Throwaway PostgreSQL the minutes are replayed into")
+    add_synthetic_arguments(events_parser, tags=4, days=1)
+    events_parser.add_argument('--minutes', type=int, default=10, help="Last minutes held back and replayed")
+    events_parser.add_argument('--minute-seconds', type=float, default=3, help="Seconds between two replayed minutes")
+    events_parser.add_argument('--debounce', type=float, help="Default: EVENT_DEBOUNCE_SECONDS")
+    events_parser.add_argument('--max-delay', type=float, help="Default: EVENT_MAX_DELAY_SECONDS")
+
+    replicas_parser = subparsers.add_parser('replicas', help="Local predictor processes sharing the tags of one PostgreSQL: claims and per-replica load")
+    replicas_parser.add_argument('--dsn', default=BENCHMARK_DSN, help="Throwaway PostgreSQL shared by the replicas")
+    replicas_parser.add_argument('--replicas', type=int, default=3)
+    add_synthetic_arguments(replicas_parser, tags=12, days=1)
+    replicas_parser.add_argument('--ticks', type=int, default=8)
+    replicas_parser.add_argument('--tick-seconds', type=float, default=4)
+    replicas_parser.add_argument('--minutes-per-tick', type=int, default=5)
+    replicas_parser.add_argument('--join-tick', type=int, default=3, help="Tick the last replica joins at (0: from the start)")
+    replicas_parser.add_argument('--kill-tick', type=int, default=5, help="Tick the first replica is killed during (0: never)")
+    replicas_parser.add_argument('--kill-after', type=float, default=0.2, help="Seconds into the tick the kill happens")
+    replicas_parser.add_argument('--heartbeat-seconds', type=float, default=0.5)
+    replicas_parser.add_argument('--ttl', type=float, default=2, help="Seconds without heartbeat before a replica is dead")
+
+    store_parser = subparsers.add_parser('model-store', help="Worker processes loading the models: unpickled, .npz or memory-mapped store")
+    store_parser.add_argument('--tags', type=int, default=8)
+    store_parser.add_argument('--support-vectors', type=int, default=20000)
+    store_parser.add_argument('--features', type=int, default=60)
+    store_parser.add_argument('--workers', type=int, default=4)
+    store_parser.add_argument('--rows', type=int, default=60, help="Rows each worker scores per tag")
+    store_parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+    results = COMMANDS[args.command](args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'command': args.command, 'results': results}, f, indent=2, default=str)
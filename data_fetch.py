@@ -0,0 +1,348 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+
+# Plant-wide signals added to every tag's data
+SHARED_SIGNALS = ['II113RC001\\U']
+
+# How far back a tag without checkpoint is fetched
+RECENT_WINDOW = pd.Timedelta(hours=12)
+# How far back a tag is fetched however old its checkpoint, the minutes before are left to
+# the catch-up (predict.py) or rewind.py
+FETCH_MAX_LOOKBACK = pd.Timedelta(hours=float(os.environ.get("FETCH_MAX_LOOKBACK_HOURS") or 24))
+# Tags whose lower bounds are this close share a query, each reading at most this much more
+FETCH_GROUP_SLACK = pd.Timedelta(hours=1)
+
+# Rows per chunk (one binary COPY each) when streaming long training ranges
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", 100000))
+
+# Binary COPY layout of a (dt timestamptz, id_param_fk integer, value float8, samples bigint) row:
+# field count, then (length, value) per field, all big-endian
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_HEADER_SIZE = 19
+POSTGRES_EPOCH_NS = pd.Timestamp('2000-01-01', tz='UTC').value
+
+
+""" ******************* Parameter id resolution ******************* """
+
+class ParamResolver:
+    """
+    Caches the params table (id -> description) and re-reads it only when it changes.
+
+    Matching a tag on the cached descriptions replaces the per-query
+    "p.description like '%tag%'" join, which can't use an index.
+    """
+
+    def __init__(self):
+        self.signature = None
+        self.descriptions = {}
+
+    def refresh(self, cursor):
+        """
+        Reloads the descriptions if params changed since the last call.
+
+        Returns:
+            bool: True if the cache was (re)loaded.
+        """
+        # Row count catches deletes, max(xmin) catches inserts and updates
+        cursor.execute(f"SELECT count(*), max(id), max(xmin::text::bigint) FROM {VARIABLES_SCHEMA}.params;")
+        signature = cursor.fetchone()
+        if signature == self.signature:
+            return False
+        cursor.execute(f"SELECT id, description FROM {VARIABLES_SCHEMA}.params;")
+        self.descriptions = dict(cursor.fetchall())
+        self.signature = signature
+        print(f"Loaded {len(self.descriptions)} params")
+        return True
+
+    def get_tag_params(self, tag_name):
+        """
+        Returns the ids of the params of a tag (description containing the tag name).
+        """
+        return [param_id for param_id, description in self.descriptions.items()
+                if description and tag_name in description]
+
+    def get_shared_params(self):
+        return [param_id for param_id, description in self.descriptions.items() if description in SHARED_SIGNALS]
+
+
+""" ******************* Typed columnar fetch ******************* """
+
+def get_copy_row_dtype(value_dtype):
+    value_type = '>f4' if value_dtype == np.float32 else '>f8'
+    return np.dtype([
+        ('fields', '>i2'),
+        ('dt_length', '>i4'), ('dt', '>i8'),
+        ('id_length', '>i4'), ('id', '>i4'),
+        ('value_length', '>i4'), ('value', value_type),
+        ('samples_length', '>i4'), ('samples', '>i8'),
+    ])
+
+
+def fetch_columnar(cursor, param_ids, lower, upper, lower_inclusive=True, value_dtype=np.float64):
+    """
+    Fetches the per-minute averages of some params as typed NumPy columns.
+
+    The rows travel as binary COPY and are decoded with a fixed-width structured dtype,
+    so no Decimal, datetime or tuple object is ever created per row.
+
+    Args:
+        cursor: The database cursor.
+        param_ids: The id_param_fk to fetch.
+        lower: Lower dt bound (None for no bound).
+        upper: Upper dt bound (inclusive).
+        lower_inclusive: Whether lower itself is included.
+        value_dtype: np.float64 or np.float32 for the values.
+
+    Returns:
+        dict: 'Timestamp' (int64 ns since epoch, UTC), 'id_param_fk' (int32),
+              'Value' (value_dtype) and 'samples' (int64) arrays, sorted by time.
+    """
+    value_cast = 'float4' if value_dtype == np.float32 else 'float8'
+    lower_condition = 'TRUE' if lower is None else ('dt >= %(lower)s' if lower_inclusive else 'dt > %(lower)s')
+    query = cursor.mogrify(f"""
+        SELECT dt, id_param_fk, AVG(value)::{value_cast}, COUNT(value)
+        FROM {VARIABLES_SCHEMA}.inspections
+        WHERE id_param_fk = ANY(%(ids)s) AND value IS NOT NULL
+          AND {lower_condition} AND dt <= %(upper)s
+        GROUP BY dt, id_param_fk
+        ORDER BY dt ASC
+    """, {'ids': list(param_ids), 'lower': lower, 'upper': upper}).decode()
+
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    return decode_copy_binary(buffer.getbuffer(), value_dtype)
+
+
+def decode_copy_binary(raw, value_dtype=np.float64):
+    """
+    Decodes a binary COPY of (dt timestamptz, id_param_fk integer, value, samples bigint)
+    rows into fetch_columnar's arrays.
+
+    Args:
+        raw: The whole COPY output (header, rows and trailer).
+        value_dtype: The type the values were cast to, float8 (np.float64) or float4 (np.float32).
+
+    Raises:
+        ValueError: If the rows aren't of that layout, e.g. a NULL field (sent as a length
+                    of -1 without data), which fetch_columnar's query never returns.
+    """
+    if bytes(raw[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError("Unexpected binary COPY header")
+    extension = int.from_bytes(raw[15:COPY_HEADER_SIZE], 'big')
+    # The body is followed by a 2-byte trailer (-1)
+    body = raw[COPY_HEADER_SIZE + extension:len(raw) - 2]
+    row_dtype = get_copy_row_dtype(value_dtype)
+    if len(body) % row_dtype.itemsize:
+        raise ValueError("Binary COPY rows are not fixed-width (NULL in the result?)")
+    rows = np.frombuffer(body, dtype=row_dtype)
+    widths = {'dt_length': 8, 'id_length': 4, 'value_length': row_dtype['value'].itemsize, 'samples_length': 8}
+    if len(rows) and ((rows['fields'] != 4).any()
+                      or any((rows[field] != width).any() for field, width in widths.items())):
+        raise ValueError("Unexpected field count or width in binary COPY rows (NULL in the result?)")
+
+    return {
+        # timestamptz is sent as microseconds since 2000-01-01 UTC
+        'Timestamp': rows['dt'].astype(np.int64) * 1000 + POSTGRES_EPOCH_NS,
+        'id_param_fk': rows['id'].astype(np.int32),
+        'Value': rows['value'].astype(value_dtype),
+        'samples': rows['samples'].astype(np.int64),
+    }
+
+
+def columns_to_long_df(columns, descriptions):
+    """
+    Builds the long (Timestamp, Variable, Value) DataFrame from fetch_columnar's arrays,
+    with a categorical Variable decoded from the param ids.
+    """
+    ids, codes = np.unique(columns['id_param_fk'], return_inverse=True)
+    codes = codes.reshape(-1)
+    names = [descriptions.get(param_id) for param_id in ids]
+    if len(set(names)) == len(names):
+        variable = pd.Categorical.from_codes(codes, categories=names)
+    else:
+        # Params sharing a description, combine_duplicate_descriptions merges them
+        variable = np.array(names, dtype=object)[codes]
+    return pd.DataFrame({
+        'Timestamp': pd.to_datetime(columns['Timestamp'], utc=True),
+        'id_param_fk': columns['id_param_fk'],
+        'Variable': variable,
+        'Value': columns['Value'],
+        'samples': columns['samples'],
+    })
+
+
+def fetch_tag_range(cursor, resolver, tag_name, start_date, end_date, value_dtype=np.float64):
+    """
+    Fetches a tag's signals (and the shared ones) between two dates through the typed path.
+
+    Returns:
+        pandas.DataFrame: Long-format Timestamp, Variable, Value.
+    """
+    resolver.refresh(cursor)
+    param_ids = sorted(set(resolver.get_tag_params(tag_name)) | set(resolver.get_shared_params()))
+    columns = fetch_columnar(cursor, param_ids, pd.Timestamp(start_date), pd.Timestamp(end_date), value_dtype=value_dtype)
+    print(f"Successfully fetched {len(columns['Value'])} rows for {tag_name}.")
+    return combine_duplicate_descriptions(columns_to_long_df(columns, resolver.descriptions))
+
+
+""" ******************* Streaming fetch ******************* """
+
+def stream_tag_range(conn, resolver, tag_name, start_date, end_date, batch_rows=STREAM_BATCH_ROWS):
+    """
+    Streams a tag's signals (and the shared ones) between two dates in consecutive time chunks.
+
+    Each chunk is a fetch_columnar query of its own, decoded from binary COPY without a
+    Python object per row. A chunk spans batch_rows / (number of params) minutes, so it
+    holds about batch_rows rows at most (one per param and minute), whatever the length
+    of the range, and ends on a chunk bound: a minute is never split across chunks.
+
+    Args:
+        conn: The database connection.
+        resolver: A ParamResolver (refreshed here).
+        tag_name: The tag to fetch.
+        start_date: Lower dt bound (inclusive).
+        end_date: Upper dt bound (inclusive).
+        batch_rows: Rows per chunk at most, about.
+
+    Yields:
+        pandas.DataFrame: Long-format Timestamp, Variable, Value, in time order.
+    """
+    with conn.cursor() as cursor:
+        resolver.refresh(cursor)
+        param_ids = sorted(set(resolver.get_tag_params(tag_name)) | set(resolver.get_shared_params()))
+        span = pd.Timedelta(minutes=max(batch_rows // max(len(param_ids), 1), 1))
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+
+        fetched = 0
+        # (lower, upper] chunks, the first one including start_date
+        lower, inclusive = start_date, True
+        while True:
+            upper = min(lower + span, end_date)
+            columns = fetch_columnar(cursor, param_ids, lower, upper, lower_inclusive=inclusive)
+            fetched += len(columns['Value'])
+            if len(columns['Value']):
+                yield combine_duplicate_descriptions(columns_to_long_df(columns, resolver.descriptions))
+            if upper >= end_date:
+                break
+            lower, inclusive = upper, False
+        print(f"Successfully streamed {fetched} rows for {tag_name}.")
+
+
+""" ******************* Multi-tag fetch ******************* """
+
+def get_upper_bound(cursor):
+    """
+    Returns the newest dt in inspections, computed once per tick.
+    """
+    cursor.execute(f"SELECT max(dt) FROM {VARIABLES_SCHEMA}.inspections;")
+    return cursor.fetchone()[0]
+
+
+def get_newest_timestamp(cursor, resolver, tag_name, start_date, end_date):
+    """
+    Returns the newest dt of a tag's own signals between two dates (None without data).
+    The shared signals are left out, they move for every tag.
+    """
+    resolver.refresh(cursor)
+    cursor.execute(f"""
+        SELECT max(dt) FROM {VARIABLES_SCHEMA}.inspections
+        WHERE id_param_fk = ANY(%s) AND dt BETWEEN %s AND %s;""",
+                   (resolver.get_tag_params(tag_name), pd.Timestamp(start_date), pd.Timestamp(end_date)))
+    return cursor.fetchone()[0]
+
+
+def group_by_lower_bound(lower_by_tag, slack=FETCH_GROUP_SLACK):
+    """
+    Splits the tags into groups fetched by one query each: newest bound first, a group
+    takes every tag whose bound is within slack of its first one.
+
+    Args:
+        lower_by_tag: {tag_name: (lower bound, inclusive)}.
+
+    Returns:
+        list: [(lowest bound of the group, [tag_name])], newest group first.
+    """
+    groups = []
+    for tag_name in sorted(lower_by_tag, key=lambda tag_name: lower_by_tag[tag_name][0], reverse=True):
+        bound = lower_by_tag[tag_name][0]
+        if groups and groups[-1][0] - bound <= slack:
+            groups[-1][1].append(tag_name)
+            groups[-1][2] = bound
+        else:
+            groups.append([bound, [tag_name], bound])
+    return [(lowest, tag_names) for _, tag_names, lowest in groups]
+
+
+def fetch_tags_data(cursor, resolver, tag_names, since_by_tag=None):
+    """
+    Fetches the per-minute averages of several tags' signals in indexed queries, one per
+    group of tags with close lower bounds (group_by_lower_bound): a tag with an old
+    checkpoint doesn't make the other tags read its history.
+
+    Args:
+        cursor: The database cursor.
+        resolver: A ParamResolver (refreshed here).
+        tag_names: The tags to fetch.
+        since_by_tag: {tag_name: last processed timestamp}; tags missing from it (or
+                      with None) get the last 12 hours. No tag reaches further back than
+                      FETCH_MAX_LOOKBACK.
+
+    Returns:
+        dict: {tag_name: long-format DataFrame with Timestamp, Variable and Value},
+              with the per-minute averages as float64.
+    """
+    since_by_tag = since_by_tag or {}
+    resolver.refresh(cursor)
+    upper = get_upper_bound(cursor)
+    if upper is None:
+        return {tag_name: pd.DataFrame(columns=['Timestamp', 'Variable', 'Value']) for tag_name in tag_names}
+    upper = pd.Timestamp(upper)
+
+    lower_by_tag = {}
+    oldest = upper - FETCH_MAX_LOOKBACK
+    for tag_name in tag_names:
+        since = since_by_tag.get(tag_name)
+        # Without checkpoint: the last 12 hours, bounds included like the original between
+        lower_by_tag[tag_name] = (pd.Timestamp(since), False) if since is not None else (upper - RECENT_WINDOW, True)
+        if lower_by_tag[tag_name][0] < oldest:
+            print(f"{tag_name}: checkpoint at {since} is older than FETCH_MAX_LOOKBACK, fetching from {oldest} "
+                  f"(rescore the minutes before with rewind.py)")
+            lower_by_tag[tag_name] = (oldest, True)
+
+    params_by_tag = {tag_name: resolver.get_tag_params(tag_name) for tag_name in tag_names}
+    shared_params = resolver.get_shared_params()
+
+    datasets = {}
+    rows_fetched = 0
+    for lowest, group in group_by_lower_bound(lower_by_tag):
+        param_ids = sorted({param_id for tag_name in group for param_id in params_by_tag[tag_name]} | set(shared_params))
+        columns = fetch_columnar(cursor, param_ids, lowest, upper)
+        data = columns_to_long_df(columns, resolver.descriptions)
+        rows_fetched += len(data)
+        for tag_name in group:
+            bound, inclusive = lower_by_tag[tag_name]
+            in_range = data['Timestamp'] >= bound if inclusive else data['Timestamp'] > bound
+            rows = data[in_range & data['id_param_fk'].isin(set(params_by_tag[tag_name]) | set(shared_params))]
+            datasets[tag_name] = combine_duplicate_descriptions(rows)
+    print(f"Successfully fetched {rows_fetched} rows for {len(tag_names)} tags.")
+    return {tag_name: datasets[tag_name] for tag_name in tag_names}
+
+
+def combine_duplicate_descriptions(rows):
+    """
+    Averages params sharing a description into one Value per minute, like the
+    original query did by grouping on p.description.
+    """
+    if not rows.duplicated(['Timestamp', 'Variable']).any():
+        return rows[['Timestamp', 'Variable', 'Value']].reset_index(drop=True)
+    rows = rows.assign(total=rows['Value'].astype(np.float64) * rows['samples'])
+    grouped = rows.groupby(['Timestamp', 'Variable'], as_index=False)[['total', 'samples']].sum()
+    grouped['Value'] = grouped['total'] / grouped['samples']
+    return grouped[['Timestamp', 'Variable', 'Value']]
@@ -0,0 +1,265 @@
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+import instrumentation
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+# Recent days compared with the training window of each model (set when the model is trained)
+DRIFT_WINDOW_DAYS = float(os.environ.get("DRIFT_WINDOW_DAYS") or 3)
+# The features of a tag drifted when their median population stability index is this many
+# times the one of the training window's own stretches of DRIFT_WINDOW_DAYS...
+DRIFT_PSI_FACTOR = float(os.environ.get("DRIFT_PSI_FACTOR") or 2)
+# ...and at least this (0.1: slight shift, 0.25: significant)
+DRIFT_PSI_THRESHOLD = float(os.environ.get("DRIFT_PSI_THRESHOLD") or 0.25)
+# Rise of the anomaly rate over the training window's that means the model no longer fits
+DRIFT_RATE_DELTA = float(os.environ.get("DRIFT_RATE_DELTA") or 0.10)
+# A model younger than this is never retrained, whatever its drift
+RETRAIN_MIN_HOURS = float(os.environ.get("RETRAIN_MIN_HOURS") or 24)
+# CPU seconds a retrain is assumed to take when the model's last training didn't record it
+RETRAIN_DEFAULT_CPU_SECONDS = float(os.environ.get("RETRAIN_DEFAULT_CPU_SECONDS") or 900)
+# Every check's decisions, one JSON line per tag
+DRIFT_LOG = os.environ.get("DRIFT_LOG", os.path.join(instrumentation.METRICS_DIR, 'drift.jsonl'))
+
+# Quantile bins of each feature's training distribution
+DRIFT_BINS = 10
+# Minutes needed in the recent window to compare a feature or an anomaly rate
+DRIFT_MIN_ROWS = 240
+# Floor of the bin fractions, so an empty bin doesn't make the index infinite
+PSI_EPSILON = 1e-4
+# Training rows scored for the reference anomaly rate
+PROFILE_SCORE_ROWS = 20000
+
+
+""" ******************* Training profile ******************* """
+
+def get_bin_fractions(values, edges):
+    """
+    Returns the fraction of values in each bin of the edges (open-ended first and last
+    bins), and the fraction of missing values last.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    counts = np.bincount(np.searchsorted(edges, values[~missing], side='right'), minlength=len(edges) + 1)
+    return np.append(counts, missing.sum()) / max(len(values), 1)
+
+
+def build_profile(dftrain_filtered, scores=None, threshold=None, bins=DRIFT_BINS, window_days=DRIFT_WINDOW_DAYS):
+    """
+    Summarises the training window of a model, kept in its .train.json: the quantile
+    bins of every feature and the fraction of training rows in each (a few thousand
+    numbers per tag), and the model's anomaly rate on the window.
+
+    The rolling features of a process whose setpoint steps every few hours differ a lot
+    between any two stretches of a few days, drift or not. The median PSI of the
+    training window's own stretches of window_days ('baseline_psi') is what the recent
+    days are compared against.
+
+    Args:
+        dftrain_filtered: The training features (prep.filter_columns' output).
+        scores: The model's anomaly scores of (a sample of) the training rows, if known.
+        threshold: The model's threshold, scores above it being anomalies.
+
+    Returns:
+        dict: {'features': {feature: {'edges', 'fractions'}}, 'window_days', 'baseline_psi',
+               'threshold', 'anomaly_rate'}.
+    """
+    features = {}
+    for feature in dftrain_filtered.columns.drop('Timestamp'):
+        values = dftrain_filtered[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            continue
+        # Constant stretches give repeated quantiles, merged into one edge
+        edges = np.unique(np.quantile(present, np.linspace(0, 1, bins + 1)[1:-1]))
+        features[feature] = {'edges': edges.tolist(), 'fractions': get_bin_fractions(values, edges).round(6).tolist()}
+    profile = {'features': features, 'window_days': window_days, 'baseline_psi': None, 'threshold': threshold,
+               'anomaly_rate': None}
+    if scores is not None and threshold is not None and len(scores):
+        profile['anomaly_rate'] = float(np.mean(np.asarray(scores) > threshold))
+
+    stretch = pd.Timedelta(days=window_days)
+    timestamps = dftrain_filtered['Timestamp']
+    medians = []
+    start = timestamps.min()
+    while start + stretch <= timestamps.max():
+        part = dftrain_filtered[(timestamps >= start) & (timestamps < start + stretch)]
+        if len(part) >= DRIFT_MIN_ROWS:
+            medians.append(np.median(list(compare_features(profile, part).values())))
+        start += stretch
+    # Two stretches at least, or the training window says nothing about its own variability
+    if len(medians) >= 2:
+        profile['baseline_psi'] = float(max(medians))
+    return profile
+
+
+""" ******************* Drift measures ******************* """
+
+def get_psi(expected, actual, epsilon=PSI_EPSILON):
+    """
+    Population stability index between the bin fractions of the training window
+    (expected) and of the recent data (actual): sum((actual - expected) * ln(actual / expected)).
+    """
+    expected = np.maximum(np.asarray(expected, dtype=np.float64), epsilon)
+    actual = np.maximum(np.asarray(actual, dtype=np.float64), epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def compare_features(profile, dataset):
+    """
+    Returns the PSI of every profiled feature in the recent features (dataset), highest
+    first. A feature missing from the dataset counts as all missing.
+    """
+    psi = {}
+    for feature, reference in profile['features'].items():
+        if feature in dataset.columns:
+            values = dataset[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            values = np.full(len(dataset), np.nan)
+        psi[feature] = get_psi(reference['fractions'], get_bin_fractions(values, np.asarray(reference['edges'])))
+    return dict(sorted(psi.items(), key=lambda item: item[1], reverse=True))
+
+
+def get_anomaly_rates(cursor, tag_name, since, threshold):
+    """
+    Returns the daily anomaly rate of a tag since a time, from the scores in
+    inspections_calc: the fraction of minutes scored above the threshold.
+
+    Returns:
+        DataFrame: One row per day with 'day', 'minutes' and 'anomalies'.
+    """
+    cursor.execute(f"""
+        SELECT date_trunc('day', c.dt), count(*), count(*) FILTER (WHERE c.value > %s)
+        FROM {VARIABLES_SCHEMA}.inspections_calc c
+        JOIN {VARIABLES_SCHEMA}.params_calc p ON p.id = c.id_param_fk
+        WHERE p.description = %s AND c.dt > %s
+        GROUP BY 1 ORDER BY 1;""", (threshold, f'{tag_name}\\AS', since))
+    return pd.DataFrame(cursor.fetchall(), columns=['day', 'minutes', 'anomalies'])
+
+
+def get_rate_trend(rates):
+    """
+    Returns the change of the daily anomaly rate per day (least squares), None with fewer
+    than two days of enough minutes.
+    """
+    rates = rates[rates['minutes'] >= DRIFT_MIN_ROWS]
+    if len(rates) < 2:
+        return None
+    days = (pd.to_datetime(rates['day']) - pd.to_datetime(rates['day']).iloc[0]).dt.total_seconds() / 86400
+    return float(np.polyfit(days, rates['anomalies'] / rates['minutes'], 1)[0])
+
+
+""" ******************* Retraining decisions ******************* """
+
+def get_psi_limit(profile):
+    """
+    Returns the median feature PSI above which a tag's features drifted.
+    """
+    if profile['baseline_psi'] is None:
+        return DRIFT_PSI_THRESHOLD
+    return max(DRIFT_PSI_THRESHOLD, DRIFT_PSI_FACTOR * profile['baseline_psi'])
+
+
+def assess_drift(tag_name, info, dataset, rates, now):
+    """
+    Measures how far a tag has drifted from its model's training window: the median
+    PSI of its features (over get_psi_limit) and the rise of its anomaly rate (over
+    DRIFT_RATE_DELTA).
+
+    Args:
+        info: The model's .train.json, with its profile.
+        dataset: The tag's recent features.
+        rates: get_anomaly_rates' output since the model was trained, over the same days.
+        now: The current time, for the model's age.
+
+    Returns:
+        dict: The measures, 'severity' (1 or more: drifted) and the 'reasons' of the drift.
+    """
+    profile = info['profile']
+    assessment = {'tag': tag_name, 'trained_at': info.get('trained_at'), 'rows': len(dataset), 'psi': None,
+                  'psi_limit': get_psi_limit(profile), 'top_features': {}, 'anomaly_rate': None,
+                  'reference_rate': profile['anomaly_rate'], 'rate_trend': get_rate_trend(rates), 'severity': 0.0,
+                  'reasons': []}
+    if len(dataset) >= DRIFT_MIN_ROWS and profile['features']:
+        psi = compare_features(profile, dataset)
+        assessment['psi'] = float(np.median(list(psi.values())))
+        assessment['top_features'] = {feature: round(value, 4) for feature, value in list(psi.items())[:3]}
+        assessment['severity'] = assessment['psi'] / assessment['psi_limit']
+        if assessment['psi'] >= assessment['psi_limit']:
+            assessment['reasons'].append(f"median feature PSI {assessment['psi']:.2f} >= {assessment['psi_limit']:.2f} "
+                                         f"(most drifted: {next(iter(psi))})")
+    minutes = int(rates['minutes'].sum())
+    if minutes >= DRIFT_MIN_ROWS:
+        assessment['anomaly_rate'] = float(rates['anomalies'].sum() / minutes)
+        if profile['anomaly_rate'] is not None:
+            rise = assessment['anomaly_rate'] - profile['anomaly_rate']
+            assessment['severity'] = max(assessment['severity'], rise / DRIFT_RATE_DELTA)
+            if rise >= DRIFT_RATE_DELTA:
+                assessment['reasons'].append(f"anomaly rate {assessment['anomaly_rate']:.1%} vs "
+                                             f"{profile['anomaly_rate']:.1%} when trained")
+    trained_at = pd.Timestamp(info['trained_at'])
+    assessment['age_hours'] = (pd.Timestamp(now) - trained_at).total_seconds() / 3600
+    return assessment
+
+
+def select_retraining(assessments, budget):
+    """
+    Decides which drifted tags are retrained: the most drifted first, as long as their
+    estimated cost ('cost_s', CPU seconds) fits in what is left of the budget. Sets
+    'decision' (retrain, keep, deferred or skipped, the latter already set by the caller)
+    and the 'reason' of every assessment.
+
+    Returns:
+        list: The assessments retrained, most drifted first.
+    """
+    selected = []
+    remaining = budget
+    for assessment in sorted(assessments, key=lambda assessment: assessment.get('severity', 0), reverse=True):
+        if assessment.get('decision') == 'skipped':
+            continue
+        if not assessment['reasons']:
+            assessment['decision'] = 'keep'
+            measures = []
+            if assessment['psi'] is not None:
+                measures.append(f"median feature PSI {assessment['psi']:.2f} < {assessment['psi_limit']:.2f}")
+            else:
+                measures.append(f"{assessment['rows']} recent rows, too few to compare the features")
+            if assessment['anomaly_rate'] is not None:
+                measures.append(f"anomaly rate {assessment['anomaly_rate']:.1%}")
+            else:
+                measures.append("too few recent scores for the anomaly rate")
+            assessment['reason'] = f"no drift ({', '.join(measures)})"
+        elif assessment['age_hours'] < RETRAIN_MIN_HOURS:
+            assessment['decision'] = 'keep'
+            assessment['reason'] = (f"{'; '.join(assessment['reasons'])}, but trained {assessment['age_hours']:.0f}h ago "
+                                    f"(< {RETRAIN_MIN_HOURS:.0f}h)")
+        elif assessment['cost_s'] > remaining:
+            assessment['decision'] = 'deferred'
+            assessment['reason'] = (f"{'; '.join(assessment['reasons'])}, but its ~{assessment['cost_s']:.0f} CPU s "
+                                    f"exceed the {remaining:.0f}s left of the budget")
+        else:
+            assessment['decision'] = 'retrain'
+            assessment['reason'] = '; '.join(assessment['reasons'])
+            remaining -= assessment['cost_s']
+            selected.append(assessment)
+    return selected
+
+
+def log_decisions(assessments, path=None):
+    """
+    Prints why every tag is retrained or not, and appends the decisions to the drift log
+    (DRIFT_LOG by default).
+    """
+    path = path or DRIFT_LOG
+    checked_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    for assessment in assessments:
+        print(f"{assessment['tag']}: {assessment['decision']}, {assessment['reason']}")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        for assessment in assessments:
+            record = {key: value for key, value in assessment.items() if key != 'task'}
+            f.write(json.dumps({'checked_at': checked_at, **record}, default=str) + '\n')
@@ -1,45 +1,157 @@
+import io
+import os
+import sys
+import time
+import argparse
+import itertools
+import collections
+import numpy as np
 import pandas as pd
-import psycopg2
-from sqlalchemy import except_
-from datetime import timedelta
-
-# Create a sample dataframe (replace with your own)
-
-df = pd.read_csv("C:\\Users\\thuli\\Downloads\\chlorum_dump.csv")
-df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms') - timedelta(hours=3)
-
-# Database connection parameters
-conn_params = {
-    'host': 'localhost',
-    'database': 'postgres',
-    'user': 'postgres',
-    'password': 1234,
-    'port': 5433
-}
-
-# Connect to PostgreSQL
-conn = psycopg2.connect(**conn_params)
-cursor = conn.cursor()
-
-# Insert data row by row using cursor
-table_name = 'chlorum_dump'
-try:
-    for index, row in df.iterrows():
-        # Create the INSERT query
-        query = f"INSERT INTO public.chlorum_dump (Variable, Value, \"Timestamp\") VALUES (%s, %s, %s)"
-        values = (row['Variable'], row['Value'], row['Timestamp'])
-        
-        # Execute the query
-        cursor.execute(query, values)
-    print("Sucess")
-except Exception as e:
-    conn.rollback()
-    print("Error while inserting data!")
-    print(e)
-
-finally:
-    # Commit and close
-    conn.commit()
-    cursor.close()
-    conn.close()
+import psycopg2 as pg
+from dotenv import load_dotenv
 
+# Load environment variables from the .env file
+load_dotenv()
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST")
+POSTGRES_USER = os.environ.get("POSTGRES_USER")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+POSTGRES_DB = os.environ.get("POSTGRES_DB")
+POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+# Table the exports are loaded into, with the columns variable, value and "Timestamp"
+DUMP_TABLE = os.environ.get("DUMP_TABLE") or f'{VARIABLES_SCHEMA}.chlorum_dump'
+# The exports hold UTC milliseconds, the table the plant's local time
+DUMP_SHIFT_HOURS = float(os.environ.get("DUMP_SHIFT_HOURS") or -3)
+# Rows parsed and copied at once (bounds the memory), and rows between two commits
+DUMP_CHUNK_ROWS = int(os.environ.get("DUMP_CHUNK_ROWS") or 100000)
+DUMP_COMMIT_ROWS = int(os.environ.get("DUMP_COMMIT_ROWS") or 1000000)
+
+COLUMNS = ['Timestamp', 'Variable', 'Value']
+
+
+""" ******************* Load progress ******************* """
+
+def get_progress(cursor, source, table, size):
+    """
+    Returns the rows of the file already loaded into the table by a previous run, 0 for a
+    new file. The progress is committed with the rows, so it never counts rows rolled back.
+    """
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS {VARIABLES_SCHEMA}.anomaly_monitor_dump_progress (
+                           source text NOT NULL,
+                           target text NOT NULL,
+                           size bigint NOT NULL,
+                           rows bigint NOT NULL,
+                           updated_at timestamptz NOT NULL DEFAULT now(),
+                           PRIMARY KEY (source, target));""")
+    cursor.execute(f"""SELECT size, rows FROM {VARIABLES_SCHEMA}.anomaly_monitor_dump_progress
+                       WHERE source = %s AND target = %s;""", (source, table))
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    if row[0] != size:
+        sys.exit(f"{source} was partly loaded into {table} with a size of {row[0]} bytes, not {size}: "
+                 f"pass --restart to load it from the first row")
+    return row[1]
+
+
+def save_progress(cursor, source, table, size, rows):
+    cursor.execute(f"""
+        INSERT INTO {VARIABLES_SCHEMA}.anomaly_monitor_dump_progress (source, target, size, rows)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (source, target) DO UPDATE SET size = EXCLUDED.size, rows = EXCLUDED.rows, updated_at = now();""",
+                   (source, table, size, rows))
+
+
+""" ******************* Loading ******************* """
+
+def copy_chunk(cursor, table, chunk, shift_hours):
+    """
+    Streams a chunk of the export into the table with COPY, the milliseconds converted to
+    shifted timestamps for the whole chunk at once.
+    """
+    timestamps = pd.to_datetime(chunk['Timestamp'], unit='ms') + pd.Timedelta(hours=shift_hours)
+    # numpy formats the timestamps about twice as fast as to_csv
+    rows = pd.DataFrame({'variable': chunk['Variable'],
+                         'value': chunk['Value'],
+                         'Timestamp': np.datetime_as_string(timestamps.values, unit='ms')})
+    buffer = io.StringIO()
+    rows.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} (variable, value, "Timestamp") FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def load_csv(conn, path, table=DUMP_TABLE, shift_hours=DUMP_SHIFT_HOURS, chunk_rows=DUMP_CHUNK_ROWS,
+             commit_rows=DUMP_COMMIT_ROWS, restart=False):
+    """
+    Loads a Timestamp, Variable, Value export into the table, chunk by chunk.
+
+    Every commit_rows rows the rows and the progress are committed together: after a
+    failure, running the same load again resumes after the last commit.
+
+    Args:
+        restart: Load from the first row, ignoring a previous run (its rows stay in the table).
+
+    Returns:
+        dict: {'rows': rows loaded by this run, 'seconds', 'total': rows of the file loaded}.
+    """
+    source = os.path.basename(path)
+    size = os.path.getsize(path)
+    columns = pd.read_csv(path, nrows=0).columns
+    with conn.cursor() as cursor, open(path, newline='') as f:
+        done = 0 if restart else get_progress(cursor, source, table, size)
+        conn.commit()
+        if done:
+            print(f"Resuming {source} after the {done} rows already loaded")
+        # Skips the header and the rows loaded as lines, without parsing them (the export
+        # has no quoted line breaks) nor keeping their numbers like read_csv's skiprows
+        collections.deque(itertools.islice(f, done + 1), maxlen=0)
+        # The default float parser can be an ulp off the exported values
+        reader = pd.read_csv(f, names=columns, usecols=COLUMNS, chunksize=chunk_rows, float_precision='round_trip')
+        started = time.perf_counter()
+        loaded = 0
+        committed = 0
+        try:
+            for chunk in reader:
+                copy_chunk(cursor, table, chunk, shift_hours)
+                loaded += len(chunk)
+                if loaded - committed >= commit_rows:
+                    save_progress(cursor, source, table, size, done + loaded)
+                    conn.commit()
+                    committed = loaded
+                    seconds = time.perf_counter() - started
+                    print(f"{done + loaded} rows loaded ({loaded / seconds:.0f} rows/s)")
+            save_progress(cursor, source, table, size, done + loaded)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"Load stopped after {done + committed} committed rows, run it again to resume")
+            raise
+
+    seconds = time.perf_counter() - started
+    print(f"Loaded {loaded} rows of {source} into {table} in {seconds:.1f}s "
+          f"({loaded / seconds if seconds else 0:.0f} rows/s)")
+    return {'rows': loaded, 'seconds': seconds, 'total': done + loaded}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a Timestamp, Variable, Value CSV export into PostgreSQL")
+    parser.add_argument('path', help="CSV file with the Timestamp (UTC milliseconds), Variable and Value columns")
+    parser.add_argument('--table', default=DUMP_TABLE)
+    parser.add_argument('--shift-hours', type=float, default=DUMP_SHIFT_HOURS, help="Added to the UTC timestamps")
+    parser.add_argument('--chunk-rows', type=int, default=DUMP_CHUNK_ROWS)
+    parser.add_argument('--commit-rows', type=int, default=DUMP_COMMIT_ROWS)
+    parser.add_argument('--restart', action='store_true', help="Load from the first row, ignoring a previous run")
+    args = parser.parse_args()
+
+    db_config = {
+        'database': POSTGRES_DB,
+        'user': POSTGRES_USER,
+        'password': POSTGRES_PASSWORD,
+        'host': POSTGRES_HOST,
+        'port': POSTGRES_PORT
+    }
+    conn = pg.connect(**db_config)
+    try:
+        load_csv(conn, args.path, args.table, args.shift_hours, args.chunk_rows, args.commit_rows, args.restart)
+    finally:
+        conn.close()
@@ -3,12 +3,69 @@
 # Ensure the script exits on failure
 set -e
 
+# Bring the database schema up to date (unique score index, ...), then create or drop the
+# notify trigger on inspections to match PREDICTOR_MODE (only events mode pays its per-row cost)
+/opt/conda/bin/python3 /src/migrations.py
+
+# TRAIN_ON_START=missing (default): train only if a tag of training_manifest.json has no model yet,
+# without importing pycaret nor querying the database otherwise. 1: also retrain the models older
+# than their data (a freshness query per tag on every start). 0: never, left to DRIFT_RETRAIN.
+# A failed tag keeps its previous model
+TRAIN_ON_START="${TRAIN_ON_START:-missing}"
+if [ "$TRAIN_ON_START" = "missing" ]; then
+  MISSING=$(/opt/conda/bin/python3 -c "
+import json, os
+tags = [entry['tag'] for entry in json.load(open(os.environ.get('TRAIN_MANIFEST', '/src/training_manifest.json')))['tags']]
+print(' '.join(tag for tag in tags if not any(os.path.exists(f'/src/models/{tag}{ext}') for ext in ('.pkl', '.npz'))))")
+  if [ -n "$MISSING" ]; then
+    /opt/conda/bin/python3 /src/train.py --tags $MISSING || echo "Some tags failed to train, see the output above"
+  fi
+elif [ "$TRAIN_ON_START" = "1" ]; then
+  /opt/conda/bin/python3 /src/train.py || echo "Some tags failed to train, see the output above"
+fi
+
+# Models trained before the lean artifact existed: export it once, so scoring doesn't import pycaret.
+# The artifact is only written if it scores like the .pkl; otherwise the .pkl keeps being used.
+# A failed export records the .pkl's mtime in <tag>.lean_failed and isn't retried until the .pkl changes
+for model in /src/models/*.pkl; do
+  [ -e "$model" ] || continue
+  [ -f "${model%.pkl}.npz" ] && continue
+  failed="${model%.pkl}.lean_failed"
+  mtime=$(stat -c %Y "$model")
+  if [ -f "$failed" ] && [ "$(cat "$failed")" = "$mtime" ]; then
+    echo "No verified lean artifact for ${model} (export failed before, the .pkl hasn't changed), it is scored from the .pkl"
+    continue
+  fi
+  if /opt/conda/bin/python3 /src/lean_model.py "${model%.pkl}"; then
+    rm -f "$failed"
+  else
+    echo "$mtime" > "$failed"
+    echo "No verified lean artifact for ${model}, it is scored from the .pkl"
+  fi
+done
+
+# Drift retraining in the background: retrains only the tags that drifted, within a CPU budget,
+# and logs why each tag was or wasn't retrained (metrics/drift.jsonl)
+if [ "${DRIFT_RETRAIN:-0}" = "1" ]; then
+  /opt/conda/bin/python3 -u /src/train.py --drift --daemon &
+fi
+
+# Event mode: scores a tag seconds after its new inspections land (LISTEN/NOTIFY, the
+# trigger is created by migrations.py in this mode and dropped in the others)
+if [ "${PREDICTOR_MODE:-daemon}" = "events" ]; then
+  exec /opt/conda/bin/python3 -u /src/event_predictor.py
+fi
+
+# Daemon mode (default): one long-running predictor that keeps the models loaded and
+# schedules itself from CRON_INTERVAL. PREDICTOR_MODE=cron keeps the old cron setup.
+if [ "${PREDICTOR_MODE:-daemon}" = "daemon" ]; then
+  # exec so the predictor receives docker's SIGTERM directly
+  exec /opt/conda/bin/python3 -u /src/predict.py --daemon
+fi
+
 # Start the cron service
 service cron start
 
-# Check if the model file exists; if not, train the model
-[ -f /src/models/PIC11151A.pkl ] || python3 /src/train.py
-
 # Remove all existing cron jobs to avoid duplicates
 crontab -r 2>/dev/null || true
 
@@ -0,0 +1,255 @@
+import os
+import select
+import signal
+import time
+import datetime
+import threading
+import collections
+import numpy as np
+import psycopg2 as pg
+import psycopg2.extensions
+from dotenv import load_dotenv
+import data_fetch
+import instrumentation
+import migrations
+import predict
+import score_writer
+
+# Load environment variables from the .env file
+load_dotenv()
+# A tag is scored once its signals have been quiet this long (the rows of a minute arrive in bursts)...
+EVENT_DEBOUNCE_SECONDS = float(os.environ.get("EVENT_DEBOUNCE_SECONDS") or 2)
+# ...or once its first notification has waited this long, when they keep coming
+EVENT_MAX_DELAY_SECONDS = float(os.environ.get("EVENT_MAX_DELAY_SECONDS") or 10)
+# How often the event-to-score latency percentiles are printed
+EVENT_REPORT_SECONDS = float(os.environ.get("EVENT_REPORT_SECONDS") or 300)
+
+
+""" ******************* Debouncing ******************* """
+
+class TagDebouncer:
+    """
+    Coalesces the notifications of each tag into one scoring.
+
+    A tag is due once no notification came for debounce seconds, or max_delay seconds
+    after its first one, whichever comes first.
+    """
+
+    def __init__(self, debounce=EVENT_DEBOUNCE_SECONDS, max_delay=EVENT_MAX_DELAY_SECONDS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # {tag_name: [first notification, last notification]}
+        self.pending = {}
+
+    def add(self, tag_name, now):
+        if tag_name in self.pending:
+            self.pending[tag_name][1] = now
+        else:
+            self.pending[tag_name] = [now, now]
+
+    def get_due_time(self, tag_name):
+        first, last = self.pending[tag_name]
+        return min(last + self.debounce, first + self.max_delay)
+
+    def pop_due(self, now):
+        """
+        Removes and returns the due tags.
+
+        Returns:
+            list: [(tag_name, time of its first notification)], the longest waiting first.
+        """
+        due = sorted((first, tag_name) for tag_name, (first, _) in self.pending.items()
+                     if self.get_due_time(tag_name) <= now)
+        for _, tag_name in due:
+            del self.pending[tag_name]
+        return [(tag_name, first) for first, tag_name in due]
+
+    def seconds_until_due(self, now):
+        """
+        Returns how long until the next tag is due, None when nothing is pending.
+        """
+        if not self.pending:
+            return None
+        return max(min(self.get_due_time(tag_name) for tag_name in self.pending) - now, 0)
+
+
+def get_latency_percentiles(latencies):
+    """
+    Returns the p50/p95/p99/max of latencies in seconds, in milliseconds.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if len(latencies) == 0:
+        return {}
+    return {'count': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p95_ms': float(np.percentile(latencies, 95) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'max_ms': float(latencies.max() * 1000)}
+
+
+""" ******************* Event-driven predictor ******************* """
+
+class EventPredictor:
+    """
+    Scores a tag seconds after new inspections of its signals land, instead of on the next
+    CRON_INTERVAL tick: LISTENs on the channel of migrations' notify trigger, maps the
+    notified params to the anomaly tags and debounces them per tag.
+
+    The shared plant-wide signals notify too but don't trigger any tag, like
+    data_fetch.get_newest_timestamp leaves them out.
+    """
+
+    def __init__(self, db_config, debounce=EVENT_DEBOUNCE_SECONDS, max_delay=EVENT_MAX_DELAY_SECONDS,
+                 on_scored=None):
+        """
+        Args:
+            on_scored: Optional callback(tag_name, first_notification, scored_at, result) after
+                       every scoring, with time.time() timestamps.
+        """
+        self.db_config = db_config
+        self.debouncer = TagDebouncer(debounce, max_delay)
+        self.on_scored = on_scored
+        self.model_cache = predict.ModelCache()
+        self.resolver = data_fetch.ParamResolver()
+        self.stop_event = threading.Event()
+        # Set once listening and caught up by the first sweep
+        self.ready = threading.Event()
+        # {tag_name: tag_anomaly_id} and {param id: [tag_name]}
+        self.tags = {}
+        self.params_to_tags = {}
+        self.latencies = collections.deque(maxlen=10000)
+        self.last_report = time.time()
+
+    def request_stop(self, signum, frame):
+        print(f"Received signal {signum}, stopping after the current tag...")
+        self.stop_event.set()
+
+    def refresh_tags(self, cursor):
+        """
+        Reloads the anomaly tags and the params notifying them when params_calc or params changed.
+        """
+        tags = {tag_name.split("\\")[0]: tag_anomaly_id for tag_anomaly_id, tag_name in predict.get_anomaly_tags(cursor)}
+        params_changed = self.resolver.refresh(cursor)
+        cursor.connection.commit()
+        if tags == self.tags and not params_changed:
+            return
+        self.tags = tags
+        self.params_to_tags = {}
+        for tag_name in tags:
+            for param_id in self.resolver.get_tag_params(tag_name):
+                self.params_to_tags.setdefault(param_id, []).append(tag_name)
+        print(f"Watching {len(self.params_to_tags)} params of {len(tags)} tags")
+
+    def read_notifications(self, listen_conn, timeout):
+        """
+        Waits up to timeout seconds for notifications and queues their tags in the debouncer.
+        """
+        if select.select([listen_conn], [], [], timeout) == ([], [], []):
+            return
+        listen_conn.poll()
+        now = time.time()
+        for notify in listen_conn.notifies:
+            try:
+                param_id = int(notify.payload)
+            except ValueError:
+                continue
+            # Params of new tags are only known after the next refresh_tags
+            for tag_name in self.params_to_tags.get(param_id, []):
+                self.debouncer.add(tag_name, now)
+        listen_conn.notifies.clear()
+
+    def score_due(self, conn, cursor):
+        """
+        Scores the tags whose notifications are due, recording their event-to-score latency:
+        from the first notification of the batch to the scores committed.
+        """
+        due = self.debouncer.pop_due(time.time())
+        if not due:
+            return
+        run = instrumentation.start_run('events')
+        try:
+            self.refresh_tags(cursor)
+            for tag_name, first in due:
+                if self.stop_event.is_set():
+                    break
+                if tag_name not in self.tags:
+                    continue
+                result = predict.score_tag_isolated(conn, cursor, self.tags[tag_name], tag_name, self.model_cache,
+                                                    resolver=self.resolver)
+                scored_at = time.time()
+                if result[0] == 'ok':
+                    self.latencies.append(scored_at - first)
+                    run.record('event_to_score', datetime.datetime.fromtimestamp(first, datetime.timezone.utc),
+                               scored_at - first, result[1], tag=tag_name)
+                if self.on_scored is not None:
+                    self.on_scored(tag_name, first, scored_at, result)
+        finally:
+            instrumentation.finish_run(None if conn.closed else conn)
+
+    def report(self):
+        percentiles = get_latency_percentiles(self.latencies)
+        if percentiles:
+            print(f"Event-to-score latency over the last {percentiles['count']} scorings: "
+                  f"p50 {percentiles['p50_ms']:.0f} ms, p95 {percentiles['p95_ms']:.0f} ms, "
+                  f"p99 {percentiles['p99_ms']:.0f} ms, max {percentiles['max_ms']:.0f} ms")
+        self.last_report = time.time()
+        return percentiles
+
+    def sweep(self, conn, cursor):
+        """
+        Scores every tag once, catching up on what was inserted while nobody listened.
+        """
+        instrumentation.start_run('events')
+        try:
+            self.refresh_tags(cursor)
+            predict.run_predictions(conn, cursor, self.model_cache, stop_event=self.stop_event,
+                                    resolver=self.resolver)
+        finally:
+            instrumentation.finish_run(None if conn.closed else conn)
+
+    def run_once(self):
+        """
+        Listens and scores until a stop is requested or a connection is lost.
+        """
+        listen_conn = pg.connect(**self.db_config)
+        conn = None
+        try:
+            listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with listen_conn.cursor() as listen_cursor:
+                listen_cursor.execute(f"LISTEN {migrations.NOTIFY_CHANNEL};")
+            conn = pg.connect(**self.db_config)
+            score_writer.prepare_statements(conn)
+            with conn.cursor() as cursor:
+                # Listening already: nothing inserted during the sweep is missed
+                self.sweep(conn, cursor)
+                self.ready.set()
+                while not self.stop_event.is_set():
+                    wait = self.debouncer.seconds_until_due(time.time())
+                    # Wake up at least every second to honour stop requests
+                    self.read_notifications(listen_conn, 1.0 if wait is None else min(wait, 1.0))
+                    self.score_due(conn, cursor)
+                    if time.time() - self.last_report >= EVENT_REPORT_SECONDS:
+                        self.report()
+        finally:
+            for connection in (conn, listen_conn):
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        print(f"Event-driven predictor listening on {migrations.NOTIFY_CHANNEL} "
+              f"(debounce {self.debouncer.debounce}s, max delay {self.debouncer.max_delay}s)")
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except (pg.OperationalError, pg.InterfaceError) as e:
+                # Notifications sent while disconnected are lost, the sweep after reconnecting catches up
+                print(f"Database connection lost: {e}, reconnecting in 5s")
+                self.stop_event.wait(5)
+        self.report()
+        print("PostgreSQL connections closed.")
+
+
+if __name__ == "__main__":
+    EventPredictor(predict.get_db_config()).run()
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import cProfile
+import resource
+import datetime
+import threading
+import contextlib
+import tracemalloc
+import psycopg2.extras
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+# Append-only JSON lines, one per stage run
+METRICS_FILE = os.environ.get("METRICS_FILE", os.path.join(METRICS_DIR, 'stages.jsonl'))
+# Also insert the records into anomaly_monitor_metrics (created by migrations.py)
+METRICS_DB = os.environ.get("METRICS_DB", "0") == "1"
+# Dump a cProfile and the tracemalloc allocations of the slowest tag of each run (only the
+# tags scored in the process calling finish_run, i.e. not those of worker processes)
+PROFILE_SLOWEST_TAG = os.environ.get("PROFILE_SLOWEST_TAG", "0") == "1"
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+""" ******************* Run metrics ******************* """
+
+class RunMetrics:
+    """
+    The stage records of one predict/train/rewind run in this process.
+
+    Every record is appended to METRICS_FILE as soon as its stage ends, so a crashed run
+    still leaves its timings behind.
+    """
+
+    def __init__(self, script, run_id=None):
+        self.script = script
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.run_id = run_id or f'{script}-{self.started_at:%Y%m%dT%H%M%S}-{os.getpid()}'
+        # Per thread: the stages of a pipelined tick (tick_pipeline) run different tags at once
+        self.local = threading.local()
+        self.pending = []
+        self.slowest = None
+        # One tag profiled at a time: tracemalloc traces the whole process, so the
+        # allocations of tags run concurrently on other threads would be mixed in
+        self.profiling = threading.Lock()
+        # Traced from the start to the end of the run, not per tag: starting and stopping
+        # it around each tag would cut off the tags of the other threads
+        self.tracing = PROFILE_SLOWEST_TAG and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    @property
+    def current_tag(self):
+        return getattr(self.local, 'tag', None)
+
+    @current_tag.setter
+    def current_tag(self, tag_name):
+        self.local.tag = tag_name
+
+    def record(self, stage, started_at, seconds, rows=None, rss_before=None, tag=None):
+        peak_rss = get_peak_rss_mb()
+        entry = {
+            'run_id': self.run_id,
+            'script': self.script,
+            'pid': os.getpid(),
+            'tag': tag if tag is not None else self.current_tag,
+            'stage': stage,
+            'started_at': started_at.isoformat(),
+            'seconds': seconds,
+            'rows': rows,
+            'peak_rss_mb': peak_rss,
+            'rss_growth_mb': peak_rss - rss_before if rss_before is not None else None,
+        }
+        self.pending.append(entry)
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        with open(METRICS_FILE, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry
+
+    @contextlib.contextmanager
+    def stage(self, stage, rows=None):
+        """
+        Times a stage. The yielded dict takes the row count when it's only known at the end
+        (details['rows'] = len(df)).
+        """
+        details = {'rows': rows}
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        rss_before = get_peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            yield details
+        finally:
+            self.record(stage, started_at, time.perf_counter() - started, details['rows'], rss_before)
+
+    @contextlib.contextmanager
+    def tag(self, tag_name):
+        """
+        Attributes the stages run inside to tag_name and records the tag's total time.
+        With PROFILE_SLOWEST_TAG, the tag is profiled unless another thread is profiling one.
+        """
+        profiler = None
+        if PROFILE_SLOWEST_TAG and tracemalloc.is_tracing() and self.profiling.acquire(blocking=False):
+            before = tracemalloc.take_snapshot()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self.current_tag = tag_name
+        started = time.perf_counter()
+        try:
+            with self.stage('tag_total') as details:
+                yield details
+        finally:
+            seconds = time.perf_counter() - started
+            self.current_tag = None
+            if profiler is not None:
+                profiler.disable()
+                # What the tag allocated and still holds
+                allocations = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+                self.profiling.release()
+                if self.slowest is None or seconds > self.slowest[1]:
+                    self.slowest = (tag_name, seconds, profiler, allocations)
+
+    @contextlib.contextmanager
+    def attribute(self, tag_name):
+        """
+        Attributes the stages this thread runs inside to tag_name, without the tag's total
+        (the steps of a pipelined tag run on several threads).
+        """
+        previous = self.current_tag
+        self.current_tag = tag_name
+        try:
+            yield
+        finally:
+            self.current_tag = previous
+
+    def flush(self, conn=None):
+        """
+        Inserts the records not yet stored into anomaly_monitor_metrics (when METRICS_DB is on).
+        """
+        if not (METRICS_DB and conn is not None and self.pending):
+            self.pending = []
+            return
+        rows = [(entry['run_id'], entry['script'], entry['tag'], entry['stage'], entry['started_at'],
+                 entry['seconds'], entry['rows'], entry['peak_rss_mb']) for entry in self.pending]
+        try:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(cursor, f"""
+                    INSERT INTO {VARIABLES_SCHEMA}.anomaly_monitor_metrics
+                        (run_id, script, tag, stage, started_at, seconds, rows, peak_rss_mb)
+                    VALUES %s;""", rows)
+            conn.commit()
+            self.pending = []
+        except Exception as e:
+            # Metrics never fail a run
+            print(f"Could not store the metrics: {e}")
+            conn.rollback()
+
+    def dump_slowest_profile(self):
+        if self.slowest is None:
+            return None
+        tag_name, seconds, profiler, allocations = self.slowest
+        profile_dir = os.path.join(METRICS_DIR, 'profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        base = os.path.join(profile_dir, f'{self.run_id}-{tag_name}')
+        profiler.dump_stats(f'{base}.prof')
+        with open(f'{base}.tracemalloc.txt', 'w') as f:
+            f.write(f"{tag_name}: {seconds:.3f}s, top allocations\n")
+            for statistic in allocations[:30]:
+                f.write(f"{statistic}\n")
+        print(f"Profile of the slowest tag ({tag_name}, {seconds:.2f}s) written to {base}.prof")
+        return base
+
+
+""" ******************* Current run ******************* """
+
+# The run of this process, set by start_run; the helpers below are no-ops without one
+_current_run = None
+
+
+def start_run(script, run_id=None):
+    global _current_run
+    previous = _current_run
+    _current_run = RunMetrics(script, run_id)
+    # A run replaced without finish_run (worker processes) hands its tracing over
+    if previous is not None and previous.tracing:
+        _current_run.tracing = True
+    return _current_run
+
+
+def get_run():
+    return _current_run
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    if _current_run is None:
+        yield {'rows': rows}
+    else:
+        with _current_run.stage(name, rows) as details:
+            yield details
+
+
+@contextlib.contextmanager
+def tag(tag_name):
+    if _current_run is None:
+        yield {}
+    else:
+        with _current_run.tag(tag_name) as details:
+            yield details
+
+
+@contextlib.contextmanager
+def attribute(tag_name):
+    if _current_run is None:
+        yield
+    else:
+        with _current_run.attribute(tag_name):
+            yield
+
+
+def flush(conn=None):
+    if _current_run is not None:
+        _current_run.flush(conn)
+
+
+def finish_run(conn=None):
+    """
+    Stores the remaining records, records the run's total time and dumps the slowest tag's profile.
+    """
+    global _current_run
+    run = _current_run
+    if run is None:
+        return
+    seconds = (datetime.datetime.now(datetime.timezone.utc) - run.started_at).total_seconds()
+    run.record('run_total', run.started_at, seconds)
+    run.flush(conn)
+    if run.tracing:
+        tracemalloc.stop()
+    run.dump_slowest_profile()
+    _current_run = None
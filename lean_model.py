@@ -0,0 +1,265 @@
+import os
+import numpy as np
+
+# Bumped whenever the layout of the .npz artifact changes
+ARTIFACT_VERSION = 1
+# Rows scored per kernel block, bounds the (rows x support vectors) matrix
+SCORE_BLOCK_ROWS = 256
+
+
+""" ******************* Export of a trained pipeline ******************* """
+
+def get_artifact_path(model_path):
+    return f'{model_path}.npz'
+
+
+def export_artifact(pipeline, path):
+    """
+    Writes the minimal scoring artifact of a pycaret anomaly pipeline (as returned by
+    pycaret.anomaly.load_model): imputer statistics, the OCSVM's support vectors,
+    dual coefficients, intercept and gamma, the pyod threshold and the ordered features.
+
+    Only the steps used at predict time are exported; train-only steps (remove_outliers)
+    are skipped. Any other step raises ValueError, rather than exporting an artifact that
+    would not score like the pipeline.
+
+    Args:
+        pipeline: The fitted pycaret Pipeline ending with a pyod OCSVM.
+        path: The .npz file to write.
+    """
+    features = list(pipeline._feature_names_in)
+    fill_values = np.full(len(features), np.nan)
+    kept = np.ones(len(features), dtype=bool)
+    *transformers, (_, model) = pipeline.steps
+
+    for name, step in transformers:
+        if step._train_only:
+            continue
+        transformer = step.transformer
+        if type(transformer).__name__ != 'SimpleImputer':
+            raise ValueError(f"Step '{name}' ({type(transformer).__name__}) is not supported by the lean artifact")
+        if not step._include:
+            continue
+        if transformer.strategy not in ('mean', 'median', 'constant'):
+            raise ValueError(f"Imputer '{name}' uses strategy '{transformer.strategy}', not supported")
+        positions = [features.index(column) for column in step._include]
+        statistics = np.asarray(transformer.statistics_, dtype=np.float64)
+        fill_values[positions] = statistics
+        # SimpleImputer drops the columns that were empty when fitted
+        if not getattr(transformer, 'keep_empty_features', False):
+            kept[positions] = ~np.isnan(statistics)
+
+    detector = getattr(model, 'detector_', None)
+    if type(detector).__name__ != 'OneClassSVM' or detector.kernel != 'rbf':
+        raise ValueError(f"Model {type(model).__name__} is not an rbf one-class SVM")
+    if detector.support_vectors_.shape[1] != kept.sum():
+        raise ValueError(f"The model expects {detector.support_vectors_.shape[1]} features, the pipeline gives {kept.sum()}")
+
+    save_artifact(path, [feature for feature, keep in zip(features, kept) if keep], fill_values[kept], detector,
+                  model.threshold_)
+
+
+def save_artifact(path, features, fill_values, detector, threshold):
+    """
+    Writes the artifact of a fitted sklearn OneClassSVM (rbf) scoring the given features.
+
+    Args:
+        path: The .npz file to write.
+        features: The ordered feature names.
+        fill_values: The value replacing a missing feature (NaN: none).
+        detector: The fitted OneClassSVM.
+        threshold: Scores above it are labelled anomalies.
+    """
+    write_artifact(path, features, fill_values, detector.support_vectors_, np.ravel(detector.dual_coef_),
+                   detector.intercept_[0], detector._gamma, threshold)
+
+
+def write_artifact(path, features, fill_values, support_vectors, dual_coef, intercept, gamma, threshold):
+    """
+    Writes an artifact scoring -(sum_i dual_coef_i * exp(-gamma * |x - sv_i|^2) + intercept),
+    whatever model the kernel expansion comes from.
+    """
+    support_vectors = np.asarray(support_vectors, dtype=np.float64)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            version=np.int64(ARTIFACT_VERSION),
+            features=np.array(features),
+            fill_values=np.asarray(fill_values, dtype=np.float64),
+            support_vectors=support_vectors,
+            dual_coef=np.asarray(dual_coef, dtype=np.float64).reshape(-1),
+            intercept=np.float64(intercept),
+            gamma=np.float64(gamma),
+            threshold=np.float64(threshold),
+        )
+    os.replace(tmp_path, path)
+    print(f"Lean artifact written to {path} ({len(support_vectors)} support vectors)")
+
+
+def verify_artifact(path, data, expected_scores, tolerance=1e-6):
+    """
+    Checks that the artifact scores data like the pipeline did (expected_scores, e.g.
+    predict_model's Anomaly_Score). A mismatching artifact is removed, so predict.py
+    falls back to the pipeline.
+
+    Returns:
+        bool: True if every score is within tolerance.
+    """
+    scores = LeanModel(path).predict(data)['Anomaly_Score'].to_numpy()
+    difference = np.max(np.abs(scores - np.asarray(expected_scores, dtype=np.float64)), initial=0)
+    if not difference <= tolerance:
+        print(f"Lean artifact {path} differs from the pipeline by {difference}, removing it")
+        os.remove(path)
+        return False
+    print(f"Lean artifact {path} matches the pipeline (max difference {difference:.2e})")
+    return True
+
+
+def get_verification_sample(path, input_features, rows=256, seed=0):
+    """
+    Builds data to check an artifact against its pipeline when the training data isn't at
+    hand (models trained before the artifact existed): points scattered around the support
+    vectors, where the score varies the most, with a tenth of the imputed values missing.
+
+    Args:
+        path: The artifact's .npz file.
+        input_features: The pipeline's input features (pipeline._feature_names_in); those the
+                        artifact doesn't score were dropped by the imputer and are left empty.
+        rows: The number of rows.
+        seed: The random seed.
+
+    Returns:
+        pd.DataFrame: The sample, with the pipeline's input features as columns.
+    """
+    import pandas as pd
+
+    model = LeanModel(path)
+    rng = np.random.default_rng(seed)
+    support_vectors = model.support_vectors + model.center
+    picks = support_vectors[rng.integers(0, len(support_vectors), rows)]
+    spread = support_vectors.std(axis=0) if len(support_vectors) > 1 else np.abs(model.center)
+    values = picks + rng.normal(0, 0.5, picks.shape) * np.where(spread > 0, spread, 1.0)
+    imputed = ~np.isnan(model.fill_values)
+    values[(rng.random(values.shape) < 0.1) & imputed] = np.nan
+
+    sample = pd.DataFrame(np.nan, index=range(rows), columns=list(input_features))
+    sample[model.features] = values
+    return sample
+
+
+""" ******************* NumPy-only scoring ******************* """
+
+class LeanModel:
+    """
+    Scores like predict_model on a pycaret OCSVM pipeline, with NumPy only:
+
+        Anomaly_Score = -(sum_i dual_coef_i * exp(-gamma * |x - sv_i|^2) + intercept)
+        Anomaly = Anomaly_Score > threshold
+    """
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as artifact:
+            if int(artifact['version']) != ARTIFACT_VERSION:
+                raise ValueError(f"{path} has artifact version {int(artifact['version'])}, expected {ARTIFACT_VERSION}")
+            self.set_parameters([str(feature) for feature in artifact['features']], artifact['fill_values'],
+                                artifact['support_vectors'], artifact['dual_coef'], float(artifact['intercept']),
+                                float(artifact['gamma']), float(artifact['threshold']))
+
+    @classmethod
+    def from_arrays(cls, features, fill_values, support_vectors, dual_coef, intercept, gamma, threshold):
+        """
+        A model scoring like the artifact write_artifact would write, without the file.
+        """
+        model = cls.__new__(cls)
+        model.set_parameters(list(features), np.asarray(fill_values, dtype=np.float64),
+                             np.asarray(support_vectors, dtype=np.float64),
+                             np.asarray(dual_coef, dtype=np.float64).reshape(-1), float(intercept), float(gamma),
+                             float(threshold))
+        return model
+
+    @classmethod
+    def from_centered(cls, features, fill_values, center, support_vectors, support_norms, dual_coef, intercept, gamma,
+                      threshold):
+        """
+        A model from the arrays of another one (model_store), support vectors already
+        centred. The arrays are used as they are, so memory-mapped ones stay shared.
+        """
+        model = cls.__new__(cls)
+        model.set_centered_parameters(list(features), fill_values, center, support_vectors, support_norms, dual_coef,
+                                      float(intercept), float(gamma), float(threshold))
+        return model
+
+    def set_parameters(self, features, fill_values, support_vectors, dual_coef, intercept, gamma, threshold):
+        # Distances are computed around the support vectors' centre, which keeps the
+        # |x|^2 + |sv|^2 - 2 x.sv expansion accurate for large feature values
+        center = support_vectors.mean(axis=0)
+        support_vectors = support_vectors - center
+        self.set_centered_parameters(features, fill_values, center, support_vectors,
+                                     np.einsum('ij,ij->i', support_vectors, support_vectors), dual_coef, intercept,
+                                     gamma, threshold)
+
+    def set_centered_parameters(self, features, fill_values, center, support_vectors, support_norms, dual_coef,
+                                intercept, gamma, threshold):
+        self.features = features
+        self.fill_values = fill_values
+        self.center = center
+        self.support_vectors = support_vectors
+        self.support_norms = support_norms
+        self.dual_coef = dual_coef
+        self.intercept = intercept
+        self.gamma = gamma
+        self.threshold = threshold
+
+    def decision_scores(self, X):
+        """
+        Returns the anomaly score of each row of the (rows x features) array X.
+        """
+        X = np.where(np.isnan(X), self.fill_values, X) - self.center
+        scores = np.empty(len(X))
+        for start in range(0, len(X), SCORE_BLOCK_ROWS):
+            block = X[start:start + SCORE_BLOCK_ROWS]
+            distances = np.einsum('ij,ij->i', block, block)[:, None] + self.support_norms - 2 * block @ self.support_vectors.T
+            np.maximum(distances, 0, out=distances)
+            kernel = np.exp(-self.gamma * distances, out=distances)
+            scores[start:start + SCORE_BLOCK_ROWS] = -(kernel @ self.dual_coef + self.intercept)
+        return scores
+
+    def predict(self, data):
+        """
+        Same output as predict_model(model, data): the data with 'Anomaly' and 'Anomaly_Score' added.
+        """
+        missing = [feature for feature in self.features if feature not in data.columns]
+        if missing:
+            raise ValueError(f"Missing features: {', '.join(missing)}")
+        scores = self.decision_scores(data[self.features].to_numpy(dtype=np.float64, na_value=np.nan))
+        predictions = data.copy()
+        predictions['Anomaly'] = (scores > self.threshold).astype(np.int64)
+        predictions['Anomaly_Score'] = scores
+        return predictions
+
+
+if __name__ == "__main__":
+    import sys
+    from pycaret.anomaly import load_model, predict_model
+
+    # Exports the artifact of already trained models: python lean_model.py models/PIC11151A ...
+    # An artifact is kept only if it scores like the pipeline, otherwise the .pkl stays in use
+    failed = []
+    for model_path in sys.argv[1:]:
+        pipeline = load_model(model_path)
+        tmp_path = get_artifact_path(f'{model_path}.unverified')
+        try:
+            export_artifact(pipeline, tmp_path)
+            sample = get_verification_sample(tmp_path, pipeline._feature_names_in)
+            if verify_artifact(tmp_path, sample, predict_model(pipeline, data=sample)['Anomaly_Score']):
+                os.replace(tmp_path, get_artifact_path(model_path))
+            else:
+                failed.append(model_path)
+        except ValueError as e:
+            print(f"Can't export the lean artifact of {model_path}: {e}")
+            failed.append(model_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import numpy as np
+from dotenv import load_dotenv
+import lean_model
+
+# Load environment variables from the .env file
+load_dotenv()
+# Score the lean artifacts from read-only memory-mapped copies of their arrays, whose pages
+# the worker processes share through the page cache instead of each loading its own
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "1") == "1"
+# Versions kept per tag: a process may still be mapping the previous one
+STORE_KEEP_VERSIONS = 2
+
+# The arrays of a LeanModel, one .npy file each, as scored (support vectors centred)
+ARRAYS = ('fill_values', 'center', 'support_vectors', 'support_norms', 'dual_coef')
+
+
+""" ******************* Versioned store ******************* """
+
+def get_store_dir(model_path):
+    return f'{model_path}.store'
+
+
+def get_version(artifact_path):
+    """
+    Returns the version an artifact is published as, from its modification time: a
+    retrained artifact (moved in place by train.py) gets a new one.
+    """
+    return f'v{os.stat(artifact_path).st_mtime_ns}'
+
+
+def get_versions(store_dir):
+    """
+    Returns the published versions of a store, oldest first.
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted((name for name in os.listdir(store_dir) if name.startswith('v') and name[1:].isdigit()),
+                  key=lambda name: int(name[1:]))
+
+
+def publish(model_path, model, version):
+    """
+    Writes the arrays of a LeanModel under <model_path>.store/<version>, the directory
+    being renamed into place once complete, so a reader sees a version whole or not at all.
+
+    Returns:
+        str: The version's directory.
+    """
+    store_dir = get_store_dir(model_path)
+    version_dir = os.path.join(store_dir, version)
+    if os.path.isdir(version_dir):
+        return version_dir
+    tmp_dir = os.path.join(store_dir, f'.{version}.{os.getpid()}.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(getattr(model, name)))
+        with open(os.path.join(tmp_dir, 'model.json'), 'w') as f:
+            json.dump({'artifact_version': lean_model.ARTIFACT_VERSION, 'features': list(model.features),
+                       'intercept': model.intercept, 'gamma': model.gamma, 'threshold': model.threshold}, f)
+        try:
+            os.rename(tmp_dir, version_dir)
+        except OSError:
+            # Another process published the same version meanwhile
+            if not os.path.isdir(version_dir):
+                raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    prune(store_dir, version)
+    return version_dir
+
+
+def prune(store_dir, keep):
+    """
+    Removes all but the STORE_KEEP_VERSIONS newest versions (and keep). A process mapping a
+    removed version keeps reading it until it unmaps it.
+    """
+    versions = get_versions(store_dir)
+    for version in versions[:-STORE_KEEP_VERSIONS]:
+        if version != keep:
+            shutil.rmtree(os.path.join(store_dir, version), ignore_errors=True)
+
+
+def load(version_dir):
+    """
+    Maps a published version read-only.
+
+    Returns:
+        lean_model.LeanModel: Scoring from the mapped arrays, without copying them.
+    """
+    with open(os.path.join(version_dir, 'model.json')) as f:
+        info = json.load(f)
+    if info['artifact_version'] != lean_model.ARTIFACT_VERSION:
+        raise ValueError(f"{version_dir} has artifact version {info['artifact_version']}, "
+                         f"expected {lean_model.ARTIFACT_VERSION}")
+    arrays = {name: np.load(os.path.join(version_dir, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+    return lean_model.LeanModel.from_centered(info['features'], intercept=info['intercept'], gamma=info['gamma'],
+                                              threshold=info['threshold'], **arrays)
+
+
+def publish_artifact(model_path):
+    """
+    Publishes the current version of a tag's lean artifact (<model_path>.npz), e.g. right
+    after training, so the predictor's processes only have to map it.
+
+    Returns:
+        str: The version's directory, None if the artifact was replaced while it was read.
+    """
+    artifact_path = lean_model.get_artifact_path(model_path)
+    version = get_version(artifact_path)
+    version_dir = os.path.join(get_store_dir(model_path), version)
+    if os.path.isdir(version_dir):
+        return version_dir
+    model = lean_model.LeanModel(artifact_path)
+    if get_version(artifact_path) != version:
+        return None
+    return publish(model_path, model, version)
+
+
+def load_artifact(model_path):
+    """
+    Returns the LeanModel of a tag's lean artifact mapped from its store, publishing the
+    artifact's version first if it isn't yet.
+    """
+    version_dir = publish_artifact(model_path)
+    if version_dir is None:
+        # Replaced while it was read: the next load maps the new version
+        return lean_model.LeanModel(lean_model.get_artifact_path(model_path))
+    return load(version_dir)
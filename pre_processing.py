@@ -1,10 +1,20 @@
 import pandas as pd
+import numpy as np
 import os
+import pickle
+import rolling_kernel
+import instrumentation
+import data_fetch
 
 #Get the current working directory
 current_directory = os.getcwd()
 folder_path = current_directory # Specify the folder containing the CSV files
 
+# Folder holding the per-tag rolling-window checkpoints used by the incremental mode
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints'))
+
+WINDOW_SIZES = [1, 6, 12]
+
 # Initialize an empty list to store DataFrames
 
 def pivot_dataframe_column(df, index_col, columns_col, values_col):
@@ -24,7 +34,7 @@ def pivot_dataframe_column(df, index_col, columns_col, values_col):
     pivoted_df = df.pivot(index=index_col, columns=columns_col, values=values_col)
     pivoted_df.reset_index(inplace=True)
     pivoted_df.columns.name = None  # Remove the name of the columns index
-    new_column_names = {col: col.replace('\\', '_').replace('/', '_').replace(' ', '_') for col in pivoted_df.columns}
+    new_column_names = {col: get_column_name(col) for col in pivoted_df.columns}
     pivoted_df = pivoted_df.rename(columns=new_column_names)
 
     # pivoted_df.set_index('Timestamp', inplace=True)
@@ -38,6 +48,13 @@ def pivot_dataframe_column(df, index_col, columns_col, values_col):
 
 
 
+def get_column_name(variable):
+  """
+  Returns the pivoted column name of a signal description (e.g. 'II113RC001\\U' -> 'II113RC001_U').
+  """
+  return variable.replace('\\', '_').replace('/', '_').replace(' ', '_')
+
+
 def read_pivot_csv_file(filepath):
   df = pd.read_csv(filepath)
   # df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
@@ -48,12 +65,105 @@ def read_pivot_csv_file(filepath):
 
 
 
-def create_aggregated_df(df, columns_to_aggregate, window_sizes):
+def create_aggregated_df(df, columns_to_aggregate, window_sizes, plan=None, shared=None, output_after=None):
     
   """
   Creates a new DataFrame with aggregated values for specified columns,
   including the number of times the original Value crosses the 6h moving average.
 
+  Every column is aggregated in a single pass of rolling_kernel for all windows at
+  once, the 6h mean doubling as the moving average of the crossings count.
+
+  Args:
+    df: The input DataFrame.
+    columns_to_aggregate: A list of column names to aggregate.
+    window_sizes: A list of window sizes in hours.
+    plan: A build_feature_plan plan: only the model's features are computed, in the
+          model's order. None computes every statistic of every window.
+    shared: A SharedFeatures of the run, standing in for the rolling statistics of the
+            plant-wide signals (SHARED_COLUMNS) whenever it matches this data.
+    output_after: Only the rows after this timestamp are used by the caller (the
+                  incremental mode drops the checkpoint's rows), None for all of them.
+
+  Returns:
+    A new DataFrame with aggregated values.
+  """
+
+  timestamps = pd.DatetimeIndex(df['Timestamp'])
+  nanoseconds = timestamps.asi8
+  if plan is not None:
+    columns_to_aggregate = list(plan['statistics'])
+    window_sizes = sorted({window_size for windows in plan['statistics'].values() for window_size in windows})
+  window_bounds = rolling_kernel.get_window_bounds(nanoseconds, window_sizes)
+  first_output = 0 if output_after is None else timestamps.searchsorted(output_after, side='right')
+
+  aggregated = {}
+  for column in columns_to_aggregate:
+    if column in df.columns:
+      values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+      if plan is None:
+        wanted = {window_size: rolling_kernel.STATISTICS + ([CROSSINGS] if window_size == 6 else [])
+                  for window_size in window_sizes}
+      else:
+        wanted = plan['statistics'][column]
+      statistics = None
+      if shared is not None and column in SHARED_COLUMNS:
+        statistics = shared.get_statistics(column, nanoseconds, values, wanted, first_output)
+      aggregated.update(aggregate_column(column, nanoseconds, values, wanted, window_bounds, statistics))
+
+  if plan is not None:
+    aggregated = {feature: aggregated[feature] for feature in plan['features'] if feature in aggregated}
+  # One block per feature: the arrays (shared ones included) are used as they are
+  df2 = pd.DataFrame({'Timestamp': timestamps, **aggregated}, copy=False)
+
+  return df2
+
+
+def get_kernel_statistics(wanted):
+  """
+  Returns the rolling_kernel statistics behind {window_size: [statistic]}: the crossings
+  count reads the 6h mean, computed once for both.
+  """
+  return {window_size: [stat for stat in stats if stat != CROSSINGS] + (['mean'] if CROSSINGS in stats else [])
+          for window_size, stats in wanted.items()}
+
+
+def aggregate_column(column, nanoseconds, values, wanted, window_bounds, statistics=None):
+  """
+  Returns {feature name: array} of one column's wanted {window_size: [statistic]}.
+
+  Args:
+    statistics: Its rolling statistics already computed on these rows (from SharedFeatures),
+                or None to compute them here.
+  """
+  if statistics is None:
+    statistics = rolling_kernel.rolling_statistics(nanoseconds, values, list(wanted), get_kernel_statistics(wanted),
+                                                   window_bounds=window_bounds)
+  features = {}
+  for window_size, window_stats in wanted.items():
+    for stat in window_stats:
+      if stat != CROSSINGS:
+        features[f'{column}_{stat}_{window_size}h'] = statistics[window_size][stat]
+
+    # Count crossings against the 6h moving average
+    if CROSSINGS in window_stats:
+      moving_average = statistics[6]['mean']
+      shifted = np.full_like(values, np.nan)
+      shifted[1:] = values[:-1]
+      with np.errstate(invalid='ignore'):
+        crossings = (values > moving_average) & (shifted < moving_average)
+      features[f'{column}_crossings_6h'] = rolling_kernel.rolling_count(window_bounds[6], crossings)
+  return features
+
+def create_aggregated_df_pandas(df, columns_to_aggregate, window_sizes):
+    
+  """
+  Reference pandas implementation of create_aggregated_df (one rolling call per
+  column and window). Kept to check the kernel against.
+
+  Creates a new DataFrame with aggregated values for specified columns,
+  including the number of times the original Value crosses the 6h moving average.
+
   Args:
     df: The input DataFrame.
     columns_to_aggregate: A list of column names to aggregate.
@@ -132,19 +242,427 @@ def filter_columns(dftrain):
     return dftrain_filtered
 
 
-def treat_data(df, tag_name):
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
-    df = pivot_dataframe_column(df, 'Timestamp', 'Variable', 'Value')
+""" ******************* Feature plan ******************* """
+
+# Name of the crossings count statistic, only computed on the 6h window
+CROSSINGS = 'crossings'
+
+
+def build_feature_plan(features, columns_to_aggregate, window_sizes):
+    """
+    Maps a model's ordered feature list onto the rolling statistics producing it, so
+    create_aggregated_df computes those features only.
+
+    Args:
+        features: The model's ordered feature names (e.g. 'PIC11151A_MV_mean_6h').
+        columns_to_aggregate: The tag's signals (get_columns_to_aggregate).
+        window_sizes: The window sizes in hours.
+
+    Returns:
+        dict: {'features': the ordered features, 'statistics': {column: {window_size: [statistic]}}}.
+
+    Raises:
+        ValueError: If the model expects a feature create_aggregated_df can't build.
+    """
+    # Longest first: a signal name can be the prefix of another one
+    columns = sorted(columns_to_aggregate, key=len, reverse=True)
+    statistics = {}
+    unknown = []
+    for feature in features:
+        column = next((column for column in columns if feature.startswith(f'{column}_')), None)
+        stat, _, window = feature[len(column) + 1:].rpartition('_') if column else ('', '', '')
+        window_size = int(window[:-1]) if window.endswith('h') and window[:-1].isdigit() else None
+        if window_size not in window_sizes or not (stat in rolling_kernel.STATISTICS
+                                                   or (stat == CROSSINGS and window_size == 6)):
+            unknown.append(feature)
+            continue
+        window_stats = statistics.setdefault(column, {}).setdefault(window_size, [])
+        if stat not in window_stats:
+            window_stats.append(stat)
+    if unknown:
+        raise ValueError(f"The model expects features the feature plan can't build from "
+                         f"{', '.join(columns_to_aggregate)}: {', '.join(unknown)}")
+    return {'features': list(features), 'statistics': statistics}
+
+
+def get_feature_names(columns_to_aggregate, window_sizes):
+    """
+    Returns every feature create_aggregated_df builds without a plan, in its order.
+    """
+    return [f'{column}_{stat}_{window_size}h' for column in columns_to_aggregate for window_size in window_sizes
+            for stat in rolling_kernel.STATISTICS + ([CROSSINGS] if window_size == 6 else [])]
+
+
+def select_model_input(dataset, plan=None):
+    """
+    Returns the model's input columns of an aggregated dataset: the plan's features in
+    order, or the filter_columns selection without a plan.
+    """
+    if plan is None:
+        return filter_columns(dataset).drop(columns=['Timestamp'])
+    missing = [feature for feature in plan['features'] if feature not in dataset.columns]
+    if missing:
+        raise ValueError(f"The data lacks the signals of the model's features: {', '.join(missing)}")
+    return dataset[plan['features']]
+
+
+def get_columns_to_aggregate(tag_name):
+    """
+    Returns the pivoted signal names whose rolling features feed the model of a tag.
+    """
+    # columns_to_aggregate = ['P11151A_U', 'PIC11151A_-_SP_Int_Ext', 'PIC11151A_MV', 'PIC11151A_PV_IN', 'PIC11151A_SP','II113RC001_U']
+    return [f'{tag_name}_-_SP_Int_Ext', f'{tag_name}_MV', f'{tag_name}_PV_IN', f'{tag_name}_SP'] + SHARED_COLUMNS
+
+
+def treat_data(df, tag_name, plan=None):
+    with instrumentation.stage('pivot', rows=len(df)):
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
+        df = pivot_dataframe_column(df, 'Timestamp', 'Variable', 'Value')
     # print(df.describe())
     # Filter columns based on specific criteria
     # Filter columns that contain '11151A' or 'II113RC001_U' in their names
     # df1 = df[['Timestamp'] + [col for col in df.columns if '11151A' in col] + [col for col in df.columns if 'II113RC001_U' in col]]
 
-    # columns_to_aggregate = ['P11151A_U', 'PIC11151A_-_SP_Int_Ext', 'PIC11151A_MV', 'PIC11151A_PV_IN', 'PIC11151A_SP','II113RC001_U']
-    columns_to_aggregate = [f'{tag_name}_-_SP_Int_Ext', f'{tag_name}_MV', f'{tag_name}_PV_IN', f'{tag_name}_SP','II113RC001_U']
-    window_sizes = [1, 6, 12]
+    return treat_pivoted_data(df, tag_name, plan)
+
+
+def treat_pivoted_data(df, tag_name, plan=None):
+    """
+    The aggregation half of treat_data, for raw signals already pivoted (e.g. read from raw_cache).
+    """
+    columns_to_aggregate = get_columns_to_aggregate(tag_name)
+    window_sizes = WINDOW_SIZES
 
-    df2 = create_aggregated_df(df, columns_to_aggregate, window_sizes)
+    with instrumentation.stage('rolling_aggregation', rows=len(df)):
+        df2 = create_aggregated_df(df, columns_to_aggregate, window_sizes, plan)
     # Print the aggregated DataFrame
     # print(df2.describe())
     return df2
+
+
+""" ******************* Shared plant-wide signals ******************* """
+
+def get_nanoseconds(timestamps):
+    """
+    Returns the int64 nanoseconds of a Timestamp column, datetimes or epoch milliseconds like treat_data reads.
+    """
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return pd.DatetimeIndex(timestamps).asi8
+    return pd.to_datetime(timestamps, unit='ms', cache=False).to_numpy().astype(np.int64)
+
+
+# Pivoted columns of the signals data_fetch adds to every tag's data
+SHARED_COLUMNS = [get_column_name(signal) for signal in data_fetch.SHARED_SIGNALS]
+
+
+class SharedFeatures:
+    """
+    Rolling statistics of the plant-wide signals (SHARED_COLUMNS) for all the tags of a run.
+
+    Every tag's data carries the same shared signals, so their statistics are computed once
+    on the union of the tags' timestamps and each tag picks its rows out of them. A tag whose
+    data doesn't match the union (other values, or older history reaching into its windows)
+    computes them itself, so its features are those of its own data either way.
+    """
+
+    def __init__(self, tick_data, window_sizes=WINDOW_SIZES):
+        """
+        Args:
+            tick_data: {tag_name: (long-format dataset, checkpoint)}, as predict.fetch_tick_data returns.
+            window_sizes: The window sizes in hours.
+        """
+        self.window_sizes = list(window_sizes)
+        self.horizon = get_history_horizon(self.window_sizes).value
+        self.hits = 0
+        self.misses = 0
+        descriptions = dict(zip(SHARED_COLUMNS, data_fetch.SHARED_SIGNALS))
+        timestamps = []
+        observations = {column: ([], []) for column in SHARED_COLUMNS}
+        for dataset, checkpoint in tick_data.values():
+            if checkpoint is not None:
+                tail = checkpoint['raw_tail']
+                nanoseconds = pd.DatetimeIndex(tail['Timestamp']).asi8
+                timestamps.append(nanoseconds)
+                for column in SHARED_COLUMNS:
+                    if column in tail.columns:
+                        observations[column][0].append(nanoseconds)
+                        observations[column][1].append(tail[column].to_numpy(dtype=np.float64, na_value=np.nan))
+            if dataset is not None and not dataset.empty:
+                nanoseconds = get_nanoseconds(dataset['Timestamp'])
+                timestamps.append(nanoseconds)
+                for column, description in descriptions.items():
+                    rows = (dataset['Variable'] == description).to_numpy()
+                    observations[column][0].append(nanoseconds[rows])
+                    observations[column][1].append(dataset['Value'].to_numpy(dtype=np.float64)[rows])
+        self.timestamps = np.unique(np.concatenate(timestamps)) if timestamps else np.array([], dtype=np.int64)
+        self.window_bounds = rolling_kernel.get_window_bounds(self.timestamps, self.window_sizes)
+
+        self.values = {}
+        self.observed = {}
+        self.statistics = {}
+        for column, (column_timestamps, column_values) in observations.items():
+            if not column_timestamps:
+                continue
+            column_timestamps = np.concatenate(column_timestamps)
+            column_values = np.concatenate(column_values)
+            present = ~np.isnan(column_values)
+            order = np.argsort(column_timestamps[present], kind='stable')
+            column_timestamps = column_timestamps[present][order]
+            column_values = column_values[present][order]
+            if len(column_values) == 0:
+                continue
+            # The same minute seen by several tags must carry the same value
+            repeated = column_timestamps[1:] == column_timestamps[:-1]
+            if (repeated & (column_values[1:] != column_values[:-1])).any():
+                print(f"The tags disagree on {column}, each one computes its features")
+                continue
+            first = np.concatenate([[True], ~repeated])
+            values = np.full(len(self.timestamps), np.nan)
+            values[np.searchsorted(self.timestamps, column_timestamps[first])] = column_values[first]
+            observed = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum(~np.isnan(values), out=observed[1:])
+            self.values[column] = values
+            self.observed[column] = observed
+            self.statistics[column] = {}
+
+    def compute(self, column, kernel_statistics=None):
+        """
+        Computes the {window_size: [statistic]} of a column not computed yet (all of them by default).
+        """
+        if kernel_statistics is None:
+            kernel_statistics = {window_size: rolling_kernel.STATISTICS for window_size in self.window_sizes}
+        computed = self.statistics[column]
+        missing = {window_size: [stat for stat in stats if stat not in computed.get(window_size, {})]
+                   for window_size, stats in kernel_statistics.items()}
+        missing = {window_size: stats for window_size, stats in missing.items() if stats}
+        if missing:
+            results = rolling_kernel.rolling_statistics(self.timestamps, self.values[column], list(missing), missing,
+                                                        window_bounds=self.window_bounds)
+            for window_size, stats in results.items():
+                for array in stats.values():
+                    # Every tag's frame refers to these arrays
+                    array.flags.writeable = False
+                computed.setdefault(window_size, {}).update(stats)
+
+    def compute_all(self):
+        """
+        Computes every statistic of every shared column, e.g. before pickling the object to worker processes.
+        """
+        for column in self.values:
+            self.compute(column)
+
+    def get_statistics(self, column, nanoseconds, values, wanted, first_output=0):
+        """
+        Returns a tag's rolling statistics of a shared column, in rolling_kernel's layout.
+
+        Args:
+            column: A SHARED_COLUMNS column.
+            nanoseconds: The tag's row timestamps.
+            values: The column's values on those rows.
+            wanted: The {window_size: [statistic]} of the tag's features.
+            first_output: The first row the caller keeps, earlier ones may differ.
+
+        Returns:
+            dict: {window_size: {statistic: array}}, None when the union doesn't match the tag's data.
+        """
+        if column not in self.values or len(nanoseconds) == 0:
+            self.misses += 1
+            return None
+        union_values = self.values[column]
+        observed = self.observed[column]
+        positions = np.minimum(np.searchsorted(self.timestamps, nanoseconds), len(self.timestamps) - 1)
+        # The same observations at the tag's rows and none the tag lacks in between...
+        matches = (np.array_equal(self.timestamps[positions], nanoseconds)
+                   and np.array_equal(union_values[positions], values, equal_nan=True)
+                   and observed[positions[-1] + 1] - observed[positions[0]] == np.count_nonzero(~np.isnan(values)))
+        # ...nor before the tag's first row, within the reach of the windows of the kept rows
+        if matches and first_output < len(nanoseconds):
+            reach = np.searchsorted(self.timestamps, nanoseconds[first_output] - self.horizon, side='right')
+            matches = observed[positions[0]] == observed[min(reach, positions[0])]
+        if not matches:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        kernel_statistics = get_kernel_statistics(wanted)
+        self.compute(column, kernel_statistics)
+        # Rows laid out like the union's (the usual case) are views, others a gather
+        contiguous = positions[-1] - positions[0] + 1 == len(positions)
+        rows = slice(positions[0], positions[-1] + 1) if contiguous else positions
+        computed = self.statistics[column]
+        return {window_size: {stat: computed[window_size][stat][rows] for stat in stats}
+                for window_size, stats in kernel_statistics.items()}
+
+
+""" ******************* Incremental (checkpointed) aggregation ******************* """
+
+def get_history_horizon(window_sizes):
+  """
+  Returns how much raw history an output row depends on.
+
+  The widest window needs its own span, and the 6h crossings count needs 6h of
+  crossings whose 6h moving average looks another 6h back.
+  """
+  horizon = max(window_sizes)
+  if 6 in window_sizes:
+    horizon = max(horizon, 12)
+  return pd.Timedelta(hours=horizon)
+
+
+def create_aggregated_df_incremental(df, columns_to_aggregate, window_sizes, checkpoint=None, plan=None, shared=None):
+  """
+  Incremental version of create_aggregated_df.
+
+  Only the rows of df newer than the checkpoint are aggregated and returned. The
+  checkpoint carries the raw rows still inside the rolling windows, so the output
+  matches what create_aggregated_df returns for the same rows on the full history.
+
+  What is incremental is the fetch and the history kept, not the statistics: no
+  rolling state is carried between calls, every call recomputes the windows over the
+  checkpoint's raw tail plus the new rows (at most the largest window plus a tick,
+  about 735 rows at one row per minute) and keeps only the new rows.
+
+  Args:
+    df: The pivoted input DataFrame (with a 'Timestamp' column).
+    columns_to_aggregate: A list of column names to aggregate.
+    window_sizes: A list of window sizes in hours.
+    checkpoint: The checkpoint returned by the previous call, or None to start cold.
+    plan: Optional build_feature_plan plan (the checkpoint doesn't depend on it).
+    shared: Optional SharedFeatures of the run.
+
+  Returns:
+    tuple: (aggregated DataFrame with only the new rows, updated checkpoint).
+  """
+  if checkpoint is not None and (checkpoint['columns'] != list(columns_to_aggregate)
+                                 or checkpoint['window_sizes'] != list(window_sizes)):
+    print("Checkpoint was built for other columns/windows, starting cold.")
+    checkpoint = None
+
+  last_timestamp = None
+  if checkpoint is not None:
+    last_timestamp = checkpoint['last_timestamp']
+    df = df[df['Timestamp'] > last_timestamp]
+
+  if df.empty:
+    return pd.DataFrame(columns=['Timestamp']), checkpoint
+
+  df = append_to_raw_tail(checkpoint, df)
+
+  with instrumentation.stage('rolling_aggregation', rows=len(df)):
+    df2 = create_aggregated_df(df, columns_to_aggregate, window_sizes, plan, shared, last_timestamp)
+  if last_timestamp is not None:
+    df2 = df2[df2['Timestamp'] > last_timestamp].reset_index(drop=True)
+
+  return df2, make_checkpoint(df, columns_to_aggregate, window_sizes)
+
+
+def append_to_raw_tail(checkpoint, df):
+  """
+  Returns the checkpoint's raw rows (if any) followed by the pivoted rows of df, sorted by time.
+  """
+  if checkpoint is not None:
+    raw_tail = checkpoint['raw_tail']
+    # Checkpoints written by another fetch path may carry another timezone
+    tail_tz = getattr(raw_tail['Timestamp'].dtype, 'tz', None)
+    if tail_tz is not None and getattr(df['Timestamp'].dtype, 'tz', None) not in (None, tail_tz):
+      df = df.assign(Timestamp=df['Timestamp'].dt.tz_convert(tail_tz))
+    df = pd.concat([raw_tail, df], ignore_index=True)
+  return df.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+
+
+def make_checkpoint(df, columns_to_aggregate, window_sizes):
+  """
+  Returns the checkpoint following the sorted, pivoted raw rows df.
+  """
+  # Keep every row still inside the horizon plus the one before it, which the
+  # crossings count reads through shift(1)
+  new_last_timestamp = df['Timestamp'].iloc[-1]
+  start = df['Timestamp'].searchsorted(new_last_timestamp - get_history_horizon(window_sizes), side='right')
+  raw_tail = df.iloc[max(start - 1, 0):].reset_index(drop=True)
+
+  return {
+      'columns': list(columns_to_aggregate),
+      'window_sizes': list(window_sizes),
+      'last_timestamp': new_last_timestamp,
+      'raw_tail': raw_tail,
+  }
+
+
+def treat_data_incremental(df, tag_name, checkpoint=None, plan=None, shared=None):
+    """
+    Same as treat_data, but only returns the minutes newer than the checkpoint.
+
+    Returns:
+        tuple: (aggregated DataFrame with only the new rows, updated checkpoint).
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=['Timestamp']), checkpoint
+
+    with instrumentation.stage('pivot', rows=len(df)):
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
+        df = pivot_dataframe_column(df, 'Timestamp', 'Variable', 'Value')
+
+    columns_to_aggregate = get_columns_to_aggregate(tag_name)
+    return create_aggregated_df_incremental(df, columns_to_aggregate, WINDOW_SIZES, checkpoint, plan, shared)
+
+
+def treat_data_streaming(chunks, tag_name):
+    """
+    Same as treat_data, for long-format data arriving in time-ordered chunks
+    (data_fetch.stream_tag_range).
+
+    Each chunk is pivoted and aggregated on its own; the checkpoint carries the last
+    12h of raw rows across chunk edges, so the rolling windows stay exact and only one
+    chunk of raw data is held at a time.
+
+    Returns:
+        pandas.DataFrame: The aggregated rows of every chunk.
+    """
+    checkpoint = None
+    parts = []
+    for chunk in chunks:
+        part, checkpoint = treat_data_incremental(chunk, tag_name, checkpoint)
+        if not part.empty:
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame(columns=['Timestamp'])
+    return pd.concat(parts, ignore_index=True)
+
+
+def get_checkpoint_path(tag_name):
+    return os.path.join(CHECKPOINT_DIR, f'{tag_name}.pkl')
+
+
+def load_checkpoint(tag_name):
+    """
+    Loads the rolling-window checkpoint of a tag, or None if there is none (or it is unreadable).
+    """
+    path = get_checkpoint_path(tag_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Could not read checkpoint {path}, starting cold: {e}")
+        return None
+
+
+def save_checkpoint(tag_name, checkpoint):
+    """
+    Writes the checkpoint of a tag atomically, so a crash never leaves a truncated file behind.
+    """
+    if checkpoint is None:
+        return
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = get_checkpoint_path(tag_name)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def delete_checkpoint(tag_name):
+    path = get_checkpoint_path(tag_name)
+    if os.path.exists(path):
+        os.remove(path)
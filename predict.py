@@ -1,10 +1,25 @@
-from pycaret.anomaly import load_model, predict_model
 import os
+import sys
+import json
+import signal
+import time
+import datetime
+import threading
+import concurrent.futures
 import pandas as pd
-from sqlalchemy.engine import cursor
 import pre_processing as prep
+import score_writer
+import data_fetch
+import lean_model
+import model_store
+import instrumentation
+import window_pushdown
+import tick_pipeline
+import replicas
 import psycopg2 as pg
+import psycopg2.pool
 from dotenv import load_dotenv
+from scheduler import CronSchedule
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -18,90 +33,839 @@ DETECTOR_SCHEMA = os.environ.get("DETECTOR_SCHEMA")
 MENDIX_SCHEMA = os.environ.get("MENDIX_SCHEMA")
 VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
 POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+CRON_INTERVAL = os.environ.get("CRON_INTERVAL") or "*/15 * * * *"
+MODELS_DIR = os.environ.get("MODELS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+PREDICT_WORKERS = int(os.environ.get("PREDICT_WORKERS") or 1)  # 1 scores the tags serially
+# Aggregate only the features the tag's model reads (0: every statistic, then filter_columns)
+FEATURE_PLAN = os.environ.get("FEATURE_PLAN", "1") == "1"
+# Compute the rolling features of the plant-wide signals once per tick for all the tags
+SHARED_FEATURES = os.environ.get("SHARED_FEATURES", "1") == "1"
+# Where the rolling features are computed: python (fetch the raw minutes) or sql (window
+# aggregates in PostgreSQL, see window_pushdown)
+FEATURE_SOURCE = os.environ.get("FEATURE_SOURCE") or "python"
+# Tags waiting between the fetch, score and write stages of a pipelined tick, which fetches
+# and writes on their own connections while the CPU scores (0: one tag after the other)
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH") or 0)
+# A tag whose checkpoint is further behind the newest data (or missing) skips ahead to it, the
+# minutes skipped are caught up in batches after the ticks (0: score the whole span at once)
+CATCHUP_LIVE_MINUTES = float(os.environ.get("CATCHUP_LIVE_MINUTES") or 60)
+CATCHUP_BATCH_HOURS = float(os.environ.get("CATCHUP_BATCH_HOURS") or 6)
+# Time spent catching up per tick, after the tags' new minutes
+CATCHUP_BUDGET_SECONDS = float(os.environ.get("CATCHUP_BUDGET_SECONDS") or 60)
+# Minutes older than this are not caught up, rewind.py rescores them
+CATCHUP_MAX_DAYS = float(os.environ.get("CATCHUP_MAX_DAYS") or 7)
 
 
 """ ******************* PostgreSQL Connection and Querying ******************* """
 
-def get_data_with_in_clause(conn, cursor, tag_name):
+"""******************* Get Tag Id *******************"""
+def get_anomaly_tags(cursor):
+    query = f""" SELECT id, description FROM {VARIABLES_SCHEMA}.params_calc WHERE description like '%\\AS'; """
+    cursor.execute(query)
+    return cursor.fetchall()
+
+
+
+
+def get_db_config():
+    return {
+        'database': POSTGRES_DB ,
+        'user': POSTGRES_USER,
+        'password': POSTGRES_PASSWORD,
+        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
+        'port': POSTGRES_PORT       # Default PostgreSQL port
+    }
+
+
+"""******************* Model cache *******************"""
+
+class ModelCache:
+    """
+    Keeps the loaded models in memory, reloading one only when its file changes on disk.
+
+    The lean artifact (<tag>.npz, written by train.py) is scored with NumPy only; pycaret
+    is imported only for tags that have nothing but the .pkl, or whose .npz is older.
+    With MODEL_MMAP, the artifact's arrays are mapped from its model_store version, so the
+    worker processes share one copy of them.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR):
+        self.models_dir = models_dir
+        self.models = {}
+        self.plans = {}
+
+    def get(self, tag_name):
+        model_path = os.path.join(self.models_dir, tag_name)
+        artifact_path = lean_model.get_artifact_path(model_path)
+        pickle_mtime = os.stat(f'{model_path}.pkl').st_mtime_ns if os.path.exists(f'{model_path}.pkl') else None
+        artifact_mtime = os.stat(artifact_path).st_mtime_ns if os.path.exists(artifact_path) else None
+        use_artifact = artifact_mtime is not None and (pickle_mtime is None or artifact_mtime >= pickle_mtime)
+        if not use_artifact and pickle_mtime is None:
+            raise FileNotFoundError(f"No model for {tag_name} in {self.models_dir}")
+
+        version = (artifact_mtime if use_artifact else pickle_mtime, use_artifact)
+        cached = self.models.get(tag_name)
+        if cached is None or cached[0] != version:
+            if use_artifact and model_store.MODEL_MMAP:
+                try:
+                    model = model_store.load_artifact(model_path)
+                    print(f"Mapped lean model {artifact_path}")
+                except OSError as e:
+                    # e.g. a read-only models volume the store can't be published to
+                    print(f"Could not map {artifact_path}, loading it: {e}")
+                    model = lean_model.LeanModel(artifact_path)
+            elif use_artifact:
+                print(f"Loading lean model {artifact_path}")
+                model = lean_model.LeanModel(artifact_path)
+            else:
+                print(f"Loading model {model_path}.pkl (no up-to-date lean artifact)")
+                from pycaret.anomaly import load_model
+                model = load_model(model_path)
+            cached = (version, model)
+            self.models[tag_name] = cached
+        return cached[1]
+
+    def get_plan(self, tag_name):
+        """
+        Returns the feature plan of the tag's current model, rebuilt when the model changes.
+
+        Raises:
+            ValueError: If the model's features don't match what pre_processing can build.
+        """
+        model = self.get(tag_name)
+        cached = self.plans.get(tag_name)
+        if cached is None or cached[0] is not model:
+            plan = prep.build_feature_plan(get_model_features(model), prep.get_columns_to_aggregate(tag_name),
+                                           prep.WINDOW_SIZES)
+            cached = (model, plan)
+            self.plans[tag_name] = cached
+        return cached[1]
+
+
+def get_model_features(model):
+    """
+    Returns the ordered features a model from ModelCache reads.
+    """
+    if isinstance(model, lean_model.LeanModel):
+        return model.features
+    # pycaret Pipeline
+    return list(model._feature_names_in)
+
+
+def predict_scores(model, data):
+    """
+    Scores data with a model from ModelCache, returning predict_model's output.
+    """
+    if isinstance(model, lean_model.LeanModel):
+        return model.predict(data)
+    from pycaret.anomaly import predict_model
+    return predict_model(model, data=data)
+
+
+"""******************* Scoring *******************"""
+
+def score_tag(conn, cursor, tag_anomaly_id, tag_name, model_cache, dataset=None, checkpoint=None, shared=None,
+              resolver=None, claims=None):
     """
+    Fetches, aggregates and scores the new minutes of one tag, then writes the scores.
+
     Args:
+        dataset: The tag's raw data already fetched by data_fetch.fetch_tags_data, along
+                 with the checkpoint it was fetched from. When None, it is fetched here.
+        shared: The tick's prep.SharedFeatures, if any.
+        resolver: The data_fetch.ParamResolver of the fetch (param ids cached between runs).
+        claims: The replicas.TagClaims the tag was claimed with, if the tags are shared.
 
     Returns:
-        pandas.DataFrame: A DataFrame containing the query results,
-                          or None if an error occurs or no data is found.
-                          Returns an empty DataFrame if filter_values is empty.
-    """
-    df = None
-
-    # Construct the SQL query using a placeholder for the IN clause
-    # Note: We use f-string for table/column names (use with caution)
-    #       but %s placeholder for the actual values to prevent SQL injection.
-    # sql_query = f"SELECT * FROM public.chlorum_dump WHERE \"Timestamp\" BETWEEN NOW() AND (NOW() - INTERVAL '6 HOUR');"
-    sql_query = f"""
-        select dt as "Timestamp"
-    ,p.description as "Variable"
-    ,AVG(value) as "Value"
-    from {VARIABLES_SCHEMA}.inspections i 
-    inner join {VARIABLES_SCHEMA}.params p on i.id_param_fk = p.id 
-    WHERE (p.description like '%{tag_name}%' or p.description = 'II113RC001\\U')
-    and dt between (select max(dt) from {VARIABLES_SCHEMA}.inspections) - interval '12 HOUR' and (select max(dt) from {VARIABLES_SCHEMA}.inspections)
-    GROUP BY "Timestamp", "Variable"
-    ORDER BY "Timestamp" asc;
+        int: The number of minutes scored.
     """
+    # Only the minutes after the last processed one are fetched and scored,
+    # the rolling windows are resumed from the tag's checkpoint
+    if dataset is None or FEATURE_SOURCE == 'sql':
+        dataset, checkpoint = fetch_tag_input(cursor, tag_name, model_cache, resolver)
+    predictions, checkpoint = compute_tag_scores(tag_name, dataset, checkpoint, model_cache, shared)
+    return write_tag_scores(conn, cursor, tag_anomaly_id, tag_name, predictions, checkpoint, claims)
 
+
+def fetch_tag_input(cursor, tag_name, model_cache, resolver=None):
+    """
+    Fetches what the scoring of a tag reads from the database, from its checkpoint on.
+
+    Returns:
+        tuple: (dataset, checkpoint): the raw minutes and the tag's checkpoint, or with the
+               sql FEATURE_SOURCE the aggregated features and the checkpoint after them.
+    """
+    checkpoint = prep.load_checkpoint(tag_name)
+    if FEATURE_SOURCE == 'sql':
+        with instrumentation.stage('load_model'):
+            plan = model_cache.get_plan(tag_name) if FEATURE_PLAN else None
+        with instrumentation.stage('fetch_features') as stage:
+            dataset, checkpoint = window_pushdown.treat_data_pushdown(cursor, resolver or data_fetch.ParamResolver(),
+                                                                      tag_name, checkpoint, plan)
+            stage['rows'] = len(dataset)
+        return dataset, checkpoint
+    with instrumentation.stage('fetch') as stage:
+        # The typed columnar fetch of fetch_tick_data, for this tag only
+        since_by_tag = {tag_name: checkpoint['last_timestamp']} if checkpoint else None
+        dataset = data_fetch.fetch_tags_data(cursor, resolver or data_fetch.ParamResolver(), [tag_name],
+                                             since_by_tag)[tag_name]
+        stage['rows'] = len(dataset)
+    return dataset, checkpoint
+
+
+def compute_tag_scores(tag_name, dataset, checkpoint, model_cache, shared=None):
+    """
+    Aggregates a tag's new minutes and scores them, without touching the database.
+
+    Returns:
+        tuple: (predictions with their Timestamp, or None without new minutes, updated checkpoint).
+    """
+    # The model is loaded first: its feature plan decides what gets aggregated
+    with instrumentation.stage('load_model'):
+        m = model_cache.get(tag_name)
+        plan = model_cache.get_plan(tag_name) if FEATURE_PLAN else None
+    # dataset = pd.read_csv(os.path.join(current_path,'csv', 'Malha_11151A.csv'))
+    if FEATURE_SOURCE != 'sql':
+        dataset, checkpoint = prep.treat_data_incremental(dataset, tag_name, checkpoint, plan, shared)
+    if dataset.empty:
+        print(f"No new data for {tag_name}")
+        return None, checkpoint
+    with instrumentation.stage('filter_columns', rows=len(dataset)):
+        model_input = prep.select_model_input(dataset, plan)
+
+    with instrumentation.stage('score', rows=len(model_input)):
+        predictions = predict_scores(m, model_input)
+        predictions = pd.concat([predictions, dataset['Timestamp']], axis=1)
+    return predictions, checkpoint
+
+
+def write_tag_scores(conn, cursor, tag_anomaly_id, tag_name, predictions, checkpoint, claims=None):
+    """
+    Writes and commits a tag's scores, then moves its checkpoint.
+
+    With claims, the claim on the tag is finished in the same transaction: a replica that
+    stalled past its heartbeat and lost the tag to another one raises instead of writing.
+
+    Returns:
+        int: The number of minutes scored.
+    """
+    if predictions is None:
+        return 0
+    if claims is not None and not claims.hold(cursor, tag_name):
+        conn.rollback()
+        raise RuntimeError(f"The claim on {tag_name} was taken over by another replica, its scores are not written")
+    with instrumentation.stage('write_scores', rows=len(predictions)):
+        score_writer.write_scores(cursor, tag_anomaly_id, predictions, mode='append', tag_name=tag_name)
+        print("Success")
+        conn.commit()
+    # Only move the checkpoint once the scores are committed
+    with instrumentation.stage('save_checkpoint'):
+        prep.save_checkpoint(tag_name, checkpoint)
+    return len(predictions)
+
+
+def score_tag_isolated(conn, cursor, tag_anomaly_id, tag_name, model_cache, dataset=None, checkpoint=None,
+                       shared=None, resolver=None, claims=None):
+    """
+    Runs score_tag, rolling back only this tag's work if it fails.
+
+    Connection-level errors are re-raised, there is nothing left to isolate them from.
+
+    Returns:
+        tuple: (status, detail) with status 'ok' (detail = minutes scored) or 'failed'.
+    """
     try:
-        # print(f"Executing query: {cursor.mogrify(sql_query, (values_tuple,)).decode('utf-8')}") # Show rendered query
-        # cursor.execute(sql_query, (values_tuple,)) # Crucial: pass values tuple inside another tuple
-        cursor.execute(sql_query,) # Crucial: pass values tuple inside another tuple
-
-        # Fetch all the results
-        results = cursor.fetchall()
-
-        if results:
-            # Get column names from the cursor description
-            colnames = [desc[0] for desc in cursor.description]
-            # Create the Pandas DataFrame
-            df = pd.DataFrame(results, columns=colnames)
-            print(f"Successfully fetched {len(df)} rows.")
-            print(f"Column name: {df.columns}")
+        with instrumentation.tag(tag_name):
+            return 'ok', score_tag(conn, cursor, tag_anomaly_id, tag_name, model_cache, dataset, checkpoint,
+                                   shared, resolver, claims)
+    except (pg.OperationalError, pg.InterfaceError):
+        raise
+    except Exception as e:
+        print(f"Failed to score {tag_name}: {e}")
+        conn.rollback()
+        return 'failed', str(e)
+
+
+""" ******************* Gap catch-up ******************* """
+
+def score_range(conn, cursor, resolver, model_cache, tag_anomaly_id, tag_name, start, end, cache=None):
+    """
+    Scores [start, end) of a tag and replaces its scores in one transaction.
+
+    The data is read from 12h before start, so the rolling windows of the first
+    minutes are as complete as anywhere else. Scores the range no longer produces are
+    deleted, the others upserted.
+
+    Args:
+        cache: Optional raw_cache.DataCache the raw signals are read through.
+
+    Returns:
+        int: The number of minutes scored.
+    """
+    warm_start = start - prep.get_history_horizon(prep.WINDOW_SIZES)
+    fetch_end = end - pd.Timedelta(microseconds=1)
+    with instrumentation.stage('load_model'):
+        model = model_cache.get(tag_name)
+        plan = model_cache.get_plan(tag_name) if FEATURE_PLAN else None
+    with instrumentation.stage('fetch_features') as stage:
+        if cache is not None:
+            raw = cache.get_raw(cursor, resolver, tag_name, warm_start, fetch_end)
+            dataset = prep.treat_pivoted_data(raw, tag_name, plan) if len(raw) else pd.DataFrame(columns=['Timestamp'])
         else:
-            print("No data found for the given filter values.")
-            # Return empty dataframe with columns if possible
-            if cursor.description:
-                 colnames = [desc[0] for desc in cursor.description]
-                 df = pd.DataFrame(columns=colnames)
+            dataset = prep.treat_data(data_fetch.fetch_tag_range(cursor, resolver, tag_name, warm_start, fetch_end),
+                                      tag_name, plan)
+        if len(dataset):
+            dataset = dataset[dataset['Timestamp'] >= start].reset_index(drop=True)
+        stage['rows'] = len(dataset)
+
+    with instrumentation.stage('delete_stale_scores'):
+        score_writer.delete_stale_scores(cursor, tag_anomaly_id, start, end, dataset['Timestamp'].tolist())
+    if len(dataset):
+        with instrumentation.stage('filter_columns', rows=len(dataset)):
+            model_input = prep.select_model_input(dataset, plan)
+        with instrumentation.stage('score', rows=len(model_input)):
+            predictions = predict_scores(model, model_input)
+            predictions = pd.concat([predictions, dataset['Timestamp']], axis=1)
+        with instrumentation.stage('write_scores', rows=len(predictions)):
+            score_writer.write_scores(cursor, tag_anomaly_id, predictions, mode='replace',
+                                      tag_name=f'{tag_name} {start:%Y-%m-%d %H:%M}')
+    conn.commit()
+    return len(dataset)
+
+
+def get_gaps_path(tag_name):
+    return os.path.join(prep.CHECKPOINT_DIR, f'{tag_name}.gaps.json')
+
+
+def load_gaps(tag_name):
+    """
+    Returns the tag's minutes still to catch up, as [start, end) ranges, newest first.
+    """
+    path = get_gaps_path(tag_name)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path) as f:
+            return [[pd.Timestamp(start), pd.Timestamp(end)] for start, end in json.load(f)]
+    except Exception as e:
+        print(f"Could not read the gaps of {tag_name} in {path}, they are left to rewind.py: {e}")
+        return []
+
+
+def save_gaps(tag_name, gaps):
+    """
+    Writes the gaps of a tag atomically next to its checkpoint, or removes the file once they are caught up.
+    """
+    path = get_gaps_path(tag_name)
+    if not gaps:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(prep.CHECKPOINT_DIR, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump([[start.isoformat(), end.isoformat()] for start, end in gaps], f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def add_gap(gaps, start, end):
+    """
+    Returns the gaps with [start, end) merged in, newest first.
+    """
+    merged = []
+    for gap_start, gap_end in sorted(gaps + [[start, end]]):
+        if merged and gap_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], gap_end)
+        else:
+            merged.append([gap_start, gap_end])
+    return merged[::-1]
+
+
+def skip_stale_checkpoints(cursor, tags, resolver):
+    """
+    Moves the checkpoint of the tags CATCHUP_LIVE_MINUTES or more behind the newest data
+    (or without a usable one) up to that point, with the raw history its windows need, and
+    records the minutes since the tag's last score as a gap for catch_up_gaps. A tag with
+    neither scores nor a checkpoint has no gap: it starts from the live window.
+
+    The tick then scores the last minutes only, however long the predictor was down.
+    """
+    newest = data_fetch.get_upper_bound(cursor)
+    cursor.connection.commit()
+    if newest is None:
+        return
+    live_start = pd.Timestamp(newest) - pd.Timedelta(minutes=CATCHUP_LIVE_MINUTES)
+    oldest = live_start - pd.Timedelta(days=CATCHUP_MAX_DAYS)
+    for tag_anomaly_id, tag_name in tags:
+        columns_to_aggregate = prep.get_columns_to_aggregate(tag_name)
+        checkpoint = prep.load_checkpoint(tag_name)
+        if (checkpoint is not None and checkpoint['columns'] == list(columns_to_aggregate)
+                and checkpoint['window_sizes'] == list(prep.WINDOW_SIZES) and checkpoint['last_timestamp'] >= live_start):
+            continue
+        try:
+            with instrumentation.tag(tag_name), instrumentation.stage('skip_ahead'):
+                raw = data_fetch.fetch_tag_range(cursor, resolver, tag_name,
+                                                 live_start - prep.get_history_horizon(prep.WINDOW_SIZES), live_start)
+                watermark = score_writer.get_watermark(cursor, tag_anomaly_id)
+                cursor.connection.commit()
+                if raw.empty:
+                    # Nothing to warm the windows up with, the tick starts the tag cold
+                    continue
+                raw['Timestamp'] = pd.to_datetime(raw['Timestamp'], unit='ms')
+                history = prep.pivot_dataframe_column(raw, 'Timestamp', 'Variable', 'Value')
+                skipped_to = prep.make_checkpoint(history, columns_to_aggregate, prep.WINDOW_SIZES)
+                end = skipped_to['last_timestamp'] + pd.Timedelta(microseconds=1)
+                # Scored up to its watermark, or its checkpoint when its scores were deleted
+                scored_until = watermark if watermark is not None else (checkpoint or {}).get('last_timestamp')
+                if scored_until is None:
+                    # A tag never scored starts from the live window, nothing to catch up
+                    start = end
+                else:
+                    start = max(pd.Timestamp(scored_until) + pd.Timedelta(microseconds=1), oldest)
+                    if pd.Timestamp(scored_until) < oldest:
+                        print(f"{tag_name}: the minutes before {oldest} are older than CATCHUP_MAX_DAYS, "
+                              f"rescore them with rewind.py")
+                # The gap is recorded first: if the checkpoint isn't saved, the next tick records it again
+                if start < end:
+                    save_gaps(tag_name, add_gap(load_gaps(tag_name), start, end))
+                prep.save_checkpoint(tag_name, skipped_to)
+                print(f"{tag_name} skipped ahead to {skipped_to['last_timestamp']}, "
+                      f"{max((end - start) / pd.Timedelta(hours=1), 0):.1f}h since its last score to catch up")
+        except (pg.OperationalError, pg.InterfaceError):
+            raise
+        except Exception as e:
+            # The tick scores the tag from its old checkpoint instead
+            print(f"Could not skip {tag_name} ahead: {e}")
+            cursor.connection.rollback()
+
+
+def catch_up_gaps(conn, cursor, model_cache, tags, resolver, stop_event=None, deadline=None):
+    """
+    Scores the gaps of the tags newest first, CATCHUP_BATCH_HOURS at a time and taking
+    turns between the tags, until CATCHUP_BUDGET_SECONDS or the deadline is spent. What
+    is left waits for the next tick.
+
+    Returns:
+        dict: {tag_name: minutes caught up}.
+    """
+    budget_end = time.time() + CATCHUP_BUDGET_SECONDS
+    if deadline is not None:
+        budget_end = min(budget_end, deadline)
+    pending = {tag_name: (tag_anomaly_id, gaps) for tag_anomaly_id, tag_name in tags
+               for gaps in [load_gaps(tag_name)] if gaps}
+    if not pending:
+        return {}
+    batch = pd.Timedelta(hours=CATCHUP_BATCH_HOURS)
+    caught_up = {}
+    while pending and time.time() < budget_end and not (stop_event is not None and stop_event.is_set()):
+        for tag_name, (tag_anomaly_id, gaps) in list(pending.items()):
+            if time.time() >= budget_end or (stop_event is not None and stop_event.is_set()):
+                break
+            start, end = gaps[0]
+            batch_start = max(start, end - batch)
+            try:
+                with instrumentation.tag(tag_name):
+                    minutes = score_range(conn, cursor, resolver, model_cache, tag_anomaly_id, tag_name, batch_start, end)
+            except (pg.OperationalError, pg.InterfaceError):
+                raise
+            except Exception as e:
+                # Left for the next tick
+                print(f"Catch-up of {tag_name} before {end} failed: {e}")
+                conn.rollback()
+                del pending[tag_name]
+                continue
+            caught_up[tag_name] = caught_up.get(tag_name, 0) + minutes
+            if batch_start > start:
+                gaps[0] = [start, batch_start]
             else:
-                 df = pd.DataFrame()
+                gaps.pop(0)
+            save_gaps(tag_name, gaps)
+            if not gaps:
+                del pending[tag_name]
+    left = sum((end - start) / pd.Timedelta(minutes=1) for _, tag_name in tags for start, end in load_gaps(tag_name))
+    print(f"Catch-up: {sum(caught_up.values())} minutes of {len(caught_up)} tag(s) scored, "
+          f"{left / 60:.1f}h of gaps left")
+    return caught_up
 
 
-    except (Exception, pg.Error) as error:
-        print(f"Error while connecting to or querying PostgreSQL: {error}")
-        df = None # Indicate error
+def report_results(results):
+    """
+    Prints one line per outcome of a run, e.g. '3 ok, 1 failed (FIC11121)'.
+    """
+    summary = []
+    for status in ('ok', 'failed', 'skipped'):
+        tags = [tag_name for tag_name, (tag_status, _) in results.items() if tag_status == status]
+        if tags:
+            summary.append(f"{len(tags)} {status}" + (f" ({', '.join(tags)})" if status != 'ok' else ''))
+    print(f"Run summary: {', '.join(summary) or 'no tags'}")
 
 
-    return df
+def fetch_tick_data(cursor, tags, resolver):
+    """
+    Fetches the new data of all tags in a single query.
 
+    Returns:
+        dict: {tag_name: (dataset, checkpoint)}.
+    """
+    checkpoints = {tag_name: prep.load_checkpoint(tag_name) for _, tag_name in tags}
+    since_by_tag = {tag_name: checkpoint['last_timestamp'] for tag_name, checkpoint in checkpoints.items() if checkpoint}
+    with instrumentation.stage('fetch_tick') as stage:
+        datasets = data_fetch.fetch_tags_data(cursor, resolver, [tag_name for _, tag_name in tags], since_by_tag)
+        stage['rows'] = sum(len(dataset) for dataset in datasets.values())
+    # The fetch only read, end its transaction so the tags start clean
+    cursor.connection.commit()
+    return {tag_name: (datasets[tag_name], checkpoints[tag_name]) for _, tag_name in tags}
+
+
+def run_predictions(conn, cursor, model_cache, stop_event=None, deadline=None, scoring_pool=None,
+                    resolver=None, write_conn=None, claims=None):
+    """
+    Scores every anomaly tag (description ending in \\AS) once.
 
+    Args:
+        deadline: Epoch seconds after which tags not started yet are skipped (the next tick is due).
+        scoring_pool: A TagScoringPool to score the tags in parallel, or None to score them here.
+        resolver: The data_fetch.ParamResolver to reuse between runs.
+        write_conn: A second connection for the scores: with PIPELINE_DEPTH, the tags are
+                    scored by run_pipelined_predictions (unless scoring_pool is given).
+        claims: The replicas.TagClaims of this tick when the tags are shared with other
+                replicas: only the tags claimed are scored.
 
+    Returns:
+        dict: {tag_name: (status, detail)}.
+    """
+    tags = [(tag_anomaly_id, tag_name.split("\\")[0]) #remove the \AS from the tag name
+            for tag_anomaly_id, tag_name in get_anomaly_tags(cursor)]
+    resolver = resolver or data_fetch.ParamResolver()
+    if claims is None:
+        results = score_tags(conn, cursor, model_cache, tags, stop_event, deadline, scoring_pool, resolver,
+                             write_conn)
+    else:
+        # The tags of this replica first, then the ones no other replica claimed
+        results = {}
+        claimed = claims.claim_own(cursor, [tag_name for _, tag_name in tags])
+        while claimed:
+            batch = score_tags(conn, cursor, model_cache, [tag for tag in tags if tag[1] in claimed],
+                               stop_event, deadline, scoring_pool, resolver, write_conn, claims)
+            claims.finish(cursor, batch)
+            results.update(batch)
+            if (stop_event is not None and stop_event.is_set()) or (deadline is not None and time.time() > deadline):
+                break
+            claimed = claims.claim(cursor, [tag_name for _, tag_name in tags if tag_name not in results])
+        print(f"Replica {claims.replica_id} scored {len(results)} of {len(tags)} tags")
+    report_results(results)
+    if CATCHUP_LIVE_MINUTES > 0:
+        # Once every tag's new minutes are in, and only for the tags scored here
+        catch_up_gaps(conn, cursor, model_cache, [tag for tag in tags if results.get(tag[1], ('',))[0] == 'ok'],
+                      resolver, stop_event, deadline)
+    return results
+
+
+def score_tags(conn, cursor, model_cache, tags, stop_event=None, deadline=None, scoring_pool=None,
+               resolver=None, write_conn=None, claims=None):
+    """
+    Scores the tags ([(tag_anomaly_id, tag_name)]) serially, in the scoring pool or pipelined.
+    With claims (replicas.TagClaims), a tag's scores are only written while this replica holds its claim.
 
-"""******************* Get Tag Id *******************"""
-def get_anomaly_tags(cursor):
-    query = f""" SELECT id, description FROM {VARIABLES_SCHEMA}.params_calc WHERE description like '%\\AS'; """
-    cursor.execute(query)
-    return cursor.fetchall()
+    Returns:
+        dict: {tag_name: (status, detail)}.
+    """
+    if CATCHUP_LIVE_MINUTES > 0:
+        skip_stale_checkpoints(cursor, tags, resolver)
+    if PIPELINE_DEPTH > 0 and write_conn is not None and scoring_pool is None:
+        # The previous statements only read, the fetch stage starts a clean transaction
+        conn.commit()
+        return run_pipelined_predictions(conn, cursor, write_conn, model_cache, tags, stop_event,
+                                         deadline, resolver, claims)
+    if FEATURE_SOURCE == 'sql':
+        # Every tag queries its own window features, nothing to fetch up front
+        tick_data = {tag_name: (None, None) for _, tag_name in tags}
+    else:
+        tick_data = fetch_tick_data(cursor, tags, resolver)
+    shared = None
+    if SHARED_FEATURES and FEATURE_SOURCE != 'sql':
+        try:
+            with instrumentation.stage('shared_features'):
+                shared = prep.SharedFeatures(tick_data)
+                if scoring_pool is not None:
+                    # Computed here once instead of in every worker
+                    shared.compute_all()
+        except Exception as e:
+            # Not worth a tick: every tag computes its own features instead
+            print(f"Could not compute the shared signals' features: {e}")
+            shared = None
+    if scoring_pool is not None:
+        return scoring_pool.score(tags, tick_data, deadline, stop_event, shared, claims)
+    results = {}
+    for tag_anomaly_id, tag_name in tags:
+        if stop_event is not None and stop_event.is_set():
+            results[tag_name] = ('skipped', 'stop requested')
+        elif deadline is not None and time.time() > deadline:
+            results[tag_name] = ('skipped', 'deadline reached')
+        else:
+            dataset, checkpoint = tick_data[tag_name]
+            results[tag_name] = score_tag_isolated(conn, cursor, tag_anomaly_id, tag_name, model_cache,
+                                                   dataset, checkpoint, shared, resolver, claims)
+    return results
+
+
+"""******************* Pipelined scoring *******************"""
+
+def run_isolated_step(conn, tag_name, step, *args):
+    """
+    Runs one step of a pipelined tag, rolling back its connection if it fails.
+    Connection-level errors are re-raised, they stop the tick.
+    """
+    with instrumentation.attribute(tag_name):
+        try:
+            return step(*args)
+        except (pg.OperationalError, pg.InterfaceError):
+            raise
+        except Exception:
+            if conn is not None:
+                conn.rollback()
+            raise
+
+
+def run_pipelined_predictions(conn, cursor, write_conn, model_cache, tags, stop_event=None,
+                              deadline=None, resolver=None, claims=None):
+    """
+    Scores the tags through tick_pipeline: the query of the next tag (on conn) and the
+    writes of the previous one (on write_conn) run while a tag is aggregated and scored.
+
+    Every tag is fetched on its own, so the SharedFeatures of a whole tick are not used.
+
+    Returns:
+        dict: {tag_name: (status, detail)}.
+    """
+    def should_skip():
+        if stop_event is not None and stop_event.is_set():
+            return 'stop requested'
+        if deadline is not None and time.time() > deadline:
+            return 'deadline reached'
+        return None
+
+    def fetch(tag, _):
+        tag_anomaly_id, tag_name = tag
+        fetched = run_isolated_step(conn, tag_name, fetch_tag_input, cursor, tag_name, model_cache, resolver)
+        # Nothing to keep open: the next query gets a fresh snapshot
+        conn.commit()
+        return fetched
+
+    def score(tag, fetched):
+        tag_anomaly_id, tag_name = tag
+        return run_isolated_step(None, tag_name, compute_tag_scores, tag_name, *fetched, model_cache)
+
+    with write_conn.cursor() as write_cursor:
+        def write(tag, scored):
+            tag_anomaly_id, tag_name = tag
+            return run_isolated_step(write_conn, tag_name, write_tag_scores, write_conn, write_cursor, tag_anomaly_id,
+                                     tag_name, *scored, claims)
+
+        return tick_pipeline.run_pipeline([(tag[1], tag) for tag in tags],
+                                          [('fetch', fetch), ('score', score), ('write', write)],
+                                          PIPELINE_DEPTH, should_skip, (pg.OperationalError, pg.InterfaceError))
+
+
+"""******************* Parallel scoring *******************"""
+
+# Connection and models of a pool worker process, set up by _init_worker
+_worker_state = {}
+
+
+def _init_worker(db_config, models_dir=MODELS_DIR):
+    # Ctrl+C reaches the whole process group, let the parent decide when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_state['db_config'] = db_config
+    _worker_state['conn'] = None
+    _worker_state['models'] = ModelCache(models_dir)
+    _worker_state['resolver'] = data_fetch.ParamResolver()
+
+
+def _worker_score_tag(tag_anomaly_id, tag_name, dataset, checkpoint, deadline, run_id=None, shared=None, claims=None):
+    if deadline is not None and time.time() > deadline:
+        return 'skipped', 'deadline reached'
+    # The worker's stage records share the run id of the tick that submitted the tag
+    run = instrumentation.get_run()
+    if run_id is not None and (run is None or run.run_id != run_id):
+        instrumentation.start_run('predict', run_id)
+    conn = _worker_state['conn']
+    try:
+        if conn is None or conn.closed:
+            conn = _worker_state['conn'] = pg.connect(**_worker_state['db_config'])
+            score_writer.prepare_statements(conn)
+        with conn.cursor() as cursor:
+            result = score_tag_isolated(conn, cursor, tag_anomaly_id, tag_name, _worker_state['models'],
+                                        dataset, checkpoint, shared, _worker_state['resolver'], claims)
+        instrumentation.flush(conn)
+        return result
+    except (pg.OperationalError, pg.InterfaceError) as e:
+        # Reconnect on the next tag
+        print(f"Database connection lost while scoring {tag_name}: {e}")
+        if conn is not None and not conn.closed:
+            conn.close()
+        _worker_state['conn'] = None
+        return 'failed', str(e)
+
+
+class TagScoringPool:
+    """
+    Worker processes scoring tags in parallel, each one with its own connection and models.
+    """
+
+    def __init__(self, workers, db_config, models_dir=MODELS_DIR):
+        self.workers = workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(db_config, models_dir))
+
+    def score(self, tags, tick_data, deadline=None, stop_event=None, shared=None, claims=None):
+        """
+        Scores the tags, skipping the ones not started when the deadline passes or a stop is requested.
+
+        Args:
+            tags: [(tag_anomaly_id, tag_name)].
+            tick_data: {tag_name: (dataset, checkpoint)} from fetch_tick_data.
+            shared: The tick's prep.SharedFeatures, already computed (compute_all).
+            claims: The replicas.TagClaims of the tick, checked by the workers before writing.
+
+        Returns:
+            dict: {tag_name: (status, detail)}.
+        """
+        run = instrumentation.get_run()
+        run_id = run.run_id if run is not None else None
+        futures = {self.executor.submit(_worker_score_tag, tag_anomaly_id, tag_name, *tick_data[tag_name], deadline,
+                                        run_id, shared, claims): tag_name
+                   for tag_anomaly_id, tag_name in tags}
+        results = {}
+        pending = set(futures)
+        while pending:
+            # Wake up regularly to honour the deadline and stop requests
+            done, pending = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = self._result(future)
+            expired = deadline is not None and time.time() > deadline
+            stopping = stop_event is not None and stop_event.is_set()
+            if expired or stopping:
+                reason = 'deadline reached' if expired else 'stop requested'
+                for future in list(pending):
+                    if future.cancel():
+                        results[futures[future]] = ('skipped', reason)
+                        pending.discard(future)
+                # Tags already running are left to finish, they hold their own transaction
+        return results
+
+    def _result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            # The worker process itself died (e.g. out of memory)
+            return 'failed', str(e)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+"""******************* Daemon mode *******************"""
+
+class PredictorDaemon:
+    """
+    Long-running predictor: models stay loaded, the connections are pooled, and ticks
+    follow CRON_INTERVAL without drifting or overlapping.
 
+    With SHARD_TAGS, several replicas share the tags: each tick (identified by its
+    scheduled time, the same for all of them) a tag is scored by the replica claiming it.
+    """
 
+    def __init__(self, db_config, schedule):
+        self.db_config = db_config
+        self.schedule = schedule
+        self.model_cache = ModelCache()
+        self.stop_event = threading.Event()
+        self.pool = None
+        self.scoring_pool = None
+        self.heartbeat = None
+        self.resolver = data_fetch.ParamResolver()
+
+    def request_stop(self, signum, frame):
+        print(f"Received signal {signum}, stopping after the current tag...")
+        self.stop_event.set()
+
+    def run_tick(self, deadline, tick_at=None):
+        conn = self.pool.getconn()
+        # A pipelined tick writes the scores on a second connection
+        write_conn = self.pool.getconn() if PIPELINE_DEPTH > 0 and self.scoring_pool is None else None
+        discard = False
+        instrumentation.start_run('predict')
+        try:
+            for connection in (conn, write_conn):
+                if connection is not None:
+                    score_writer.prepare_statements(connection)
+            with conn.cursor() as cursor:
+                run_predictions(conn, cursor, self.model_cache, stop_event=self.stop_event,
+                                deadline=deadline, scoring_pool=self.scoring_pool, resolver=self.resolver,
+                                write_conn=write_conn,
+                                claims=replicas.TagClaims(tick_at) if self.heartbeat is not None else None)
+        except (pg.OperationalError, pg.InterfaceError) as e:
+            # Broken connection: drop it, the pool opens a new one on the next tick
+            print(f"Database connection lost: {e}")
+            discard = True
+        except Exception as e:
+            print(e)
+            for connection in (conn, write_conn):
+                if connection is not None and not connection.closed:
+                    connection.rollback()
+        finally:
+            instrumentation.finish_run(None if discard or conn.closed else conn)
+            self.pool.putconn(conn, close=discard or bool(conn.closed))
+            if write_conn is not None:
+                self.pool.putconn(write_conn, close=discard or bool(write_conn.closed))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        print("Connecting to the PostgreSQL database...")
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 2 if PIPELINE_DEPTH > 0 else 1, **self.db_config)
+        if PREDICT_WORKERS > 1:
+            self.scoring_pool = TagScoringPool(PREDICT_WORKERS, self.db_config)
+        if replicas.SHARD_TAGS:
+            self.heartbeat = replicas.Heartbeat(self.db_config)
+            self.heartbeat.start()
+            print(f"Sharing the tags with the other replicas as {replicas.REPLICA_ID}")
+        print(f"Predictor daemon started, schedule '{self.schedule.expression}', {PREDICT_WORKERS} worker(s)"
+              + (f", pipeline depth {PIPELINE_DEPTH}" if PIPELINE_DEPTH > 0 and self.scoring_pool is None else ""))
+        try:
+            next_run = self.schedule.next_after(datetime.datetime.now())
+            while not self.stop_event.is_set():
+                wait = (next_run - datetime.datetime.now()).total_seconds()
+                if self.stop_event.wait(max(wait, 0)):
+                    break
+                print(f"Tick {next_run:%Y-%m-%d %H:%M}")
+                # Tags not started by the time the next tick is due are skipped
+                following = self.schedule.next_after(next_run)
+                self.run_tick(following.timestamp(), next_run.astimezone())
+                # Ticks that fired while this one was running are skipped, not queued
+                now = datetime.datetime.now()
+                if following <= now:
+                    following = self.schedule.next_after(now)
+                    print(f"Tick overran its interval, next one at {following:%Y-%m-%d %H:%M}")
+                next_run = following
+        finally:
+            if self.scoring_pool is not None:
+                self.scoring_pool.shutdown()
+            if self.heartbeat is not None:
+                # Leaving: the other replicas take the tags over from the next tick
+                self.heartbeat.stop()
+            self.pool.closeall()
+            print("PostgreSQL connection closed.")
 
 
 if __name__ == "__main__":
 
-    db_config = {
-        'database': POSTGRES_DB ,
-        'user': POSTGRES_USER,
-        'password': POSTGRES_PASSWORD,
-        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
-        'port': POSTGRES_PORT       # Default PostgreSQL port
-    }
+    db_config = get_db_config()
+
+    if '--daemon' in sys.argv[1:]:
+        PredictorDaemon(db_config, CronSchedule(CRON_INTERVAL)).run()
+        sys.exit(0)
 
     # Parameters for the query
     # tags = [(1, 'PIC11151A'), (2, 'FIC11121'), (3, 'FIC11120'), (4, 'TIC12102'), (5, 'PIC05101'), (6, 'PIC07814')] 
@@ -109,47 +873,26 @@ if __name__ == "__main__":
     # Creating postgres connection
     conn = None
     cursor = None
+    write_conn = None
     try:
         print("Connecting to the PostgreSQL database...")
         conn = pg.connect(**db_config)
 
         # Create a cursor
         cursor = conn.cursor()
-        tags = get_anomaly_tags(cursor)
         if conn and cursor:
-            for tag_anomaly_id, tag_name in tags:
-                tag_name = tag_name.split("\\")[0] #remove the \AS from the tag name
-                dataset= get_data_with_in_clause(conn, cursor, tag_name)
-                current_path = os.path.dirname(os.path.abspath(__file__))
-                model_path = os.path.join(current_path, tag_name)
-                # dataset = pd.read_csv(os.path.join(current_path,'csv', 'Malha_11151A.csv'))
-                dataset = prep.treat_data(dataset, tag_name)
-                dataset_filtered = prep.filter_columns(dataset)
-
-                m = load_model(f'./models/{tag_name}')
-                predictions = predict_model(m, data=dataset_filtered.drop(columns=['Timestamp']))
-
-                window = 15 #The script will run every 15 minutes
-
-                predictions = pd.concat([predictions, dataset['Timestamp']], axis=1).tail(window)
-                for index, row in predictions.iterrows():
-                    # Create the INSERT query
-
-                    query = f"""INSERT INTO {VARIABLES_SCHEMA}.inspections_calc (id_param_fk, value, dt) 
-                            select * from
-                            (
-                            select %s as id_param_fk,
-                                %s as value,
-                                %s as dt
-                                ) as sub
-                            where sub.dt > (select case when max(dt) is null then '2025-01-01'::timestamptz else max(dt) end 
-                                            from {VARIABLES_SCHEMA}.inspections_calc where id_param_fk = %s); """
-
-                    values = (tag_anomaly_id, row['Anomaly_Score'], row['Timestamp'], tag_anomaly_id)
-                    # Execute the query
-                    cursor.execute(query, values)
-                print("Success")
-                conn.commit()
+            deadline = CronSchedule(CRON_INTERVAL).next_after(datetime.datetime.now()).timestamp()
+            scoring_pool = TagScoringPool(PREDICT_WORKERS, db_config) if PREDICT_WORKERS > 1 else None
+            if PIPELINE_DEPTH > 0 and scoring_pool is None:
+                write_conn = pg.connect(**db_config)
+            instrumentation.start_run('predict')
+            try:
+                run_predictions(conn, cursor, ModelCache(), deadline=deadline, scoring_pool=scoring_pool,
+                                write_conn=write_conn)
+            finally:
+                if scoring_pool is not None:
+                    scoring_pool.shutdown()
+                instrumentation.finish_run(conn)
         else:
             print('No connection or cursor was found')
     except Exception as e:
@@ -158,9 +901,9 @@ if __name__ == "__main__":
             print("Error while conecting to database!")
         print(e)
     finally:
+        if write_conn is not None:
+            write_conn.close()
         if conn and cursor:
             cursor.close()
             conn.close()
             print("PostgreSQL connection closed.")
-
-
@@ -0,0 +1,227 @@
+import json
+import os
+import pandas as pd
+from dotenv import load_dotenv
+import pre_processing as prep
+import data_fetch
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Folder of the local day-partitioned copy of the history (Parquet, needs pyarrow)
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+# DATA_CACHE=1: train.py and rewind.py read the history through the cache, which then
+# replaces train.py's TRAIN_FETCH_MODE (missing days are fetched CACHE_FETCH_DAYS at a time)
+CACHE_ENABLED = os.environ.get("DATA_CACHE", "0") == "1"
+# Days fetched from PostgreSQL per query when filling the cache
+CACHE_FETCH_DAYS = int(os.environ.get("CACHE_FETCH_DAYS", 7))
+# Hours PostgreSQL must have data past the end of a day before it counts as complete, for
+# the rows of the day written late
+CACHE_SETTLE_HOURS = float(os.environ.get("CACHE_SETTLE_HOURS", 1))
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def to_utc(moment):
+    """
+    Returns moment as a UTC Timestamp, naive values being taken as UTC.
+    """
+    moment = pd.Timestamp(moment)
+    return moment.tz_localize('UTC') if moment.tz is None else moment.tz_convert('UTC')
+
+
+def get_days(start_date, end_date):
+    """
+    Returns the UTC days (midnight Timestamps) covering [start_date, end_date].
+    """
+    return list(pd.date_range(to_utc(start_date).floor('D'), to_utc(end_date).floor('D'), freq='D'))
+
+
+""" ******************* Day-partitioned Parquet cache ******************* """
+
+class DataCache:
+    """
+    Local copy of the history of each tag, one Parquet file per tag and UTC day:
+
+        <CACHE_DIR>/raw/<tag>/<YYYY-MM-DD>.parquet       pivoted raw signals
+        <CACHE_DIR>/features/<tag>/<YYYY-MM-DD>.parquet  rolling features (optional)
+
+    A manifest.json next to the files records which days are complete, i.e. were
+    fetched after PostgreSQL already had data CACHE_SETTLE_HOURS past their end. Complete
+    days are never fetched again; the others (the current day, typically) are fetched on
+    every use, so a refresh only appends what is newer than the cache. A feature day is
+    recomputed whenever one of the two raw days it was computed from was fetched again.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.stats = {kind: {'hits': 0, 'misses': 0} for kind in ('raw', 'features')}
+        self.rows_fetched = 0
+
+    """ ***** Files ***** """
+
+    def get_tag_dir(self, kind, tag_name):
+        return os.path.join(self.cache_dir, kind, tag_name)
+
+    def get_day_path(self, kind, tag_name, day):
+        return os.path.join(self.get_tag_dir(kind, tag_name), f'{day:%Y-%m-%d}.parquet')
+
+    def load_manifest(self, kind, tag_name):
+        path = os.path.join(self.get_tag_dir(kind, tag_name), 'manifest.json')
+        if not os.path.exists(path):
+            return {'signature': None, 'days': {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def save_manifest(self, kind, tag_name, manifest):
+        path = os.path.join(self.get_tag_dir(kind, tag_name), 'manifest.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def write_day(self, kind, tag_name, day, df):
+        os.makedirs(self.get_tag_dir(kind, tag_name), exist_ok=True)
+        path = self.get_day_path(kind, tag_name, day)
+        tmp_path = f'{path}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def read_day(self, kind, tag_name, day):
+        return pd.read_parquet(self.get_day_path(kind, tag_name, day))
+
+    """ ***** Raw signals ***** """
+
+    def fetch_raw_days(self, cursor, resolver, tag_name, days, manifest, upper):
+        """
+        Fetches consecutive days from PostgreSQL and writes one pivoted file per day.
+        """
+        start = days[0]
+        end = days[-1] + ONE_DAY - pd.Timedelta(microseconds=1)
+        dataset = data_fetch.fetch_tag_range(cursor, resolver, tag_name, start, end)
+        self.rows_fetched += len(dataset)
+        pivoted = prep.pivot_dataframe_column(dataset, 'Timestamp', 'Variable', 'Value')
+        if pivoted is None:
+            raise ValueError(f"Could not pivot the data of {tag_name}")
+        day_of_row = pivoted['Timestamp'].dt.floor('D') if len(pivoted) else pd.Series(dtype='datetime64[ns, UTC]')
+        for day in days:
+            rows = pivoted[(day_of_row == day).to_numpy()].reset_index(drop=True)
+            self.write_day('raw', tag_name, day, rows)
+            manifest['days'][f'{day:%Y-%m-%d}'] = {
+                'complete': upper is not None and upper >= day + ONE_DAY + pd.Timedelta(hours=CACHE_SETTLE_HOURS),
+                'rows': len(rows),
+                # Tells the feature days which fetch of the raw day they were computed from
+                'fetched_upper': None if upper is None else upper.isoformat(),
+            }
+
+    def ensure_raw(self, cursor, resolver, tag_name, days):
+        """
+        Makes sure the raw files of the given days are in the cache, fetching the missing
+        or incomplete ones in runs of at most CACHE_FETCH_DAYS consecutive days.
+        """
+        manifest = self.load_manifest('raw', tag_name)
+        missing = [day for day in days if not manifest['days'].get(f'{day:%Y-%m-%d}', {}).get('complete')]
+        self.stats['raw']['hits'] += len(days) - len(missing)
+        self.stats['raw']['misses'] += len(missing)
+        if not missing:
+            return
+
+        upper = data_fetch.get_upper_bound(cursor)
+        upper = to_utc(upper) if upper is not None else None
+        run = []
+        for day in missing:
+            if run and (day - run[-1] != ONE_DAY or len(run) == CACHE_FETCH_DAYS):
+                self.fetch_raw_days(cursor, resolver, tag_name, run, manifest, upper)
+                run = []
+            run.append(day)
+        self.fetch_raw_days(cursor, resolver, tag_name, run, manifest, upper)
+        self.save_manifest('raw', tag_name, manifest)
+
+    def iter_raw(self, cursor, resolver, tag_name, start_date, end_date):
+        """
+        Yields the pivoted raw signals of [start_date, end_date] one day at a time,
+        filling the cache first where needed.
+        """
+        start, end = to_utc(start_date), to_utc(end_date)
+        days = get_days(start, end)
+        self.ensure_raw(cursor, resolver, tag_name, days)
+        for day in days:
+            rows = self.read_day('raw', tag_name, day)
+            if day == days[0] or day == days[-1]:
+                rows = rows[(rows['Timestamp'] >= start) & (rows['Timestamp'] <= end)].reset_index(drop=True)
+            yield rows
+
+    def get_raw(self, cursor, resolver, tag_name, start_date, end_date):
+        """
+        Returns the pivoted raw signals of [start_date, end_date], like
+        prep.pivot_dataframe_column on data_fetch.fetch_tag_range's result.
+        """
+        days = [rows for rows in self.iter_raw(cursor, resolver, tag_name, start_date, end_date) if len(rows)]
+        if not days:
+            return pd.DataFrame(columns=['Timestamp'])
+        return pd.concat(days, ignore_index=True)
+
+    def refresh(self, cursor, resolver, tag_name, start_date):
+        """
+        Brings the raw cache of a tag up to date from start_date on: complete days are
+        skipped, so only the last cached day and the newer ones are fetched.
+        """
+        upper = data_fetch.get_upper_bound(cursor)
+        if upper is not None:
+            self.ensure_raw(cursor, resolver, tag_name, get_days(start_date, upper))
+
+    """ ***** Features ***** """
+
+    def get_features(self, cursor, resolver, tag_name, start_date, end_date):
+        """
+        Returns the rolling features (prep.treat_data) of [start_date, end_date].
+
+        Each day is computed from the raw signals of that day and the previous one,
+        which covers the 12h the windows look back. A complete feature day is reused as
+        long as both raw days are still the ones it was computed from. Feature files are
+        dropped when the aggregated columns or window sizes change.
+        """
+        start, end = to_utc(start_date), to_utc(end_date)
+        signature = {'columns': prep.get_columns_to_aggregate(tag_name), 'window_sizes': prep.WINDOW_SIZES}
+        manifest = self.load_manifest('features', tag_name)
+        if manifest['signature'] != signature:
+            manifest = {'signature': signature, 'days': {}}
+        raw_days = self.load_manifest('raw', tag_name)['days']
+
+        parts = []
+        for day in get_days(start, end):
+            key = f'{day:%Y-%m-%d}'
+            raw_keys = [f'{day - ONE_DAY:%Y-%m-%d}', key]
+            entry = manifest['days'].get(key, {})
+            if entry.get('complete') and entry.get('raw') == [raw_days.get(raw_key) for raw_key in raw_keys]:
+                self.stats['features']['hits'] += 1
+                features = self.read_day('features', tag_name, day)
+            else:
+                self.stats['features']['misses'] += 1
+                self.ensure_raw(cursor, resolver, tag_name, [day - ONE_DAY, day])
+                raw = pd.concat([self.read_day('raw', tag_name, day - ONE_DAY), self.read_day('raw', tag_name, day)],
+                                ignore_index=True)
+                features = prep.treat_pivoted_data(raw, tag_name) if len(raw) else pd.DataFrame(columns=['Timestamp'])
+                if len(features):
+                    features = features[features['Timestamp'] >= day].reset_index(drop=True)
+                self.write_day('features', tag_name, day, features)
+                raw_days = self.load_manifest('raw', tag_name)['days']
+                manifest['days'][key] = {'complete': raw_days[key]['complete'], 'rows': len(features),
+                                         'raw': [raw_days[raw_key] for raw_key in raw_keys]}
+            if len(features):
+                parts.append(features[(features['Timestamp'] >= start) & (features['Timestamp'] <= end)])
+
+        os.makedirs(self.get_tag_dir('features', tag_name), exist_ok=True)
+        self.save_manifest('features', tag_name, manifest)
+        if not parts:
+            return pd.DataFrame(columns=['Timestamp'])
+        return pd.concat(parts, ignore_index=True)
+
+    """ ***** Statistics ***** """
+
+    def report(self):
+        for kind, stats in self.stats.items():
+            looked_up = stats['hits'] + stats['misses']
+            if looked_up:
+                print(f"{kind} cache: {stats['hits']}/{looked_up} day(s) hit ({100 * stats['hits'] / looked_up:.0f}%)")
+        print(f"{self.rows_fetched} rows fetched from PostgreSQL")
@@ -0,0 +1,200 @@
+import os
+import socket
+import hashlib
+import threading
+import psycopg2 as pg
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+# Share the anomaly tags with the other predictor replicas (claims in anomaly_monitor_tag_claims)
+SHARD_TAGS = os.environ.get("SHARD_TAGS", "0") == "1"
+# Unique per replica: the container's hostname by default
+REPLICA_ID = os.environ.get("REPLICA_ID") or f'{socket.gethostname()}-{os.getpid()}'
+REPLICA_HEARTBEAT_SECONDS = float(os.environ.get("REPLICA_HEARTBEAT_SECONDS") or 10)
+# A replica without heartbeat for this long is considered dead: its tags move to the others
+REPLICA_TTL_SECONDS = float(os.environ.get("REPLICA_TTL_SECONDS") or 30)
+# Claims are kept this long for get_replica_load
+CLAIMS_RETENTION_DAYS = 7
+
+
+""" ******************* Membership ******************* """
+
+def get_rendezvous_owner(tag_name, replica_ids):
+    """
+    Returns the replica a tag belongs to (highest random weight hashing): when a replica
+    joins or leaves, only the tags it gains or had move.
+    """
+    return max(replica_ids, key=lambda replica_id: hashlib.md5(f'{replica_id}/{tag_name}'.encode()).digest())
+
+
+def send_heartbeat(cursor, replica_id):
+    cursor.execute(f"""
+        INSERT INTO {VARIABLES_SCHEMA}.anomaly_monitor_replicas (replica_id, heartbeat_at)
+        VALUES (%s, now())
+        ON CONFLICT (replica_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at;""", (replica_id,))
+
+
+def get_live_replicas(cursor, ttl=REPLICA_TTL_SECONDS):
+    cursor.execute(f"""
+        SELECT replica_id FROM {VARIABLES_SCHEMA}.anomaly_monitor_replicas
+        WHERE heartbeat_at > now() - %s * interval '1 second'
+        ORDER BY replica_id;""", (ttl,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+class Heartbeat:
+    """
+    Keeps the replica's heartbeat fresh from a background thread with its own connection,
+    and removes it on stop so the others take its tags over at once.
+    """
+
+    def __init__(self, db_config, replica_id=REPLICA_ID, interval=REPLICA_HEARTBEAT_SECONDS):
+        self.db_config = db_config
+        self.replica_id = replica_id
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def beat(self, conn):
+        with conn.cursor() as cursor:
+            send_heartbeat(cursor, self.replica_id)
+        conn.commit()
+
+    def run(self):
+        conn = None
+        while not self.stop_event.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = pg.connect(**self.db_config)
+                self.beat(conn)
+            except (pg.OperationalError, pg.InterfaceError) as e:
+                # Missing beats only make the others take the tags over
+                print(f"Could not send the heartbeat of {self.replica_id}: {e}")
+                if conn is not None and not conn.closed:
+                    conn.close()
+                conn = None
+            self.stop_event.wait(self.interval)
+        try:
+            if conn is None or conn.closed:
+                conn = pg.connect(**self.db_config)
+            with conn.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {VARIABLES_SCHEMA}.anomaly_monitor_replicas WHERE replica_id = %s;",
+                               (self.replica_id,))
+            conn.commit()
+        except (pg.OperationalError, pg.InterfaceError) as e:
+            print(f"Could not remove the replica {self.replica_id}, it expires after {REPLICA_TTL_SECONDS}s: {e}")
+        finally:
+            if conn is not None and not conn.closed:
+                conn.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='heartbeat', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+""" ******************* Tag claims ******************* """
+
+class TagClaims:
+    """
+    The claims of one replica in one tick: a tag's scores are written by the replica whose
+    claim on (tick_at, tag) is recorded, so by one of them only.
+
+    Every replica first claims the tags rendezvous hashing gives it among the live
+    replicas, then the tags still unclaimed (a replica that died before claiming, or
+    joined without having ticked yet). The claim of a replica whose heartbeat expired
+    before it finished is taken over. A replica that stalled past its heartbeat may still
+    be scoring such a tag: hold, in the transaction of its scores, makes sure they are
+    only written while the claim is its own.
+    """
+
+    def __init__(self, tick_at, replica_id=REPLICA_ID, ttl=REPLICA_TTL_SECONDS):
+        self.tick_at = tick_at
+        self.replica_id = replica_id
+        self.ttl = ttl
+
+    def claim(self, cursor, tag_names):
+        """
+        Claims the tags free in this tick, in sorted order so concurrent claims don't deadlock.
+
+        Returns:
+            list: The tags claimed.
+        """
+        cursor.execute(f"""
+            INSERT INTO {VARIABLES_SCHEMA}.anomaly_monitor_tag_claims AS c (tick_at, tag, replica_id, claimed_at)
+            SELECT %(tick_at)s, tag, %(replica_id)s, now() FROM unnest(%(tags)s::text[]) AS t(tag)
+            ON CONFLICT (tick_at, tag) DO UPDATE SET replica_id = EXCLUDED.replica_id, claimed_at = EXCLUDED.claimed_at
+            WHERE c.finished_at IS NULL AND NOT EXISTS (
+                SELECT 1 FROM {VARIABLES_SCHEMA}.anomaly_monitor_replicas r
+                WHERE r.replica_id = c.replica_id AND r.heartbeat_at > now() - %(ttl)s * interval '1 second')
+            RETURNING tag;""", {'tick_at': self.tick_at, 'replica_id': self.replica_id, 'tags': sorted(tag_names),
+                                'ttl': self.ttl})
+        claimed = {row[0] for row in cursor.fetchall()}
+        cursor.connection.commit()
+        return [tag_name for tag_name in tag_names if tag_name in claimed]
+
+    def claim_own(self, cursor, tag_names):
+        """
+        Claims the tags rendezvous hashing gives this replica among the live ones, after
+        refreshing its heartbeat and pruning the claims older than CLAIMS_RETENTION_DAYS.
+        """
+        send_heartbeat(cursor, self.replica_id)
+        cursor.execute(f"DELETE FROM {VARIABLES_SCHEMA}.anomaly_monitor_tag_claims WHERE tick_at < now() - %s * interval '1 day';",
+                       (CLAIMS_RETENTION_DAYS,))
+        cursor.connection.commit()
+        replica_ids = get_live_replicas(cursor, self.ttl)
+        own = [tag_name for tag_name in tag_names if get_rendezvous_owner(tag_name, replica_ids) == self.replica_id]
+        return self.claim(cursor, own)
+
+    def hold(self, cursor, tag_name):
+        """
+        Finishes this replica's claim on a tag in the caller's transaction, before the tag's
+        scores are written in it. Once committed the claim can't be taken over; if it already
+        was, nothing changes.
+
+        Returns:
+            bool: False if the claim is no longer this replica's: the scores must not be written.
+        """
+        cursor.execute(f"""
+            UPDATE {VARIABLES_SCHEMA}.anomaly_monitor_tag_claims SET finished_at = now()
+            WHERE tick_at = %s AND tag = %s AND replica_id = %s AND finished_at IS NULL
+            RETURNING 1;""", (self.tick_at, tag_name, self.replica_id))
+        return cursor.fetchone() is not None
+
+    def finish(self, cursor, results):
+        """
+        Records the outcome of the claimed tags scored ({tag_name: (status, detail)}).
+        """
+        for tag_name, (status, detail) in results.items():
+            cursor.execute(f"""
+                UPDATE {VARIABLES_SCHEMA}.anomaly_monitor_tag_claims
+                SET finished_at = now(), status = %s, minutes = %s
+                WHERE tick_at = %s AND tag = %s AND replica_id = %s;""",
+                           (status, detail if status == 'ok' else None, self.tick_at, tag_name, self.replica_id))
+        cursor.connection.commit()
+
+
+def get_replica_load(cursor, since):
+    """
+    Returns the tags and busy seconds of every replica in the ticks since a time.
+
+    Returns:
+        list: [{'replica_id', 'ticks', 'tags', 'unfinished', 'minutes', 'busy_s'}].
+    """
+    # A replica is busy in a tick from its first claim to its last finished tag
+    cursor.execute(f"""
+        SELECT replica_id, count(*), sum(tags), sum(unfinished), sum(minutes), coalesce(extract(epoch FROM sum(busy)), 0)
+        FROM (SELECT replica_id, tick_at, count(*) AS tags, count(*) FILTER (WHERE finished_at IS NULL) AS unfinished,
+                     coalesce(sum(minutes), 0) AS minutes, max(finished_at) - min(claimed_at) AS busy
+              FROM {VARIABLES_SCHEMA}.anomaly_monitor_tag_claims
+              WHERE tick_at >= %s
+              GROUP BY replica_id, tick_at) ticks
+        GROUP BY replica_id ORDER BY replica_id;""", (since,))
+    return [{'replica_id': replica_id, 'ticks': ticks, 'tags': tags, 'unfinished': unfinished, 'minutes': int(minutes),
+             'busy_s': float(busy)} for replica_id, ticks, tags, unfinished, minutes, busy in cursor.fetchall()]
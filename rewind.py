@@ -1,8 +1,16 @@
-from pycaret.anomaly import load_model, predict_model
 import os
+import sys
+import json
+import time
+import signal
+import argparse
+import concurrent.futures
 import pandas as pd
-from sqlalchemy.engine import cursor
 import pre_processing as prep
+import data_fetch
+import raw_cache
+import predict
+import instrumentation
 import psycopg2 as pg
 from dotenv import load_dotenv
 
@@ -18,156 +26,275 @@ MENDIX_SCHEMA = os.environ.get("MENDIX_SCHEMA")
 VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
 POSTGRES_DB = os.environ.get("POSTGRES_DB")
 POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+BACKFILL_CHUNK_HOURS = int(os.environ.get("BACKFILL_CHUNK_HOURS", 24))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", 1))
+# Completed chunks of the current backfill, so an interrupted run resumes where it stopped
+BACKFILL_STATE_FILE = os.environ.get("BACKFILL_STATE_FILE", os.path.join(prep.CHECKPOINT_DIR, 'backfill.json'))
 
 
-""" ******************* PostgreSQL Connection and Querying ******************* """
+"""******************* Backfill *******************"""
 
-def get_data_with_in_clause(cursor, tag_name, lower_offset, upper_offset):
+def split_chunks(start, end, chunk_hours):
     """
-    Args:
+    Splits [start, end] into consecutive half-open [chunk_start, chunk_end) ranges of chunk_hours.
+    """
+    bounds = list(pd.date_range(start, end, freq=pd.Timedelta(hours=chunk_hours)))
+    # The last chunk also covers end itself
+    bounds.append(end + pd.Timedelta(microseconds=1))
+    return [(chunk_start, chunk_end) for chunk_start, chunk_end in zip(bounds, bounds[1:]) if chunk_start < chunk_end]
 
-    Returns:
-        pandas.DataFrame: A DataFrame containing the query results,
-                          or None if an error occurs or no data is found.
-                          Returns an empty DataFrame if filter_values is empty.
+
+def resolve_range(path, tag_names, chunk_hours, start=None, end=None, newest=None, restart=False):
+    """
+    Returns the (start, end) UTC Timestamps of a backfill. The bounds left out are the
+    ones of the unfinished backfill recorded in path for the same tags and chunk size, so
+    running the same command again resumes it instead of scoring a range moved by the
+    newest data. Otherwise end defaults to newest and start to 4 weeks before end.
+    """
+    if (start is None or end is None) and not restart and os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        signature = state.get('signature', {})
+        if (not state.get('complete') and signature.get('tags') == sorted(tag_names)
+                and signature.get('chunk_hours') == chunk_hours
+                and (start is None or raw_cache.to_utc(start).isoformat() == signature['start'])
+                and (end is None or raw_cache.to_utc(end).isoformat() == signature['end'])):
+            print(f"Resuming the backfill from {signature['start']} to {signature['end']} recorded in {path}")
+            return pd.Timestamp(signature['start']), pd.Timestamp(signature['end'])
+    if end is None and newest is None:
+        raise ValueError("No end given and no data in inspections")
+    end = raw_cache.to_utc(end if end is not None else newest)
+    start = raw_cache.to_utc(start) if start is not None else end - pd.Timedelta(weeks=4)
+    return start, end
+
+
+def load_state(path, signature):
     """
-    df = None
-
-    # Construct the SQL query using a placeholder for the IN clause
-    # Note: We use f-string for table/column names (use with caution)
-    #       but %s placeholder for the actual values to prevent SQL injection.
-    # sql_query = f"SELECT * FROM public.chlorum_dump WHERE \"Timestamp\" BETWEEN NOW() AND (NOW() - INTERVAL '6 HOUR');"
-    sql_query = f"""
-        select dt as "Timestamp"
-    ,p.description as "Variable"
-    ,AVG(value) as "Value"
-    from {VARIABLES_SCHEMA}.inspections i 
-    inner join {VARIABLES_SCHEMA}.params p on i.id_param_fk = p.id 
-    WHERE (p.description like '%{tag_name}%' or p.description = 'II113RC001\\U')
-    and dt between (select max(dt) from {VARIABLES_SCHEMA}.inspections) - interval '{lower_offset} WEEK' and (select max(dt) from {VARIABLES_SCHEMA}.inspections) - interval '{upper_offset} WEEK'
-    GROUP BY "Timestamp", "Variable"
-    ORDER BY "Timestamp" asc;
+    Returns the completed chunks recorded for this backfill ({'signature', 'done': {tag: [chunk starts]}}),
+    or an empty state if the file is missing or belongs to another backfill.
     """
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('signature') == signature:
+            return state
+        print(f"{path} belongs to another backfill, starting over")
+    return {'signature': signature, 'done': {}}
 
-    try:
-        # print(f"Executing query: {cursor.mogrify(sql_query, (values_tuple,)).decode('utf-8')}") # Show rendered query
-        # cursor.execute(sql_query, (values_tuple,)) # Crucial: pass values tuple inside another tuple
-        cursor.execute(sql_query,) # Crucial: pass values tuple inside another tuple
 
-        # Fetch all the results
-        results = cursor.fetchall()
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def score_chunk(conn, cursor, resolver, cache, model_cache, tag_anomaly_id, tag_name, chunk_start, chunk_end):
+    """
+    Rescores [chunk_start, chunk_end) of a tag and replaces its scores in one transaction,
+    reading from 12h before chunk_start (predict.score_range).
+
+    Returns:
+        int: The number of minutes scored.
+    """
+    return predict.score_range(conn, cursor, resolver, model_cache, tag_anomaly_id, tag_name, chunk_start, chunk_end,
+                               cache)
+
 
-        if results:
-            # Get column names from the cursor description
-            colnames = [desc[0] for desc in cursor.description]
-            # Create the Pandas DataFrame
-            df = pd.DataFrame(results, columns=colnames)
-            print(f"Successfully fetched {len(df)} rows.")
-            print(f"Column name: {df.columns}")
-        else:
-            print("No data found for the given filter values.")
-            # Return empty dataframe with columns if possible
-            if cursor.description:
-                 colnames = [desc[0] for desc in cursor.description]
-                 df = pd.DataFrame(columns=colnames)
-            else:
-                 df = pd.DataFrame()
+# Connection, models and caches of the process scoring chunks, set up by _setup_worker
+_worker_state = {}
 
 
-    except (Exception, pg.Error) as error:
-        print(f"Error while connecting to or querying PostgreSQL: {error}")
-        df = None # Indicate error
+def _setup_worker(db_config):
+    _worker_state['db_config'] = db_config
+    _worker_state['conn'] = None
+    _worker_state['models'] = predict.ModelCache()
+    _worker_state['resolver'] = data_fetch.ParamResolver()
+    _worker_state['cache'] = raw_cache.DataCache() if raw_cache.CACHE_ENABLED else None
 
 
-    return df
+def _init_pool_worker(db_config):
+    # Ctrl+C reaches the whole process group, let the parent decide when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _setup_worker(db_config)
 
-"""******************* Clear old model predictions *******************"""
 
-def delete_old_data(cursor, tag_anomaly_id):
+def _worker_score_chunk(tag_anomaly_id, tag_name, chunk_start, chunk_end, run_id=None):
+    # The stage records of a pool worker share the run id of the backfill
+    run = instrumentation.get_run()
+    if run_id is not None and (run is None or run.run_id != run_id):
+        instrumentation.start_run('rewind', run_id)
+    conn = _worker_state['conn']
+    if conn is None or conn.closed:
+        conn = _worker_state['conn'] = pg.connect(**_worker_state['db_config'])
+    try:
+        with conn.cursor() as cursor, instrumentation.tag(tag_name):
+            minutes = score_chunk(conn, cursor, _worker_state['resolver'], _worker_state['cache'], _worker_state['models'],
+                                  tag_anomaly_id, tag_name, chunk_start, chunk_end)
+        instrumentation.flush(conn)
+        return minutes
+    except (pg.OperationalError, pg.InterfaceError):
+        # Reconnect on the next chunk
+        conn.close()
+        _worker_state['conn'] = None
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def warm_cache(db_config, tags, start, end):
     """
-    Deletes old data from the database.
+    Fills the raw cache for the whole backfill up front, so the workers only read it.
     """
-    delete_query = f"""DELETE FROM {VARIABLES_SCHEMA}.inspections_calc WHERE id_param_fk = %s"""
-    # Execute the delete query
-    cursor.execute(delete_query, (tag_anomaly_id))
+    cache = raw_cache.DataCache()
+    resolver = data_fetch.ParamResolver()
+    conn = pg.connect(**db_config)
+    try:
+        with conn.cursor() as cursor:
+            days = raw_cache.get_days(start - prep.get_history_horizon(prep.WINDOW_SIZES), end)
+            for _, tag_name in tags:
+                cache.ensure_raw(cursor, resolver, tag_name, days)
+        conn.commit()
+    finally:
+        conn.close()
+    cache.report()
 
 
-"""******************* Insert new model predictions *******************"""
-def insert_new_data(cursor, values):
-    """
-    Inserts new data into the database.
+def run_backfill(db_config, tags, start, end, chunk_hours=BACKFILL_CHUNK_HOURS, workers=BACKFILL_WORKERS,
+                 state_path=BACKFILL_STATE_FILE, restart=False):
     """
-    insert_query = f"""INSERT INTO {VARIABLES_SCHEMA}.inspections_calc (id_param_fk, value, dt) 
-                        SELECT %s AS id_param_fk,
-                               %s AS value,
-                               %s AS dt
-                        WHERE dt < (SELECT CASE WHEN min(dt) IS NULL THEN current_timestamp ELSE min(dt) END 
-                                    FROM {VARIABLES_SCHEMA}.inspections_calc WHERE id_param_fk = %s);"""
-    # Execute the insert query
-    cursor.execute(insert_query, values)
+    Rescores tags over [start, end], chunk by chunk, in parallel worker processes.
 
+    Every completed chunk is recorded in state_path; running the same backfill again
+    only scores the chunks still missing. Once all of them are, the state is marked
+    complete.
+
+    Args:
+        tags: [(tag_anomaly_id, tag_name)].
+        start, end: UTC Timestamps.
+        restart: Ignore the recorded chunks and score everything again.
+
+    Returns:
+        dict: minutes scored, seconds, and the chunks that failed.
+    """
+    chunks = split_chunks(start, end, chunk_hours)
+    signature = {'tags': sorted(tag_name for _, tag_name in tags), 'start': start.isoformat(),
+                 'end': end.isoformat(), 'chunk_hours': chunk_hours}
+    state = {'signature': signature, 'done': {}} if restart else load_state(state_path, signature)
+    pending = [(tag_anomaly_id, tag_name, chunk_start, chunk_end)
+               for tag_anomaly_id, tag_name in tags
+               for chunk_start, chunk_end in chunks
+               if chunk_start.isoformat() not in state['done'].get(tag_name, [])]
+    print(f"Backfill of {len(tags)} tag(s) from {start} to {end}: "
+          f"{len(pending)} of {len(tags) * len(chunks)} chunk(s) of {chunk_hours}h to score, {workers} worker(s)")
+    if not pending:
+        if not state.get('complete'):
+            state['complete'] = True
+            save_state(state_path, state)
+        return {'minutes': 0, 'seconds': 0.0, 'failed': []}
+
+    if raw_cache.CACHE_ENABLED:
+        warm_cache(db_config, [(tag_anomaly_id, tag_name) for tag_anomaly_id, tag_name in tags
+                               if any(task[1] == tag_name for task in pending)],
+                   min(task[2] for task in pending), end)
+
+    run = instrumentation.start_run('rewind')
+    started = time.perf_counter()
+    minutes = 0
+    failed = []
+
+    def record(task, result, error):
+        nonlocal minutes
+        _, tag_name, chunk_start, _ = task
+        if error is not None:
+            print(f"Chunk {tag_name} {chunk_start} failed: {error}")
+            failed.append((tag_name, chunk_start.isoformat(), str(error)))
+            return
+        minutes += result
+        state['done'].setdefault(tag_name, []).append(chunk_start.isoformat())
+        save_state(state_path, state)
+        elapsed = time.perf_counter() - started
+        completed = sum(len(done) for done in state['done'].values())
+        print(f"{tag_name} {chunk_start:%Y-%m-%d %H:%M}: {result} minutes "
+              f"[{completed}/{len(tags) * len(chunks)} chunks, {minutes / elapsed:.1f} minutes/s]")
+
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker,
+                                                          initargs=(db_config,))
+        try:
+            futures = {executor.submit(_worker_score_chunk, *task, run.run_id): task for task in pending}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    record(futures[future], future.result(), None)
+                except Exception as e:
+                    record(futures[future], None, e)
+        except KeyboardInterrupt:
+            print("Interrupted, run the same backfill again to resume")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            # The workers stored their own records, the parent only has the run total
+            instrumentation.finish_run()
+    else:
+        _setup_worker(db_config)
+        try:
+            for task in pending:
+                try:
+                    record(task, _worker_score_chunk(*task), None)
+                except KeyboardInterrupt:
+                    print("Interrupted, run the same backfill again to resume")
+                    break
+                except Exception as e:
+                    record(task, None, e)
+        finally:
+            conn = _worker_state['conn']
+            instrumentation.finish_run(conn if conn is not None and not conn.closed else None)
+            if conn is not None:
+                conn.close()
+
+    if sum(len(done) for done in state['done'].values()) == len(tags) * len(chunks):
+        # A later run without bounds starts a new backfill instead of resuming this one
+        state['complete'] = True
+        save_state(state_path, state)
+    seconds = time.perf_counter() - started
+    print(f"Backfill scored {minutes} minutes of plant data in {seconds:.1f}s "
+          f"({minutes / seconds if seconds else 0:.1f} minutes/s), {len(failed)} chunk(s) failed")
+    return {'minutes': minutes, 'seconds': seconds, 'failed': failed}
 
-"""******************* Vizualization of the predictions using Tkinter and Matplotlib *******************"""
 
 if __name__ == "__main__":
-    db_config = {
-        'database': POSTGRES_DB ,
-        'user': POSTGRES_USER,
-        'password': POSTGRES_PASSWORD,
-        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
-        'port': POSTGRES_PORT       # Default PostgreSQL port
-    }
-
-    # Parameters for the query
-    # tags = [(1, 'PIC11151A'), (2, 'FIC11121'), (3, 'FIC11120'), (4, 'TIC12102'), (5, 'PIC05101'), (6, 'PIC07814')] 
-    tags = [(1, 'PIC11151A')] 
-
-    # Creating postgres connection
-    conn = None
-    cursor = None
+    parser = argparse.ArgumentParser(description="Rescore anomaly tags over a time range")
+    parser.add_argument('--tags', nargs='*', help="Tag names (default: every tag with an \\AS param)")
+    parser.add_argument('--start', help="UTC start (default: the unfinished backfill's, or 4 weeks before the end)")
+    parser.add_argument('--end', help="UTC end (default: the unfinished backfill's, or the newest data)")
+    parser.add_argument('--chunk-hours', type=int, default=BACKFILL_CHUNK_HOURS)
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    parser.add_argument('--state', default=BACKFILL_STATE_FILE, help="File recording the completed chunks")
+    parser.add_argument('--restart', action='store_true', help="Ignore the completed chunks of a previous run")
+    args = parser.parse_args()
+
+    db_config = predict.get_db_config()
+    print("Connecting to the PostgreSQL database...")
+    conn = pg.connect(**db_config)
     try:
-        print("Connecting to the PostgreSQL database...")
-        conn = pg.connect(**db_config)
-
-        # Create a cursor
-        cursor = conn.cursor()
-        # --- Run the query ---
-        # dataset, cursor, conn = get_data_with_in_clause(db_params=db_config)
-        if conn and cursor:
-            for tag_anomaly_id, tag_name in tags:
-
-                current_path = os.path.dirname(os.path.abspath(__file__))
-                model_path = os.path.join(current_path, tag_name)
-                m = load_model(f'./models/{tag_name}')
-
-                #call the function to delete old data
-                delete_old_data(cursor, tag_anomaly_id)
-
-                for upper_offset in range(4):
-                    dataset= get_data_with_in_clause(cursor, tag_name, upper_offset+1, upper_offset)
-                    dataset = prep.treat_data(dataset, tag_name)
-                    dataset_filtered = prep.filter_columns(dataset)
-
-                    predictions = predict_model(m, data=dataset_filtered.drop(columns=['Timestamp']))
-                    predictions = pd.concat([predictions, dataset['Timestamp']], axis=1)
-
-                    for index, row in predictions.iterrows():
-                        values = (tag_anomaly_id, row['Anomaly_Score'], row['Timestamp'], tag_anomaly_id)
-                        insert_new_data(cursor, values)
-
-                    print("Success")
-                    conn.commit()
-        else:
-            print('No connection or cursor was found')
-    except Exception as e:
-        if conn:
-            conn.rollback()
-            print("Error while conecting to database!")
-        print(e)
+        with conn.cursor() as cursor:
+            anomaly_tags = {tag_name.split("\\")[0]: tag_anomaly_id
+                            for tag_anomaly_id, tag_name in predict.get_anomaly_tags(cursor)}
+            newest = data_fetch.get_upper_bound(cursor)
+        conn.commit()
     finally:
-        if conn and cursor:
-            cursor.close()
-            conn.close()
-            print("PostgreSQL connection closed.")
+        conn.close()
 
+    names = args.tags or sorted(anomaly_tags)
+    unknown = [tag_name for tag_name in names if tag_name not in anomaly_tags]
+    if unknown:
+        sys.exit(f"No \\AS param for: {', '.join(unknown)}")
+    try:
+        start, end = resolve_range(args.state, names, args.chunk_hours, args.start, args.end, newest, args.restart)
+    except ValueError as e:
+        sys.exit(str(e))
 
+    result = run_backfill(db_config, [(anomaly_tags[tag_name], tag_name) for tag_name in names], start, end,
+                          args.chunk_hours, args.workers, args.state, args.restart)
+    sys.exit(1 if result['failed'] else 0)
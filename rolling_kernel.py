@@ -0,0 +1,235 @@
+import numpy as np
+
+""" ******************* Multi-window rolling statistics kernel ******************* """
+
+# Statistics the kernel can produce, in the order create_aggregated_df lays them out
+STATISTICS = ['mean', 'std', 'max', 'min', 'median', 'range']
+
+
+def get_window_bounds(timestamps, window_sizes):
+    """
+    Computes the row span of every time-based window, pandas style: (t - w, t].
+
+    Args:
+        timestamps: Sorted int64 nanosecond timestamps.
+        window_sizes: A list of window sizes in hours.
+
+    Returns:
+        dict: {window_size: start row of each window}. The end row (exclusive) is always i + 1.
+    """
+    bounds = {}
+    for window_size in window_sizes:
+        offset = np.int64(window_size) * 3600 * 10**9
+        bounds[window_size] = np.searchsorted(timestamps, timestamps - offset, side='right')
+    return bounds
+
+
+class SparseTable:
+    """
+    Range min/max over rows [l, r) in O(1) per query after an O(n log n) build.
+
+    This is the vectorized counterpart of the monotonic-deque sliding max/min: the
+    windows of a time-based rolling have variable row counts, and a sparse table
+    answers all of them with two lookups each.
+    """
+
+    def __init__(self, values, reduce):
+        self.reduce = reduce
+        self.levels = [values]
+        span = 1
+        while span * 2 <= len(values):
+            previous = self.levels[-1]
+            self.levels.append(reduce(previous[:-span], previous[span:]))
+            span *= 2
+
+    def query(self, left, right):
+        """
+        Returns the reduction of rows [left, right) for every query (right > left).
+        """
+        length = right - left
+        level = np.log2(length).astype(np.int64)
+        # Rounding of log2 could overshoot on exact powers of two for huge n, fix it up
+        level -= (np.left_shift(1, level) > length)
+        result = np.empty(len(left), dtype=np.float64)
+        for depth in np.unique(level):
+            rows = level == depth
+            table = self.levels[depth]
+            result[rows] = self.reduce(table[left[rows]], table[right[rows] - (1 << depth)])
+        return result
+
+
+class WaveletMatrix:
+    """
+    Static order-statistic structure over a sequence of values.
+
+    Answers "k-th smallest value in rows [l, r)" in O(log n), and every level of the
+    walk is vectorized, so all the windows of a column are answered together.
+    """
+
+    def __init__(self, values):
+        n = len(values)
+        # Ranks over the distinct values: quantized plant signals need far fewer levels
+        self.sorted_values, ranks = np.unique(values, return_inverse=True)
+        ranks = ranks.astype(np.int32).reshape(-1)
+
+        self.levels = max(int(len(self.sorted_values) - 1).bit_length(), 1)
+        self.zero_prefix = []
+        self.zero_count = []
+        current = ranks
+        for level in range(self.levels - 1, -1, -1):
+            is_zero = ((current >> level) & 1) == 0
+            zeros = np.zeros(n + 1, dtype=np.int32)
+            np.cumsum(is_zero, out=zeros[1:])
+            self.zero_prefix.append(zeros)
+            self.zero_count.append(zeros[-1])
+            current = np.concatenate([current[is_zero], current[~is_zero]])
+
+    def kth_smallest(self, left, right, k):
+        """
+        Returns the k-th (0-based) smallest value of rows [left, right) for every query.
+        Queries must satisfy 0 <= k < right - left.
+        """
+        left = left.astype(np.int32)
+        right = right.astype(np.int32)
+        k = k.astype(np.int32)
+        rank = np.zeros(len(k), dtype=np.int32)
+        for depth, level in enumerate(range(self.levels - 1, -1, -1)):
+            zeros = self.zero_prefix[depth]
+            zero_left = zeros[left]
+            zero_right = zeros[right]
+            zeros_in_range = zero_right - zero_left
+            go_right = k >= zeros_in_range
+            # Going right: skip the zeros and move into the ones block of the next level
+            k = np.where(go_right, k - zeros_in_range, k)
+            left = np.where(go_right, self.zero_count[depth] + left - zero_left, zero_left)
+            right = np.where(go_right, self.zero_count[depth] + right - zero_right, zero_right)
+            rank |= go_right.astype(np.int32) << level
+        return self.sorted_values[rank]
+
+
+def rolling_statistics(timestamps, values, window_sizes, statistics=None, window_bounds=None):
+    """
+    Computes the rolling statistics of one column for every window in a single pass.
+
+    Mean and std come from prefix sums of the (centered) values, min/max from a
+    SparseTable and the median from a WaveletMatrix, each built once for the column and
+    shared by all windows. NaNs are skipped and a window with no values gives NaN, like
+    pandas' time-based rolling (min_periods=1).
+
+    Args:
+        timestamps: Sorted int64 nanosecond timestamps.
+        values: float64 values, NaN where the signal is missing.
+        window_sizes: A list of window sizes in hours.
+        statistics: Which of STATISTICS to compute (all by default), either one list for
+                    every window or {window_size: list} (a feature plan).
+        window_bounds: Optional precomputed get_window_bounds(timestamps, window_sizes).
+
+    Returns:
+        dict: {window_size: {statistic: float64 array}}.
+    """
+    statistics = STATISTICS if statistics is None else statistics
+    if not isinstance(statistics, dict):
+        statistics = {window_size: statistics for window_size in window_sizes}
+    # The structures below are built once for the union of the windows' statistics
+    requested = set().union(*statistics.values())
+    if window_bounds is None:
+        window_bounds = get_window_bounds(timestamps, window_sizes)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+
+    # Everything below works on the NaN-free sequence, windows are mapped onto it
+    valid = ~np.isnan(values)
+    valid_prefix = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(valid, out=valid_prefix[1:])
+    present = values[valid]
+    empty = len(present) == 0
+
+    def needs_moments(stats):
+        return 'mean' in stats or 'std' in stats
+
+    def needs_extremes(stats):
+        # min/max are also needed to pin constant windows to an exact mean and std
+        return needs_moments(stats) or any(stat in stats for stat in ('max', 'min', 'range'))
+
+    if needs_extremes(requested) and not empty:
+        lowest_table = SparseTable(present, np.minimum)
+        highest_table = SparseTable(present, np.maximum)
+    if 'median' in requested and not empty:
+        matrix = WaveletMatrix(present)
+
+    if needs_moments(requested):
+        # Center on the median so the prefix sums stay small, and accumulate in extended
+        # precision to keep the cancellation error of long series negligible
+        reference = np.median(present) if not empty else 0.0
+        centered = (present - reference).astype(np.longdouble)
+        sum_prefix = np.zeros(len(present) + 1, dtype=np.longdouble)
+        np.cumsum(centered, out=sum_prefix[1:])
+        square_prefix = np.zeros(len(present) + 1, dtype=np.longdouble)
+        np.cumsum(centered * centered, out=square_prefix[1:])
+
+    results = {}
+    for window_size in window_sizes:
+        if window_size not in statistics:
+            continue
+        window_statistics = statistics[window_size]
+        need_moments = needs_moments(window_statistics)
+        need_extremes = needs_extremes(window_statistics)
+        left = valid_prefix[window_bounds[window_size]]
+        right = valid_prefix[1:]
+        count = right - left
+        has_values = count > 0
+        q_left, q_right, q_count = left[has_values], right[has_values], count[has_values]
+        stats = {}
+
+        if need_extremes:
+            lowest = np.full(n, np.nan)
+            highest = np.full(n, np.nan)
+            if not empty:
+                lowest[has_values] = lowest_table.query(q_left, q_right)
+                highest[has_values] = highest_table.query(q_left, q_right)
+
+        if 'median' in window_statistics:
+            median = np.full(n, np.nan)
+            if not empty:
+                lower_mid = matrix.kth_smallest(q_left, q_right, (q_count - 1) // 2)
+                # Even counts average the two middle values
+                even = q_count % 2 == 0
+                upper_mid = lower_mid.copy()
+                upper_mid[even] = matrix.kth_smallest(q_left[even], q_right[even], q_count[even] // 2)
+                median[has_values] = (lower_mid + upper_mid) / 2
+            stats['median'] = median
+
+        if need_moments:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                window_sum = sum_prefix[right] - sum_prefix[left]
+                window_square = square_prefix[right] - square_prefix[left]
+                mean = (reference + window_sum / count).astype(np.float64)
+                variance = ((window_square - window_sum * window_sum / count) / (count - 1)).astype(np.float64)
+            # A constant window has exactly its value as mean and no spread
+            constant = highest == lowest
+            mean = np.where(constant, lowest, mean)
+            mean[~has_values] = np.nan
+            variance = np.where(constant, 0.0, np.maximum(variance, 0.0))
+            variance[count < 2] = np.nan
+            if 'mean' in window_statistics:
+                stats['mean'] = mean
+            if 'std' in window_statistics:
+                stats['std'] = np.sqrt(variance)
+
+        if 'max' in window_statistics:
+            stats['max'] = highest
+        if 'min' in window_statistics:
+            stats['min'] = lowest
+        if 'range' in window_statistics:
+            stats['range'] = highest - lowest
+        results[window_size] = stats
+    return results
+
+
+def rolling_count(window_start, flags):
+    """
+    Rolling sum of a 0/1 flag over precomputed windows (used for the crossings count).
+    """
+    prefix = np.zeros(len(flags) + 1, dtype=np.int64)
+    np.cumsum(flags, out=prefix[1:])
+    return (prefix[1:] - prefix[window_start]).astype(np.float64)
@@ -0,0 +1,207 @@
+import os
+import numpy as np
+from sklearn.svm import OneClassSVM
+from sklearn.ensemble import IsolationForest
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+import lean_model
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+# 'ocsvm' is the pycaret pipeline of train.py, the others are fitted here and only
+# written as a lean artifact
+MODEL_KINDS = ('ocsvm', 'subsample', 'nystroem')
+# Rows the 'subsample' OCSVM is fitted on; its fit time grows about quadratically with them
+SUBSAMPLE_ROWS = int(os.environ.get("SUBSAMPLE_ROWS", "6000"))
+# Kernel centres of the 'nystroem' model, its scoring cost per row
+NYSTROEM_COMPONENTS = int(os.environ.get("NYSTROEM_COMPONENTS", "1000"))
+# Rows embedded at once while fitting the 'nystroem' model, and passes over the data
+NYSTROEM_BLOCK_ROWS = 10000
+NYSTROEM_EPOCHS = 5
+# Rows of the OCSVM the 'nystroem' scores are calibrated against
+CALIBRATION_ROWS = int(os.environ.get("CALIBRATION_ROWS", "3000"))
+# Share of the reference OCSVM's anomalies the calibrated 'nystroem' model must also flag,
+# below it the model is refused (on long ranges it can agree on as little as a fifth)
+NYSTROEM_MIN_AGREEMENT = float(os.environ.get("NYSTROEM_MIN_AGREEMENT", "0.8"))
+# pycaret's create_model('svm'): pyod OCSVM with nu=0.5, gamma='auto' and 5% contamination
+NU = 0.5
+CONTAMINATION = 0.05
+# pycaret's setup(remove_outliers=True): an isolation forest drops this share of the
+# (imputed) training rows before the OCSVM is fitted
+OUTLIERS_THRESHOLD = 0.05
+
+
+""" ******************* Training data ******************* """
+
+def get_training_matrix(dftrain_filtered):
+    """
+    Returns the features, their fill values and the imputed (rows x features) matrix,
+    like the pipeline's mean imputer (features empty in the training data are dropped).
+
+    Args:
+        dftrain_filtered: prep.filter_columns' output, in time order.
+    """
+    data = dftrain_filtered.drop(columns=['Timestamp'])
+    means = data.mean()
+    features = [feature for feature in data.columns if not np.isnan(means[feature])]
+    fill_values = means[features].to_numpy(dtype=np.float64)
+    X = data[features].to_numpy(dtype=np.float64, na_value=np.nan)
+    return features, fill_values, np.where(np.isnan(X), fill_values, X)
+
+
+def remove_outliers(X, seed=0):
+    """
+    Returns the rows of X that pycaret's train-only outlier removal keeps, in their order,
+    so the scalable models are fitted on the rows its OCSVM would be.
+    """
+    forest = IsolationForest(n_estimators=100, contamination=OUTLIERS_THRESHOLD, random_state=seed)
+    return X[forest.fit_predict(X) != -1]
+
+
+def stratified_sample(rows, size, seed=0):
+    """
+    Returns size row positions spread over the time-ordered rows: one at random in each of
+    size equal strata, so every period of the range (plant stops, setpoint changes) is kept.
+    """
+    if size >= rows:
+        return np.arange(rows)
+    edges = np.linspace(0, rows, size + 1)
+    rng = np.random.default_rng(seed)
+    return (edges[:-1] + rng.random(size) * np.diff(edges)).astype(np.int64)
+
+
+""" ******************* Models ******************* """
+
+def fit_subsample_ocsvm(X, rows=SUBSAMPLE_ROWS, seed=0):
+    """
+    Fits the exact OCSVM on a stratified subsample of X.
+
+    libsvm's dual coefficients sum to nu * training rows, so an OCSVM's scores grow with the
+    rows it's fitted on. The expansion is multiplied by len(X) / rows, which puts it on the
+    scale of an OCSVM fitted on all of X, the scale of the scores already in inspections_calc.
+
+    Returns:
+        tuple: (centres, weights, intercept, gamma) of -(K(x, centres) @ weights + intercept).
+    """
+    positions = stratified_sample(len(X), rows, seed)
+    detector = OneClassSVM(nu=NU, gamma='auto').fit(X[positions])
+    scale = len(X) / len(positions)
+    return detector.support_vectors_, scale * np.ravel(detector.dual_coef_), scale * detector.intercept_[0], detector._gamma
+
+
+def fit_nystroem(X, components=NYSTROEM_COMPONENTS, seed=0):
+    """
+    Fits a linear one-class SVM (SGD) on a Nystroem approximation of the OCSVM's kernel,
+    in time linear in the rows. Rows are embedded NYSTROEM_BLOCK_ROWS at a time, so the
+    memory doesn't grow with the range either.
+
+    The model's decision, phi(x) . coef - offset with phi(x) = K(x, centres) @ normalization.T,
+    is itself a kernel expansion over the Nystroem centres. With the narrow kernel of the
+    unscaled features (gamma='auto') it follows the exact OCSVM less closely than the
+    subsample does; benchmark.py models measures both.
+
+    Returns:
+        tuple: (centres, weights, intercept, gamma), uncalibrated.
+    """
+    gamma = 1.0 / X.shape[1]
+    rng = np.random.default_rng(seed)
+    feature_map = Nystroem(gamma=gamma, n_components=min(components, len(X)), random_state=seed).fit(X)
+    detector = SGDOneClassSVM(nu=NU, random_state=seed)
+    # Each block is embedded once (the costly part) and passed over NYSTROEM_EPOCHS times
+    for start in rng.permutation(np.arange(0, len(X), NYSTROEM_BLOCK_ROWS)):
+        embedded = feature_map.transform(X[start:start + NYSTROEM_BLOCK_ROWS])
+        for _ in range(NYSTROEM_EPOCHS):
+            detector.partial_fit(embedded[rng.permutation(len(embedded))])
+    weights = feature_map.normalization_.T @ np.ravel(detector.coef_)
+    return feature_map.components_, weights, -np.ravel(detector.offset_)[0], gamma
+
+
+def calibrate(scores, reference):
+    """
+    Returns the (scale, shift) mapping scores onto reference by least squares.
+    """
+    design = np.column_stack([scores, np.ones_like(scores)])
+    (scale, shift), *_ = np.linalg.lstsq(design, reference, rcond=None)
+    if not scale > 0:
+        raise ValueError(f"The scores don't follow the reference model (calibration scale {scale})")
+    return scale, shift
+
+
+def check_agreement(scores, reference, min_agreement):
+    """
+    Checks that calibrated scores flag the rows the reference model flags, each at its own
+    CONTAMINATION threshold (the 95th percentile of its scores).
+
+    Returns:
+        float: The share of the reference's flagged rows also flagged by the scores.
+
+    Raises:
+        ValueError: If that share is below min_agreement.
+    """
+    flags = scores > np.percentile(scores, 100 * (1 - CONTAMINATION))
+    reference_flags = reference > np.percentile(reference, 100 * (1 - CONTAMINATION))
+    agreement = np.sum(flags & reference_flags) / max(reference_flags.sum(), 1)
+    if not agreement >= min_agreement:
+        correlation = np.corrcoef(scores, reference)[0, 1]
+        raise ValueError(f"The model flags {100 * agreement:.0f}% of the reference OCSVM's anomalies (score correlation "
+                         f"{correlation:.2f}), below the required {100 * min_agreement:.0f}%")
+    return agreement
+
+
+def fit_scalable_model(kind, features, fill_values, X, seed=0, subsample_rows=None, components=None,
+                       min_agreement=None):
+    """
+    Fits a scalable model on the score scale of the pycaret OCSVM.
+
+    'subsample': the exact OCSVM on subsample_rows (SUBSAMPLE_ROWS) stratified rows.
+    'nystroem': components (NYSTROEM_COMPONENTS) Nystroem centres and a linear one-class SVM,
+        whose scores are mapped by least squares onto those of a CALIBRATION_ROWS subsample OCSVM.
+        The model is refused (ValueError) if, on the calibration rows, it flags less than
+        min_agreement (NYSTROEM_MIN_AGREEMENT) of the anomalies that OCSVM flags.
+
+    The threshold is the training scores' 95th percentile, as pyod sets it.
+
+    Args:
+        X: The imputed training rows, outliers already removed (remove_outliers) as the
+           pipeline does before its OCSVM: the models and the reference OCSVM they are
+           checked against are fitted on the same rows.
+
+    Returns:
+        tuple: (centres, weights, intercept, gamma, threshold), write_artifact's parameters.
+    """
+    if kind == 'subsample':
+        centres, weights, intercept, gamma = fit_subsample_ocsvm(X, subsample_rows or SUBSAMPLE_ROWS, seed)
+    elif kind == 'nystroem':
+        reference = lean_model.LeanModel.from_arrays(features, fill_values, *fit_subsample_ocsvm(X, CALIBRATION_ROWS, seed),
+                                                     np.inf)
+        centres, weights, intercept, gamma = fit_nystroem(X, components or NYSTROEM_COMPONENTS, seed)
+        uncalibrated = lean_model.LeanModel.from_arrays(features, fill_values, centres, weights, intercept, gamma, np.inf)
+        sample = X[stratified_sample(len(X), CALIBRATION_ROWS, seed + 1)]
+        reference_scores = reference.decision_scores(sample)
+        scale, shift = calibrate(uncalibrated.decision_scores(sample), reference_scores)
+        # scale * -(K @ w + b) + shift = -(K @ (scale * w) + scale * b - shift)
+        weights, intercept = scale * weights, scale * intercept - shift
+        calibrated = lean_model.LeanModel.from_arrays(features, fill_values, centres, weights, intercept, gamma, np.inf)
+        agreement = check_agreement(calibrated.decision_scores(sample), reference_scores,
+                                    NYSTROEM_MIN_AGREEMENT if min_agreement is None else min_agreement)
+        print(f"Nystroem model flags {100 * agreement:.0f}% of the reference OCSVM's anomalies")
+    else:
+        raise ValueError(f"Unknown scalable model '{kind}', expected one of {', '.join(MODEL_KINDS[1:])}")
+
+    model = lean_model.LeanModel.from_arrays(features, fill_values, centres, weights, intercept, gamma, np.inf)
+    threshold = np.percentile(model.decision_scores(X), 100 * (1 - CONTAMINATION))
+    return centres, weights, intercept, gamma, threshold
+
+
+def train_scalable_model(kind, dftrain_filtered, path, seed=0):
+    """
+    Fits a scalable model on train.py's filtered training features and writes its lean artifact.
+
+    Returns:
+        int: The number of kernel centres scored per row.
+    """
+    features, fill_values, X = get_training_matrix(dftrain_filtered)
+    parameters = fit_scalable_model(kind, features, fill_values, remove_outliers(X, seed), seed)
+    lean_model.write_artifact(path, features, fill_values, *parameters)
+    return len(parameters[0])
@@ -0,0 +1,90 @@
+import datetime
+
+""" ******************* Cron expression schedule ******************* """
+
+# (name, lowest, highest) of the five crontab fields
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+]
+
+
+def parse_cron_field(field, lowest, highest):
+    """
+    Parses one crontab field ('*', '*/15', '1-5', '0,30', '10-50/10') into the set of allowed values.
+    """
+    allowed = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+            if step <= 0:
+                raise ValueError(f"Invalid step in cron field '{field}'")
+        if part == '*':
+            start, end = lowest, highest
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-'))
+        else:
+            start = int(part)
+            # '5/10' means every 10 starting at 5
+            end = highest if step > 1 else start
+        if start < lowest or end > highest or start > end:
+            raise ValueError(f"Cron field '{field}' out of range {lowest}-{highest}")
+        allowed.update(range(start, end + 1, step))
+    return allowed
+
+
+class CronSchedule:
+    """
+    A standard 5-field crontab expression (e.g. the CRON_INTERVAL of docker-compose).
+
+    Fire times are always derived from the wall clock, so a long tick never shifts
+    the following ones.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' must have 5 fields")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_cron_field(field, lowest, highest) for field, (_, lowest, highest) in zip(fields, CRON_FIELDS)
+        )
+        # 7 is also Sunday
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # Like cron, when both day fields are restricted a day matches if either does; a
+        # field starting with '*' ('*/2' too) is not restricted
+        self.day_restricted = not fields[2].startswith('*')
+        self.weekday_restricted = not fields[4].startswith('*')
+
+    def day_matches(self, moment):
+        if moment.month not in self.months:
+            return False
+        day_ok = moment.day in self.days
+        # Python: Monday=0, cron: Sunday=0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment):
+        """
+        Returns the first fire time strictly after moment.
+        """
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Four years always contain every valid day/month combination
+        limit = candidate + datetime.timedelta(days=4 * 366)
+        while candidate < limit:
+            if not self.day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
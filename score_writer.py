@@ -0,0 +1,134 @@
+import os
+import weakref
+import psycopg2.extras
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+
+# Rows per multi-row INSERT statement
+PAGE_SIZE = 1000
+
+# Connections prepare_statements prepared the watermark and write statements on
+_prepared = weakref.WeakSet()
+
+
+""" ******************* Prepared statements ******************* """
+
+def get_conflict_clause(mode):
+    """
+    Returns the ON CONFLICT action of a write mode (see write_scores).
+    """
+    if mode == 'append':
+        return "DO NOTHING"
+    # Unchanged scores are left alone, so a re-run rewrites nothing
+    return (f"DO UPDATE SET value = EXCLUDED.value "
+            f"WHERE {VARIABLES_SCHEMA}.inspections_calc.value IS DISTINCT FROM EXCLUDED.value")
+
+
+def prepare_statements(conn):
+    """
+    Prepares the watermark query and the page writes of both modes on a connection of a
+    long-running predictor, which runs them for every tag of every tick; get_watermark and
+    write_scores then only EXECUTE them. A page is written from two arrays, so one
+    statement fits every page size. Nothing is done on a connection already prepared.
+    """
+    if conn in _prepared:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"""PREPARE anomaly_monitor_watermark (integer) AS
+                           SELECT max(dt) FROM {VARIABLES_SCHEMA}.inspections_calc WHERE id_param_fk = $1;""")
+        for mode in ('append', 'replace'):
+            cursor.execute(f"""PREPARE anomaly_monitor_write_{mode} (integer, double precision[], timestamptz[]) AS
+                               INSERT INTO {VARIABLES_SCHEMA}.inspections_calc (id_param_fk, value, dt)
+                               SELECT $1, page.value, page.dt FROM unnest($2, $3) AS page (value, dt)
+                               ON CONFLICT (id_param_fk, dt) {get_conflict_clause(mode)}
+                               RETURNING 1;""")
+    conn.commit()
+    _prepared.add(conn)
+
+
+""" ******************* Bulk write of anomaly scores ******************* """
+
+def get_watermark(cursor, tag_anomaly_id):
+    """
+    Returns the newest dt already scored for the tag, or None if it has no scores yet.
+    """
+    if cursor.connection in _prepared:
+        cursor.execute("EXECUTE anomaly_monitor_watermark (%s);", (tag_anomaly_id,))
+    else:
+        cursor.execute(f"SELECT max(dt) FROM {VARIABLES_SCHEMA}.inspections_calc WHERE id_param_fk = %s;",
+                       (tag_anomaly_id,))
+    return cursor.fetchone()[0]
+
+
+def write_scores(cursor, tag_anomaly_id, predictions, mode='append', tag_name=None):
+    """
+    Writes the scores of one tag into inspections_calc in batched multi-row upserts.
+
+    Relies on the unique index on (id_param_fk, dt) created by migrations.py, so running
+    the same batch twice never duplicates rows. On a connection prepare_statements
+    prepared, the pages go through the prepared statement of the mode.
+
+    Args:
+        cursor: The database cursor (the caller commits).
+        tag_anomaly_id: id_param_fk of the tag's anomaly score (its \\AS param).
+        predictions: DataFrame with 'Timestamp' and 'Anomaly_Score' columns.
+        mode: 'append' only writes minutes newer than the tag's last score (predictor
+              ticks). 'replace' upserts every minute, overwriting changed scores
+              (rewinds and backfills).
+        tag_name: Name used in the report, defaults to the id.
+
+    Returns:
+        tuple: (rows written, rows skipped).
+    """
+    if mode not in ('append', 'replace'):
+        raise ValueError(f"Unknown write mode '{mode}'")
+
+    total = len(predictions)
+    if mode == 'append':
+        # The watermark is read once for the whole batch instead of once per row
+        watermark = get_watermark(cursor, tag_anomaly_id)
+        if watermark is not None:
+            predictions = predictions[predictions['Timestamp'] > watermark]
+
+    written = 0
+    if len(predictions) and cursor.connection in _prepared:
+        values = predictions['Anomaly_Score'].astype(float).tolist()
+        timestamps = predictions['Timestamp'].dt.to_pydatetime().tolist()
+        for start in range(0, len(values), PAGE_SIZE):
+            cursor.execute(f"EXECUTE anomaly_monitor_write_{mode} (%s, %s, %s);",
+                           (tag_anomaly_id, values[start:start + PAGE_SIZE], timestamps[start:start + PAGE_SIZE]))
+            written += len(cursor.fetchall())
+    elif len(predictions):
+        rows = list(zip(
+            [tag_anomaly_id] * len(predictions),
+            predictions['Anomaly_Score'].astype(float).tolist(),
+            predictions['Timestamp'].dt.to_pydatetime().tolist(),
+        ))
+        query = f"""INSERT INTO {VARIABLES_SCHEMA}.inspections_calc (id_param_fk, value, dt)
+                    VALUES %s
+                    ON CONFLICT (id_param_fk, dt) {get_conflict_clause(mode)}
+                    RETURNING 1;"""
+        for start in range(0, len(rows), PAGE_SIZE):
+            page = rows[start:start + PAGE_SIZE]
+            written += len(psycopg2.extras.execute_values(cursor, query, page, page_size=len(page), fetch=True))
+
+    skipped = total - written
+    print(f"{tag_name or tag_anomaly_id}: {written} rows written, {skipped} skipped")
+    return written, skipped
+
+
+def delete_stale_scores(cursor, tag_anomaly_id, start, end, keep):
+    """
+    Deletes the tag's scores in [start, end) whose minute is not in keep, i.e. minutes a
+    rewrite of that range no longer produces.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    cursor.execute(f"""DELETE FROM {VARIABLES_SCHEMA}.inspections_calc
+                       WHERE id_param_fk = %s AND dt >= %s AND dt < %s AND NOT (dt = ANY(%s));""",
+                   (tag_anomaly_id, start, end, list(keep)))
+    return cursor.rowcount
@@ -0,0 +1,152 @@
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.signal
+
+# Plant-wide signal shared by every tag, with its level while the plant runs
+SHARED_SIGNAL = 'II113RC001\\U'
+SHARED_LEVEL = 16.6
+
+# Status signals of a control loop, constant in the real data (training_data/PIC11151A.csv)
+STATUS_SIGNALS = {
+    ' - Alarme': 0.0,
+    ' - Falha': 192.0,
+    ' - Limites de Abertura/Fechamento': 5.0,
+    ' - Modos de Operacao': 46.0,
+}
+
+
+""" ******************* Timeline ******************* """
+
+def generate_timeline(start, days, rng, missing_rate=0.02, outages_per_day=0.3, jitter_rate=0.01):
+    """
+    Returns the timestamps of a signal: one per minute, with missing minutes, multi-hour
+    outages and a few samples off the minute.
+
+    Args:
+        start: First minute.
+        days: Number of days.
+        rng: numpy Generator.
+        missing_rate: Fraction of minutes randomly missing.
+        outages_per_day: Expected number of outages (30 min to 4 h without data) per day.
+        jitter_rate: Fraction of samples shifted by a few seconds.
+    """
+    minutes = pd.date_range(start, periods=int(days * 24 * 60), freq='min')
+    keep = rng.random(len(minutes)) >= missing_rate
+    for _ in range(rng.poisson(outages_per_day * days)):
+        begin = rng.integers(len(minutes))
+        keep[begin:begin + rng.integers(30, 240)] = False
+    timestamps = minutes[keep]
+    jitter = np.where(rng.random(len(timestamps)) < jitter_rate, rng.integers(1, 30, len(timestamps)), 0)
+    return timestamps + pd.to_timedelta(jitter, unit='s')
+
+
+def ar1(rng, length, scale, persistence=0.98):
+    """
+    First-order autoregressive noise with the given stationary standard deviation.
+    """
+    shocks = rng.normal(0, scale * np.sqrt(1 - persistence ** 2), length)
+    return scipy.signal.lfilter([1.0], [1.0, -persistence], shocks)
+
+
+""" ******************* Signals ******************* """
+
+def generate_loop_signals(tag_name, timestamps, rng, setpoint=220.0):
+    """
+    Returns the long-format rows of one control loop (SP, PV_IN, MV, SP Int/Ext and status signals).
+
+    The setpoint steps a few times a day, the process value follows it with AR(1)
+    noise and occasional disturbances, and the controller output reacts to the error.
+    """
+    length = len(timestamps)
+    # A setpoint change every ~8 hours on average
+    changes = np.cumsum(rng.random(length) < 1 / 480)
+    levels = setpoint + rng.choice([-10.0, -5.0, 0.0, 5.0, 10.0], changes[-1] + 1 if length else 1)
+    sp = levels[changes]
+
+    disturbance = np.zeros(length)
+    for begin in np.flatnonzero(rng.random(length) < 1 / 2000):
+        span = min(int(rng.integers(10, 120)), length - begin)
+        disturbance[begin:begin + span] += rng.normal(0, 25) * np.hanning(span)
+    pv = sp + ar1(rng, length, 14.0) + disturbance
+    mv = np.clip(80 + 0.2 * (sp - pv) + ar1(rng, length, 2.0, 0.9), 0, 100)
+    sp_int_ext = np.where(rng.random(length) < 0.001, 1.0, 2.0)
+
+    signals = {
+        f'{tag_name}\\SP': sp,
+        f'{tag_name}\\PV_IN': pv,
+        f'{tag_name}\\MV': mv,
+        f'{tag_name} - SP Int/Ext': sp_int_ext,
+    }
+    for suffix, value in STATUS_SIGNALS.items():
+        signals[f'{tag_name}{suffix}'] = np.full(length, value)
+    return signals
+
+
+def generate_shared_signal(timestamps, rng, stops_per_week=1.0):
+    """
+    Returns the plant-wide II113RC001\\U: a steady level with plant stops where it drops to about zero.
+    """
+    length = len(timestamps)
+    values = SHARED_LEVEL + ar1(rng, length, 0.01)
+    for begin in np.flatnonzero(rng.random(length) < stops_per_week / (7 * 24 * 60)):
+        values[begin:begin + int(rng.integers(60, 600))] = rng.normal(0.2, 0.1)
+    return values
+
+
+def to_long(timestamps, signals, timestamp_unit):
+    index = timestamps.asi8 // 1_000_000 if timestamp_unit == 'ms' else timestamps
+    return pd.concat(
+        [pd.DataFrame({'Timestamp': index, 'Variable': variable, 'Value': values}) for variable, values in signals.items()],
+        ignore_index=True,
+    )
+
+
+def generate_dataset(tag_names, days, start='2025-03-01', seed=0, timestamp_unit='ms'):
+    """
+    Generates long-format Timestamp, Variable, Value data for several tags and the shared signal,
+    in the layout of training_data/PIC11151A.csv.
+
+    Args:
+        tag_names: The control loops to generate.
+        days: Number of days.
+        start: First minute.
+        seed: Seed of the random generator (the same seed gives the same data).
+        timestamp_unit: 'ms' for epoch milliseconds like the CSV, None for Timestamps.
+
+    Returns:
+        dict: {tag_name: long-format DataFrame with the tag's signals and the shared one}.
+    """
+    rng = np.random.default_rng(seed)
+    shared_timestamps = generate_timeline(start, days, rng)
+    shared = to_long(shared_timestamps, {SHARED_SIGNAL: generate_shared_signal(shared_timestamps, rng)}, timestamp_unit)
+
+    datasets = {}
+    for tag_name in tag_names:
+        timestamps = generate_timeline(start, days, rng)
+        signals = generate_loop_signals(tag_name, timestamps, rng, setpoint=float(rng.choice([120.0, 220.0, 350.0])))
+        data = pd.concat([to_long(timestamps, signals, timestamp_unit), shared], ignore_index=True)
+        datasets[tag_name] = data.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+    return datasets
+
+
+def get_tag_names(count):
+    return ['PIC11151A'] + [f'PIC9{index:04d}A' for index in range(1, count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic long-format plant data")
+    parser.add_argument('--tags', type=int, default=1, help="Number of control loops")
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--start', default='2025-03-01')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic_data.csv')
+    args = parser.parse_args()
+
+    datasets = generate_dataset(get_tag_names(args.tags), args.days, args.start, args.seed)
+    # The shared signal is written once
+    shared = next(iter(datasets.values()))
+    data = pd.concat([shared] + [dataset[dataset['Variable'] != SHARED_SIGNAL] for dataset in list(datasets.values())[1:]],
+                     ignore_index=True)
+    data.to_csv(args.output, index=False)
+    print(f"Wrote {len(data)} rows ({args.tags} tag(s) x {args.days} day(s)) to {args.output}")
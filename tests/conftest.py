@@ -0,0 +1,48 @@
+import os
+import sys
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import helpers
+import drift
+import instrumentation
+import pre_processing as prep
+
+
+@pytest.fixture(autouse=True)
+def isolated_files(tmp_path, monkeypatch):
+    """
+    Keeps the stage records, drift decisions and checkpoints of a test out of the repository.
+    """
+    monkeypatch.setattr(instrumentation, 'METRICS_FILE', str(tmp_path / 'metrics' / 'stages.jsonl'))
+    monkeypatch.setattr(drift, 'DRIFT_LOG', str(tmp_path / 'metrics' / 'drift.jsonl'))
+    monkeypatch.setattr(prep, 'CHECKPOINT_DIR', str(tmp_path / 'checkpoints'))
+
+
+@pytest.fixture(scope='session')
+def pg_dsn():
+    """
+    The throwaway PostgreSQL of the benchmarks (BENCHMARK_DSN), the test is skipped without one.
+    """
+    import psycopg2
+
+    dsn = os.environ.get("BENCHMARK_DSN")
+    if not dsn:
+        pytest.skip("BENCHMARK_DSN is not set")
+    try:
+        psycopg2.connect(dsn).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL at BENCHMARK_DSN is not reachable: {e}")
+    return dsn
+
+
+@pytest.fixture
+def schema_conn(pg_dsn):
+    """
+    A connection to helpers.empty_schema: empty params, params_calc, inspections and
+    inspections_calc, every module's queries pointed at it.
+    """
+    with helpers.empty_schema(pg_dsn) as conn:
+        yield conn
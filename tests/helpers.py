@@ -0,0 +1,205 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import psycopg2 as pg
+import psycopg2.extras
+import pre_processing as prep
+import data_fetch
+import dump
+import drift
+import instrumentation
+import lean_model
+import migrations
+import predict
+import replicas
+import rewind
+import score_writer
+import synthetic_data
+import train
+import window_pushdown
+
+# Throwaway schema of the PostgreSQL at BENCHMARK_DSN, dropped after each use
+SCHEMA = 'anomaly_monitor_test'
+# Modules whose queries read VARIABLES_SCHEMA
+SCHEMA_MODULES = [data_fetch, dump, drift, instrumentation, migrations, predict, replicas, rewind, score_writer,
+                  train, window_pushdown]
+
+
+""" ******************* Throwaway schema ******************* """
+
+@contextlib.contextmanager
+def pointed_at(schema):
+    """
+    Points the queries of every module at schema, restored afterwards.
+    """
+    saved = [module.VARIABLES_SCHEMA for module in SCHEMA_MODULES]
+    for module in SCHEMA_MODULES:
+        module.VARIABLES_SCHEMA = schema
+    try:
+        yield
+    finally:
+        for module, previous in zip(SCHEMA_MODULES, saved):
+            module.VARIABLES_SCHEMA = previous
+
+
+@contextlib.contextmanager
+def empty_schema(dsn, schema=SCHEMA):
+    """
+    Yields a connection to a fresh schema with empty params, params_calc, inspections and
+    inspections_calc tables (no migration applied), the modules pointed at it. The
+    schema is dropped afterwards.
+    """
+    conn = pg.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+            cursor.execute(f"CREATE SCHEMA {schema};")
+            cursor.execute(f"CREATE TABLE {schema}.params (id integer PRIMARY KEY, description text);")
+            cursor.execute(f"CREATE TABLE {schema}.params_calc (id integer PRIMARY KEY, description text, type text);")
+            cursor.execute(f"CREATE TABLE {schema}.inspections (dt timestamptz, id_param_fk integer, value double precision);")
+            cursor.execute(f"""CREATE TABLE {schema}.inspections_calc (
+                                   id_param_fk integer, value double precision, dt timestamptz);""")
+        conn.commit()
+        with pointed_at(schema):
+            yield conn
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+def insert_inspections(conn, rows, schema=SCHEMA):
+    """
+    Adds long-format rows (Timestamp, Variable, Value) to inspections, creating the params
+    of the variables not in params yet.
+
+    Returns:
+        int: The number of rows inserted.
+    """
+    rows = rows.drop_duplicates(['Timestamp', 'Variable'])
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT description, id FROM {schema}.params;")
+        param_ids = dict(cursor.fetchall())
+        new = sorted(set(rows['Variable']) - set(param_ids))
+        next_id = max(param_ids.values(), default=0) + 1
+        param_ids.update({variable: param_id for param_id, variable in enumerate(new, start=next_id)})
+        psycopg2.extras.execute_values(cursor, f"INSERT INTO {schema}.params VALUES %s",
+                                       [(param_ids[variable], variable) for variable in new])
+        buffer = io.StringIO()
+        pd.DataFrame({'dt': pd.to_datetime(rows['Timestamp'], utc=True), 'id_param_fk': rows['Variable'].map(param_ids),
+                      'value': rows['Value']}).to_csv(buffer, index=False, header=False,
+                                                      date_format='%Y-%m-%d %H:%M:%S.%f+00')
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {schema}.inspections FROM STDIN WITH (FORMAT csv)", buffer)
+    conn.commit()
+    return len(rows)
+
+
+@contextlib.contextmanager
+def synthetic_inspections(dsn, tag_names, days, seed, schema=SCHEMA):
+    """
+    Yields a connection to empty_schema filled with the synthetic params and inspections
+    of the tags (synthetic_data.generate_dataset).
+    """
+    datasets = synthetic_data.generate_dataset(tag_names, days, seed=seed, timestamp_unit=None)
+    with empty_schema(dsn, schema) as conn:
+        count = insert_inspections(conn, pd.concat(datasets.values(), ignore_index=True), schema)
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE INDEX ON {schema}.inspections (id_param_fk, dt);")
+            cursor.execute(f"ANALYZE {schema}.inspections;")
+        conn.commit()
+        print(f"Loaded {count} synthetic rows into {schema}")
+        yield conn
+
+
+""" ******************* Scoring database ******************* """
+
+def fit_synthetic_model(tag_name, dataset, path, max_rows=2000):
+    """
+    Fits an OCSVM like train.py's on a subsample of a tag's synthetic features and saves its lean artifact.
+    """
+    from sklearn.svm import OneClassSVM
+
+    features = prep.filter_columns(prep.treat_data(dataset.copy(), tag_name)).drop(columns=['Timestamp'])
+    sample = features.sample(min(max_rows, len(features)), random_state=0)
+    fill_values = sample.mean().to_numpy()
+    X = sample.to_numpy(dtype=np.float64, na_value=np.nan)
+    X = np.where(np.isnan(X), fill_values, X)
+    detector = OneClassSVM(gamma='auto').fit(X)
+    # pyod's default contamination of 5%
+    threshold = np.percentile(-detector.decision_function(X), 95)
+    lean_model.save_artifact(path, list(features.columns), fill_values, detector, threshold)
+    return lean_model.LeanModel(path)
+
+
+def add_anomaly_tags(conn, tag_names, schema=SCHEMA):
+    """
+    Adds the tags' \\AS params to params_calc, ids from 1 in the order given.
+    """
+    with conn.cursor() as cursor:
+        psycopg2.extras.execute_values(cursor, f"INSERT INTO {schema}.params_calc VALUES %s",
+                                       [(tag_id, f'{tag_name}\\AS', 'anomaly')
+                                        for tag_id, tag_name in enumerate(tag_names, start=1)])
+    conn.commit()
+
+
+@contextlib.contextmanager
+def scoring_database(dsn, tag_names, days, seed, held_minutes, schema=SCHEMA):
+    """
+    Yields a throwaway database a predictor scores synthetic tags from: synthetic_inspections
+    with the tags as anomaly tags (params_calc) and the migrations applied. The rows of the
+    last held_minutes are moved to <schema>.held, to be replayed. The checkpoints go to
+    a temporary directory.
+
+    Yields:
+        tuple: (connection, directory of the tags' lean models, dt the held rows start after).
+    """
+    datasets = synthetic_data.generate_dataset(tag_names, days, seed=seed)
+    with tempfile.TemporaryDirectory() as work_dir, synthetic_inspections(dsn, tag_names, days, seed, schema) as conn:
+        checkpoint_dir, prep.CHECKPOINT_DIR = prep.CHECKPOINT_DIR, os.path.join(work_dir, 'checkpoints')
+        try:
+            for tag_name, dataset in datasets.items():
+                fit_synthetic_model(tag_name, dataset, os.path.join(work_dir, f'{tag_name}.npz'))
+            add_anomaly_tags(conn, tag_names, schema)
+            migrations.apply_migrations(conn)
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT max(dt) - %s * interval '1 minute' FROM {schema}.inspections;", (held_minutes,))
+                held_from = cursor.fetchone()[0]
+                cursor.execute(f"CREATE TABLE {schema}.held AS SELECT * FROM {schema}.inspections WHERE dt > %s;",
+                               (held_from,))
+                cursor.execute(f"DELETE FROM {schema}.inspections WHERE dt > %s;", (held_from,))
+            conn.commit()
+            yield conn, work_dir, held_from
+        finally:
+            prep.CHECKPOINT_DIR = checkpoint_dir
+
+
+def replay_minutes(conn, minutes, tag_params, shared_params, minute_seconds, stop_event, schema=SCHEMA):
+    """
+    Inserts the held rows minute by minute from <schema>.held, every minute_seconds:
+    the shared signals first, then each tag's signals in their own transaction.
+
+    Returns:
+        list: [(tag_name, dt, commit time.time())].
+    """
+    arrivals = []
+    started = time.time()
+    with conn.cursor() as cursor:
+        for index, dt in enumerate(minutes):
+            if stop_event.is_set():
+                break
+            for tag_name, param_ids in [(None, shared_params)] + list(tag_params.items()):
+                cursor.execute(f"""INSERT INTO {schema}.inspections
+                                   SELECT * FROM {schema}.held WHERE dt = %s AND id_param_fk = ANY(%s);""",
+                               (dt, param_ids))
+                conn.commit()
+                if tag_name is not None:
+                    arrivals.append((tag_name, dt, time.time()))
+            time.sleep(max(started + minute_seconds * (index + 1) - time.time(), 0))
+    return arrivals
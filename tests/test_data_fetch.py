@@ -0,0 +1,128 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import data_fetch
+import helpers
+import synthetic_data
+
+NOW = pd.Timestamp('2025-03-02 00:00', tz='UTC')
+
+
+def test_tags_with_close_bounds_share_a_query():
+    lower_by_tag = {
+        'A': (NOW - pd.Timedelta(minutes=15), False),
+        'B': (NOW - pd.Timedelta(minutes=16), False),
+        'C': (NOW - pd.Timedelta(hours=12), True),
+        'D': (NOW - pd.Timedelta(minutes=80), False),
+        'E': (NOW - pd.Timedelta(minutes=90), False),
+    }
+    groups = data_fetch.group_by_lower_bound(lower_by_tag)
+    # D is more than an hour behind A, it starts the next group
+    assert groups == [(NOW - pd.Timedelta(minutes=16), ['A', 'B']),
+                      (NOW - pd.Timedelta(minutes=90), ['D', 'E']),
+                      (NOW - pd.Timedelta(hours=12), ['C'])]
+
+
+@pytest.fixture
+def inspections(pg_dsn):
+    with helpers.synthetic_inspections(pg_dsn, synthetic_data.get_tag_names(3), 1, 0) as conn:
+        yield conn
+
+
+def test_stale_tag_is_fetched_on_its_own_within_the_lookback(inspections, monkeypatch):
+    monkeypatch.setattr(data_fetch, 'FETCH_MAX_LOOKBACK', pd.Timedelta(hours=6))
+    lowers = []
+    fetch_columnar = data_fetch.fetch_columnar
+
+    def recording_fetch(cursor, param_ids, lower, upper, *args, **kwargs):
+        lowers.append(lower)
+        return fetch_columnar(cursor, param_ids, lower, upper, *args, **kwargs)
+
+    monkeypatch.setattr(data_fetch, 'fetch_columnar', recording_fetch)
+    fresh, other, stale = synthetic_data.get_tag_names(3)
+    with inspections.cursor() as cursor:
+        upper = pd.Timestamp(data_fetch.get_upper_bound(cursor))
+        since_by_tag = {fresh: upper - pd.Timedelta(minutes=15), other: upper - pd.Timedelta(minutes=20),
+                        stale: upper - pd.Timedelta(days=3)}
+        datasets = data_fetch.fetch_tags_data(cursor, data_fetch.ParamResolver(), [fresh, other, stale], since_by_tag)
+
+        assert lowers == [upper - pd.Timedelta(minutes=20), upper - pd.Timedelta(hours=6)]
+        assert datasets[fresh]['Timestamp'].min() == upper - pd.Timedelta(minutes=14)
+        assert datasets[other]['Timestamp'].min() == upper - pd.Timedelta(minutes=19)
+        # Capped to FETCH_MAX_LOOKBACK instead of the three days of its checkpoint
+        assert datasets[stale]['Timestamp'].min() == upper - pd.Timedelta(hours=6)
+        # Each tag reads what it would read fetched alone
+        for tag_name, dataset in datasets.items():
+            alone = data_fetch.fetch_tags_data(cursor, data_fetch.ParamResolver(), [tag_name],
+                                               {tag_name: since_by_tag[tag_name]})[tag_name]
+            assert len(dataset) == len(alone)
+            assert set(dataset['Variable'].astype(str)) == set(alone['Variable'].astype(str))
+
+
+def copy_binary(conn, query):
+    buffer = io.BytesIO()
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    conn.commit()
+    return buffer.getbuffer()
+
+
+def test_copy_decoder_reads_utc_nanoseconds_and_numeric_values(schema_conn):
+    # Values stored as numeric, like a plant historian's
+    with schema_conn.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {helpers.SCHEMA}.inspections ALTER COLUMN value TYPE numeric;")
+        cursor.execute(f"""INSERT INTO {helpers.SCHEMA}.inspections VALUES
+                           ('2025-03-01 00:00:00.123456-03', 7, 0.1),
+                           ('2025-03-01 00:00:00.123456-03', 7, 0.2),
+                           ('2025-03-01 00:00:00.123456-03', 7, NULL),
+                           ('2025-03-01 04:00:00+01', 9, 123456789.123456789012),
+                           ('1999-12-31 23:59:59.999999+00', 9, -1e-7);""")
+        schema_conn.commit()
+        columns = data_fetch.fetch_columnar(cursor, [7, 9], None, pd.Timestamp('2025-03-02', tz='UTC'))
+    # Before the PostgreSQL epoch, then the same instant in two time zones, in time order
+    assert columns['Timestamp'].tolist() == [pd.Timestamp('1999-12-31 23:59:59.999999', tz='UTC').value,
+                                             pd.Timestamp('2025-03-01 03:00:00', tz='UTC').value,
+                                             pd.Timestamp('2025-03-01 03:00:00.123456', tz='UTC').value]
+    assert columns['id_param_fk'].tolist() == [9, 9, 7]
+    # The NULL is left out of the average and the count
+    assert columns['Value'].tolist() == [-1e-7, 123456789.12345679, 0.15]
+    assert columns['samples'].tolist() == [1, 1, 2]
+    long = data_fetch.columns_to_long_df(columns, {7: 'A', 9: 'B'})
+    assert long['Timestamp'].iloc[0] == pd.Timestamp('1999-12-31 23:59:59.999999', tz='UTC')
+
+
+def test_copy_decoder_refuses_nulls(schema_conn):
+    row = "SELECT now(), 1, 1.5::float8, 1::bigint"
+    assert data_fetch.decode_copy_binary(copy_binary(schema_conn, f"{row} UNION ALL {row}"))['Value'].tolist() == [1.5, 1.5]
+    for query in [f"{row} UNION ALL SELECT NULL, 1, 1.5::float8, 1::bigint",
+                  f"{row} UNION ALL SELECT now(), 1, 1.5::float8, NULL::bigint",
+                  # Two NULL timestamps leave the body a whole number of rows
+                  "SELECT NULL::timestamptz, 1, 1.5::float8, 1::bigint FROM generate_series(1, 8)"]:
+        with pytest.raises(ValueError, match='NULL'):
+            data_fetch.decode_copy_binary(copy_binary(schema_conn, query))
+    # float4 values
+    columns = data_fetch.decode_copy_binary(copy_binary(schema_conn, "SELECT now(), 1, 0.1::float4, 1::bigint"),
+                                            np.float32)
+    assert columns['Value'].dtype == np.float32 and columns['Value'][0] == np.float32(0.1)
+
+
+def test_streamed_chunks_are_the_range_fetched_at_once(inspections):
+    tag_name = synthetic_data.get_tag_names(3)[1]
+    with inspections.cursor() as cursor:
+        upper = pd.Timestamp(data_fetch.get_upper_bound(cursor))
+        start_date, end_date = upper - pd.Timedelta(hours=20), upper - pd.Timedelta(hours=1)
+        whole = data_fetch.fetch_tag_range(cursor, data_fetch.ParamResolver(), tag_name, start_date, end_date)
+    chunks = list(data_fetch.stream_tag_range(inspections, data_fetch.ParamResolver(), tag_name, start_date, end_date,
+                                              batch_rows=1000))
+    assert len(chunks) > 5
+    # No minute split across chunks, each holding about batch_rows rows at most
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous['Timestamp'].max() < chunk['Timestamp'].min()
+    assert max(len(chunk) for chunk in chunks) <= 1000 * 1.05
+    streamed = pd.concat(chunks, ignore_index=True)
+    assert streamed['Timestamp'].min() == start_date and streamed['Timestamp'].max() == end_date
+    # The same rows, in whatever order within a minute
+    streamed, whole = [rows.astype({'Variable': str}).sort_values(['Timestamp', 'Variable'], ignore_index=True)
+                       for rows in (streamed, whole)]
+    pd.testing.assert_frame_equal(streamed, whole)
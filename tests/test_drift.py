@@ -0,0 +1,86 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import drift
+
+FEATURES = ['a_mean_1h', 'a_std_6h']
+
+
+def get_features(days, seed, shift=0.0, start='2025-03-01'):
+    rng = np.random.default_rng(seed)
+    minutes = int(days * 24 * 60)
+    return pd.DataFrame({'Timestamp': pd.date_range(start, periods=minutes, freq='min'),
+                         'a_mean_1h': rng.normal(10 + shift, 1, minutes),
+                         'a_std_6h': rng.gamma(2, 0.5 + shift / 2, minutes)})
+
+
+def no_rates():
+    return pd.DataFrame(columns=['day', 'minutes', 'anomalies'])
+
+
+def get_info(profile, trained_at='2025-03-07T00:00:00+00:00'):
+    return {'trained_at': trained_at, 'profile': profile}
+
+
+def test_psi_of_the_same_distribution_vs_a_shifted_one():
+    profile = drift.build_profile(get_features(6, 0), window_days=1)
+    assert set(profile['features']) == set(FEATURES)
+    assert profile['baseline_psi'] is not None and profile['baseline_psi'] < 0.05
+
+    same = drift.compare_features(profile, get_features(1, 1))
+    shifted = drift.compare_features(profile, get_features(1, 1, shift=2))
+    assert max(same.values()) < 0.05
+    assert min(shifted.values()) > 1
+    # Highest first
+    assert list(shifted.values()) == sorted(shifted.values(), reverse=True)
+
+    now = pd.Timestamp('2025-03-09', tz='UTC')
+    kept = drift.assess_drift('PIC11151A', get_info(profile), get_features(1, 1), no_rates(), now)
+    drifted = drift.assess_drift('PIC11151A', get_info(profile), get_features(1, 1, shift=2), no_rates(), now)
+    assert kept['reasons'] == [] and kept['severity'] < 1
+    assert drifted['severity'] > 1 and 'median feature PSI' in drifted['reasons'][0]
+    assert drifted['age_hours'] == 48
+
+
+def test_missing_feature_counts_as_all_missing():
+    profile = drift.build_profile(get_features(2, 0), window_days=1)
+    psi = drift.compare_features(profile, get_features(1, 1).drop(columns=['a_std_6h']))
+    assert psi['a_std_6h'] > 5 > psi['a_mean_1h']
+
+
+def test_anomaly_rate_rise():
+    profile = drift.build_profile(get_features(2, 0), scores=np.r_[np.zeros(95), np.ones(5)], threshold=0.5,
+                                  window_days=1)
+    assert profile['anomaly_rate'] == 0.05
+    days = pd.date_range('2025-03-08', periods=2, freq='D', tz='UTC')
+    rates = pd.DataFrame({'day': days, 'minutes': [1440, 1440], 'anomalies': [288, 432]})
+    assessment = drift.assess_drift('PIC11151A', get_info(profile), get_features(1, 1), rates,
+                                    pd.Timestamp('2025-03-10', tz='UTC'))
+    assert assessment['anomaly_rate'] == pytest.approx(0.25)
+    assert assessment['rate_trend'] == pytest.approx(0.1)
+    assert assessment['severity'] == pytest.approx(2)
+    assert assessment['reasons'] == ["anomaly rate 25.0% vs 5.0% when trained"]
+
+
+def assessment(tag, severity, cost_s, age_hours=100.0):
+    return {'tag': tag, 'severity': severity, 'cost_s': cost_s, 'age_hours': age_hours, 'psi': severity,
+            'psi_limit': 1.0, 'rows': 1440, 'anomaly_rate': None,
+            'reasons': ['median feature PSI'] if severity >= 1 else []}
+
+
+def test_budget_retrains_the_most_drifted_first(tmp_path):
+    assessments = [assessment('cheap', 1.5, 100), assessment('worst', 4, 600), assessment('big', 3, 600),
+                   assessment('young', 5, 10, age_hours=2), assessment('fine', 0.5, 10),
+                   {'tag': 'new', 'decision': 'skipped', 'reason': 'no model trained from the manifest'}]
+    selected = drift.select_retraining(assessments, 1000)
+    assert [item['tag'] for item in selected] == ['worst', 'cheap']
+    decisions = {item['tag']: item['decision'] for item in assessments}
+    assert decisions == {'cheap': 'retrain', 'worst': 'retrain', 'big': 'deferred', 'young': 'keep', 'fine': 'keep',
+                         'new': 'skipped'}
+    assert 'exceed the 400s left of the budget' in assessments[2]['reason']
+
+    log_path = tmp_path / 'drift.jsonl'
+    drift.log_decisions(assessments, str(log_path))
+    records = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [record['decision'] for record in records] == [item['decision'] for item in assessments]
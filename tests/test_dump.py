@@ -0,0 +1,94 @@
+import hashlib
+import pandas as pd
+import pytest
+import dump
+import helpers
+import synthetic_data
+
+TABLE = f'{helpers.SCHEMA}.chlorum_dump'
+
+
+@pytest.fixture
+def export(tmp_path):
+    """
+    A Timestamp (UTC milliseconds), Variable, Value export of two synthetic tags, with a column the load ignores.
+    """
+    datasets = synthetic_data.generate_dataset(synthetic_data.get_tag_names(2), 0.5, seed=2)
+    rows = pd.concat(datasets.values(), ignore_index=True).drop_duplicates(['Timestamp', 'Variable'])
+    rows = rows.assign(Quality='good')[['Quality'] + dump.COLUMNS]
+    path = tmp_path / 'export.csv'
+    rows.to_csv(path, index=False)
+    return str(path), rows
+
+
+@pytest.fixture
+def conn(schema_conn):
+    with schema_conn.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {TABLE} (variable text, value double precision, "Timestamp" timestamp);')
+    schema_conn.commit()
+    return schema_conn
+
+
+def get_checksum(lines):
+    return hashlib.md5('\n'.join(sorted(lines)).encode()).hexdigest()
+
+
+def get_expected(rows, shift_hours):
+    """
+    Returns the row count and checksum of an export loaded with shift_hours.
+    """
+    milliseconds = rows['Timestamp'] + int(shift_hours * 3600 * 1000)
+    return len(rows), get_checksum(f'{variable},{value!r},{timestamp}' for variable, value, timestamp
+                                   in zip(rows['Variable'], rows['Value'], milliseconds))
+
+
+def get_loaded(conn):
+    """
+    Returns the row count and checksum of the rows in the dump table.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"""SELECT variable, value, (extract(epoch FROM "Timestamp") * 1000)::bigint FROM {TABLE};""")
+        rows = cursor.fetchall()
+    conn.commit()
+    return len(rows), get_checksum(f'{variable},{value!r},{timestamp}' for variable, value, timestamp in rows)
+
+
+def test_round_trip(conn, export):
+    path, rows = export
+    result = dump.load_csv(conn, path, TABLE, shift_hours=-3, chunk_rows=5000, commit_rows=20000)
+    assert result['rows'] == result['total'] == len(rows)
+    assert get_loaded(conn) == get_expected(rows, -3)
+
+
+def test_failed_load_resumes_after_the_last_commit(conn, export, monkeypatch):
+    path, rows = export
+    copy_chunk = dump.copy_chunk
+    chunks = []
+
+    def failing_copy_chunk(cursor, table, chunk, shift_hours):
+        chunks.append(len(chunk))
+        if len(chunks) == 7:
+            raise RuntimeError("connection lost")
+        copy_chunk(cursor, table, chunk, shift_hours)
+
+    monkeypatch.setattr(dump, 'copy_chunk', failing_copy_chunk)
+    with pytest.raises(RuntimeError):
+        dump.load_csv(conn, path, TABLE, shift_hours=0, chunk_rows=1000, commit_rows=3000)
+    # The 6th chunk was committed, the 7th rolled back
+    assert get_loaded(conn)[0] == 6000
+    monkeypatch.setattr(dump, 'copy_chunk', copy_chunk)
+    result = dump.load_csv(conn, path, TABLE, shift_hours=0, chunk_rows=1000, commit_rows=3000)
+    assert result['rows'] == len(rows) - 6000 and result['total'] == len(rows)
+    # Every row once
+    assert get_loaded(conn) == get_expected(rows, 0)
+    # Loaded already: nothing left to load
+    assert dump.load_csv(conn, path, TABLE, shift_hours=0)['rows'] == 0
+
+
+def test_changed_file_is_not_resumed(conn, export):
+    path, rows = export
+    dump.load_csv(conn, path, TABLE, shift_hours=0)
+    rows.iloc[:10].to_csv(path, index=False, mode='a', header=False)
+    with pytest.raises(SystemExit, match='--restart'):
+        dump.load_csv(conn, path, TABLE, shift_hours=0)
+    assert get_loaded(conn)[0] == len(rows)
@@ -0,0 +1,80 @@
+import threading
+import time
+import data_fetch
+import event_predictor
+import helpers
+import migrations
+import predict
+import synthetic_data
+
+
+def test_burst_of_notifications_is_scored_once():
+    debouncer = event_predictor.TagDebouncer(debounce=2, max_delay=10)
+    for now in [0, 0.5, 1, 1.5]:
+        debouncer.add('PIC11151A', now)
+    # Due 2s after the last notification
+    assert debouncer.pop_due(3.4) == []
+    assert debouncer.pop_due(3.5) == [('PIC11151A', 0)]
+    assert debouncer.pop_due(10) == []
+
+
+def test_continuous_stream_is_scored_after_max_delay():
+    debouncer = event_predictor.TagDebouncer(debounce=2, max_delay=10)
+    for now in range(10):
+        debouncer.add('PIC11151A', now)
+        assert debouncer.pop_due(now) == []
+    assert debouncer.pop_due(10) == [('PIC11151A', 0)]
+    # The notifications after it start a new wait
+    debouncer.add('PIC11151A', 10.5)
+    assert debouncer.get_due_time('PIC11151A') == 12.5
+
+
+def test_tags_are_due_independently_longest_waiting_first():
+    debouncer = event_predictor.TagDebouncer(debounce=2, max_delay=10)
+    debouncer.add('B', 0)
+    debouncer.add('A', 1)
+    debouncer.add('C', 5)
+    assert debouncer.pop_due(3) == [('B', 0), ('A', 1)]
+    assert list(debouncer.pending) == ['C']
+
+
+def test_seconds_until_due():
+    debouncer = event_predictor.TagDebouncer(debounce=2, max_delay=10)
+    assert debouncer.seconds_until_due(0) is None
+    debouncer.add('A', 0)
+    debouncer.add('B', 1)
+    assert debouncer.seconds_until_due(0.5) == 1.5
+    assert debouncer.seconds_until_due(5) == 0
+
+
+def test_every_replayed_minute_is_scored_once(pg_dsn):
+    tag_names = synthetic_data.get_tag_names(3)
+    minutes = 4
+    with helpers.scoring_database(pg_dsn, tag_names, 2, 0, minutes) as (conn, models_dir, held_from):
+        migrations.set_notify_trigger(conn, helpers.SCHEMA, True)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT dt FROM {helpers.SCHEMA}.held ORDER BY dt;")
+            held_minutes = [row[0] for row in cursor.fetchall()]
+            resolver = data_fetch.ParamResolver()
+            resolver.refresh(cursor)
+        conn.commit()
+
+        predictor = event_predictor.EventPredictor({'dsn': pg_dsn}, 0.2, 1)
+        predictor.model_cache = predict.ModelCache(models_dir)
+        listener = threading.Thread(target=predictor.run_once)
+        listener.start()
+        try:
+            assert predictor.ready.wait(300)
+            helpers.replay_minutes(conn, held_minutes, {tag_name: resolver.get_tag_params(tag_name) for tag_name in tag_names},
+                                   resolver.get_shared_params(), 0.3, predictor.stop_event)
+            time.sleep(2)
+        finally:
+            predictor.stop_event.set()
+            listener.join()
+
+        with conn.cursor() as cursor:
+            cursor.execute(f"""SELECT id_param_fk, count(*), count(DISTINCT dt) FROM {helpers.SCHEMA}.inspections_calc
+                               WHERE dt > %s GROUP BY id_param_fk;""", (held_from,))
+            scored = cursor.fetchall()
+    assert len(held_minutes) == minutes
+    assert sorted(scored) == [(tag_id, minutes, minutes) for tag_id in range(1, len(tag_names) + 1)]
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+import pytest
+import helpers
+import instrumentation
+import migrations
+import tick_pipeline
+
+
+@pytest.fixture
+def run():
+    run = instrumentation.start_run('predict')
+    yield run
+    instrumentation.finish_run()
+
+
+def read_records():
+    with open(instrumentation.METRICS_FILE) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_pipelined_stages_are_attributed_to_their_tag(run):
+    def step(name):
+        def function(tag_name, previous):
+            with instrumentation.attribute(tag_name), instrumentation.stage(name):
+                # Lets the other stages run meanwhile
+                time.sleep(0.01)
+            return tag_name
+        return function
+
+    tag_names = [f'TAG{index}' for index in range(6)]
+    results = tick_pipeline.run_pipeline([(tag_name, tag_name) for tag_name in tag_names],
+                                         [('fetch', step('fetch')), ('score', step('score')), ('write', step('write'))], 2)
+    assert all(status == 'ok' for status, _ in results.values())
+    records = read_records()
+    assert sorted((record['tag'], record['stage']) for record in records) == sorted(
+        (tag_name, stage) for tag_name in tag_names for stage in ('fetch', 'score', 'write'))
+    assert all(record['run_id'] == run.run_id for record in records)
+    # Nothing left attributed on this thread
+    with instrumentation.stage('report'):
+        pass
+    assert read_records()[-1]['tag'] is None
+
+
+def test_tag_total_and_nested_stages(run):
+    with instrumentation.tag('PIC11151A'):
+        with instrumentation.stage('fetch') as details:
+            details['rows'] = 42
+    fetch, total = read_records()
+    assert (fetch['tag'], fetch['stage'], fetch['rows']) == ('PIC11151A', 'fetch', 42)
+    assert (total['tag'], total['stage']) == ('PIC11151A', 'tag_total') and total['seconds'] >= fetch['seconds']
+
+
+def count_metrics(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT run_id, tag, stage, rows FROM {helpers.SCHEMA}.anomaly_monitor_metrics ORDER BY id;")
+        rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def test_flush_to_the_database(schema_conn, monkeypatch):
+    migrations.apply_migrations(schema_conn)
+    run = instrumentation.start_run('train')
+    with instrumentation.tag('PIC11151A'), instrumentation.stage('fetch', rows=3):
+        pass
+    # Without METRICS_DB only the file has them
+    instrumentation.flush(schema_conn)
+    assert count_metrics(schema_conn) == [] and run.pending == []
+
+    monkeypatch.setattr(instrumentation, 'METRICS_DB', True)
+    with instrumentation.tag('PIC11151A'), instrumentation.stage('fetch', rows=3):
+        pass
+    instrumentation.flush(schema_conn)
+    assert count_metrics(schema_conn) == [(run.run_id, 'PIC11151A', 'fetch', 3),
+                                          (run.run_id, 'PIC11151A', 'tag_total', None)]
+    instrumentation.finish_run(schema_conn)
+    assert count_metrics(schema_conn)[-1][2] == 'run_total'
+    assert len(read_records()) == 5
+
+
+@pytest.fixture
+def profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'PROFILE_SLOWEST_TAG', True)
+    monkeypatch.setattr(instrumentation, 'METRICS_DIR', str(tmp_path / 'metrics'))
+    assert not tracemalloc.is_tracing()
+    run = instrumentation.start_run('predict')
+    yield run, tmp_path / 'metrics' / 'profiles'
+    instrumentation.finish_run()
+    # Traced for the run only
+    assert not tracemalloc.is_tracing()
+
+
+def test_slowest_tag_profile(profiled):
+    run, profile_dir = profiled
+    kept = []
+    for tag_name, seconds in [('FAST', 0), ('SLOW', 0.2), ('MEDIUM', 0.1)]:
+        with instrumentation.tag(tag_name):
+            kept.append(bytearray(10 ** 7))
+            time.sleep(seconds)
+    assert run.slowest[0] == 'SLOW'
+    base = run.dump_slowest_profile()
+    assert sorted(os.listdir(profile_dir)) == [f'{run.run_id}-SLOW.prof', f'{run.run_id}-SLOW.tracemalloc.txt']
+    with open(f'{base}.tracemalloc.txt') as f:
+        lines = f.readlines()
+    # The 10 MB the tag allocated come first
+    assert lines[0].startswith('SLOW: ') and 'test_instrumentation.py' in lines[1] and '(+9766 KiB)' in lines[1]
+
+
+def test_concurrent_tags_profile_one_at_a_time(profiled):
+    run, profile_dir = profiled
+    started = threading.Event()
+    release = threading.Event()
+
+    def other_thread_tag():
+        with instrumentation.tag('OTHER_THREAD'):
+            started.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=other_thread_tag)
+    thread.start()
+    started.wait(5)
+    # Slower, but run while the other thread's tag is being profiled
+    with instrumentation.tag('CONCURRENT'):
+        time.sleep(0.3)
+    release.set()
+    thread.join()
+    assert run.slowest[0] == 'OTHER_THREAD'
+    with instrumentation.tag('AFTERWARDS'):
+        time.sleep(1)
+    assert run.slowest[0] == 'AFTERWARDS'
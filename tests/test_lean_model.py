@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+from sklearn.svm import OneClassSVM
+import lean_model
+
+FEATURES = ['a_mean_1h', 'a_std_1h', 'b_mean_6h']
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    """
+    An artifact of an OCSVM with the 'a_*' features imputed, 'b_mean_6h' not, and 'empty'
+    dropped by the imputer.
+    """
+    rng = np.random.default_rng(3)
+    X = rng.normal([10, 1, -5], [2, 0.1, 1], (300, 3))
+    detector = OneClassSVM(kernel='rbf', gamma=0.3, nu=0.05).fit(X)
+    path = str(tmp_path / 'tag.npz')
+    fill_values = [10.0, 1.0, np.nan]
+    lean_model.save_artifact(path, FEATURES, fill_values, detector, 0.0)
+    return path, detector, np.array(fill_values)
+
+
+def pipeline_scores(detector, fill_values, sample):
+    X = sample[FEATURES].to_numpy()
+    return -detector.decision_function(np.where(np.isnan(X), fill_values, X))
+
+
+def test_verification_sample_matches_the_pipeline_inputs(artifact):
+    path, detector, fill_values = artifact
+    sample = lean_model.get_verification_sample(path, FEATURES + ['empty'])
+
+    assert list(sample.columns) == FEATURES + ['empty']
+    assert sample['empty'].isna().all()
+    # Only imputed features are left missing, the others would fail the pipeline
+    assert sample[['a_mean_1h', 'a_std_1h']].isna().any().all()
+    assert sample['b_mean_6h'].notna().all()
+    # Around the support vectors: both sides of the decision boundary
+    scores = pipeline_scores(detector, fill_values, sample)
+    assert (scores > 0).any() and (scores < 0).any()
+    assert lean_model.verify_artifact(path, sample, scores)
+    assert os.path.exists(path)
+
+
+def test_mismatching_artifact_is_removed(artifact):
+    path, detector, fill_values = artifact
+    sample = lean_model.get_verification_sample(path, FEATURES)
+    scores = pipeline_scores(detector, fill_values, sample)
+    scores[7] += 1e-3
+
+    assert not lean_model.verify_artifact(path, sample, scores)
+    assert not os.path.exists(path)
@@ -0,0 +1,70 @@
+import select
+import psycopg2
+import psycopg2.errors
+import pytest
+import helpers
+import migrations
+
+
+def has_trigger(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_trigger WHERE tgname = 'anomaly_monitor_notify' AND tgrelid = %s::regclass;",
+                       (f'{helpers.SCHEMA}.inspections',))
+        return cursor.fetchone()[0] == 1
+
+
+def test_migrations_do_not_depend_on_the_predictor_mode(monkeypatch):
+    monkeypatch.setattr(migrations, 'INSPECTIONS_NOTIFY', False)
+    daemon = migrations.get_migrations()
+    monkeypatch.setattr(migrations, 'INSPECTIONS_NOTIFY', True)
+    assert migrations.get_migrations() == daemon
+    assert '0003_inspections_notify_trigger' in [name for name, _ in daemon]
+
+
+def test_notify_trigger_follows_the_mode(schema_conn, pg_dsn):
+    conn = schema_conn
+    migrations.apply_migrations(conn)
+    # The migrations alone leave inspections without trigger, whatever the mode
+    assert not has_trigger(conn)
+
+    assert migrations.set_notify_trigger(conn, helpers.SCHEMA, True)
+    assert not migrations.set_notify_trigger(conn, helpers.SCHEMA, True)
+    assert has_trigger(conn)
+
+    listener = psycopg2.connect(pg_dsn)
+    listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {migrations.NOTIFY_CHANNEL};")
+        with conn.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {helpers.SCHEMA}.inspections SELECT now(), 7, i FROM generate_series(1, 3) i;")
+        conn.commit()
+        select.select([listener], [], [], 5)
+        listener.poll()
+        # One notification per param and transaction
+        assert [notify.payload for notify in listener.notifies] == ['7']
+    finally:
+        listener.close()
+
+    assert migrations.set_notify_trigger(conn, helpers.SCHEMA, False)
+    assert not migrations.set_notify_trigger(conn, helpers.SCHEMA, False)
+    assert not has_trigger(conn)
+
+
+def test_duplicate_scores_are_deleted_before_the_unique_index(schema_conn):
+    conn = schema_conn
+    with conn.cursor() as cursor:
+        # Param 1 scored twice over the same minutes, the second copy last; param 2 once
+        cursor.execute(f"""INSERT INTO {helpers.SCHEMA}.inspections_calc
+                           SELECT param_id, copy, '2025-03-01'::timestamptz + minute * interval '1 minute'
+                           FROM generate_series(1, 2) copy, generate_series(0, 9) minute, generate_series(1, 2) param_id
+                           WHERE copy = 1 OR param_id = 1;""")
+    conn.commit()
+    assert '0001_inspections_calc_unique_param_dt' in migrations.apply_migrations(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"""SELECT id_param_fk, count(*), count(DISTINCT dt), min(value), max(value)
+                           FROM {helpers.SCHEMA}.inspections_calc GROUP BY id_param_fk ORDER BY id_param_fk;""")
+        assert cursor.fetchall() == [(1, 10, 10, 2, 2), (2, 10, 10, 1, 1)]
+        with pytest.raises(psycopg2.errors.UniqueViolation):
+            cursor.execute(f"INSERT INTO {helpers.SCHEMA}.inspections_calc VALUES (1, 0, '2025-03-01');")
+    conn.rollback()
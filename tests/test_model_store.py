@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.svm import OneClassSVM
+import lean_model
+import model_store
+
+FEATURES = ['a_mean_1h', 'a_std_1h', 'b_mean_6h']
+
+
+def write_model(model_path, seed):
+    """
+    Writes the lean artifact <model_path>.npz of an OCSVM fitted on data of the seed.
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal([10, 1, -5], [2, 0.1, 1], (300, 3))
+    detector = OneClassSVM(kernel='rbf', gamma=0.3, nu=0.05).fit(X)
+    lean_model.save_artifact(lean_model.get_artifact_path(model_path), FEATURES, [10.0, 1.0, np.nan], detector, 0.0)
+
+
+def get_sample(seed=9):
+    rng = np.random.default_rng(seed)
+    sample = pd.DataFrame(rng.normal([10, 1, -5], [3, 0.2, 2], (500, 3)), columns=FEATURES)
+    sample.iloc[::7, 0] = np.nan
+    return sample
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = str(tmp_path / 'PIC11151A')
+    write_model(path, 0)
+    return path
+
+
+def test_mapped_model_scores_like_the_artifact(model_path):
+    mapped = model_store.load_artifact(model_path)
+    assert isinstance(mapped.support_vectors, np.memmap)
+    assert not mapped.support_vectors.flags.writeable
+    sample = get_sample()
+    pd.testing.assert_frame_equal(mapped.predict(sample),
+                                  lean_model.LeanModel(lean_model.get_artifact_path(model_path)).predict(sample))
+
+
+def test_retrained_artifact_is_a_new_version(model_path):
+    first = model_store.publish_artifact(model_path)
+    # Published once per artifact version
+    assert model_store.publish_artifact(model_path) == first
+    artifact_path = lean_model.get_artifact_path(model_path)
+    first_mtime = os.stat(artifact_path).st_mtime_ns
+    write_model(model_path, 1)
+    os.utime(artifact_path, ns=(first_mtime + 10**9, first_mtime + 10**9))
+    second = model_store.publish_artifact(model_path)
+    assert second != first
+    store_dir = model_store.get_store_dir(model_path)
+    assert model_store.get_versions(store_dir) == [os.path.basename(first), os.path.basename(second)]
+    sample = get_sample()
+    assert not np.allclose(model_store.load(first).predict(sample)['Anomaly_Score'],
+                           model_store.load(second).predict(sample)['Anomaly_Score'])
+
+
+def test_failed_publish_leaves_no_partial_version(model_path, monkeypatch):
+    first = model_store.publish_artifact(model_path)
+    model = lean_model.LeanModel(lean_model.get_artifact_path(model_path))
+    saved = []
+
+    def save_then_fail(path, array):
+        if len(saved) == 2:
+            raise OSError("disk full")
+        saved.append(path)
+        real_save(path, array)
+
+    real_save = np.save
+    monkeypatch.setattr(model_store.np, 'save', save_then_fail)
+    with pytest.raises(OSError, match='disk full'):
+        model_store.publish(model_path, model, 'v99')
+    # The reader only ever lists the complete version, and nothing half-written is left
+    store_dir = model_store.get_store_dir(model_path)
+    assert model_store.get_versions(store_dir) == [os.path.basename(first)]
+    assert sorted(os.listdir(store_dir)) == [os.path.basename(first)]
+    model_store.load(first)
+
+
+def test_prune_keeps_the_newest_and_the_live_version(model_path, monkeypatch):
+    model = lean_model.LeanModel(lean_model.get_artifact_path(model_path))
+    store_dir = model_store.get_store_dir(model_path)
+    for version in ['v1', 'v2', 'v3']:
+        model_store.publish(model_path, model, version)
+    assert model_store.get_versions(store_dir) == ['v2', 'v3']
+
+    # A reader still mapping a removed version scores from it until it unmaps it
+    mapped = model_store.load(os.path.join(store_dir, 'v2'))
+    model_store.publish(model_path, model, 'v4')
+    assert model_store.get_versions(store_dir) == ['v3', 'v4']
+    assert len(mapped.predict(get_sample())) == 500
+
+    # The version being published is kept even when older than the others
+    monkeypatch.setattr(model_store, 'STORE_KEEP_VERSIONS', 1)
+    model_store.publish(model_path, model, 'v0')
+    assert model_store.get_versions(store_dir) == ['v0', 'v4']
@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import pre_processing as prep
+import synthetic_data
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'training_data', 'PIC11151A.csv')
+TAG_NAME = 'PIC11151A'
+
+
+@pytest.fixture(scope='module')
+def sample():
+    return pd.read_csv(SAMPLE_CSV)
+
+
+def replay_ticks(data, tick_minutes, tag_name=TAG_NAME):
+    """
+    Scores the long-format data like the predictor does, one tick of tick_minutes at a
+    time, the checkpoint going through save_checkpoint/load_checkpoint between ticks.
+    """
+    timestamps = pd.to_datetime(data['Timestamp'], unit='ms')
+    ticks = pd.date_range(timestamps.min().floor(f'{tick_minutes}min'), timestamps.max(),
+                          freq=f'{tick_minutes}min') + pd.Timedelta(minutes=tick_minutes)
+    parts = []
+    previous = None
+    for tick in ticks:
+        rows = (timestamps < tick) if previous is None else ((timestamps >= previous) & (timestamps < tick))
+        part, checkpoint = prep.treat_data_incremental(data[rows].copy(), tag_name, prep.load_checkpoint(tag_name))
+        prep.save_checkpoint(tag_name, checkpoint)
+        parts.append(part)
+        previous = tick
+    return pd.concat([part for part in parts if len(part)], ignore_index=True)
+
+
+def test_incremental_ticks_match_full_recompute(sample):
+    full = prep.treat_data(sample.copy(), TAG_NAME)
+    incremental = replay_ticks(sample, 15)
+
+    assert incremental['Timestamp'].tolist() == full['Timestamp'].tolist()
+    assert list(incremental.columns) == list(full.columns)
+    features = full.columns.drop('Timestamp')
+    expected = full[features].to_numpy(dtype=np.float64)
+    got = incremental[features].to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(np.isnan(got), np.isnan(expected))
+    np.testing.assert_allclose(got, expected, rtol=0, atol=1e-9)
+
+
+def test_checkpoint_keeps_only_the_history_horizon(sample):
+    _, checkpoint = prep.treat_data_incremental(sample.copy(), TAG_NAME)
+    tail = checkpoint['raw_tail']['Timestamp']
+    horizon = prep.get_history_horizon(prep.WINDOW_SIZES)
+    assert checkpoint['last_timestamp'] == tail.iloc[-1]
+    # The horizon plus the row before it, read by the crossings count
+    assert tail.iloc[1] > checkpoint['last_timestamp'] - horizon
+    assert tail.iloc[0] <= checkpoint['last_timestamp'] - horizon
+
+
+def test_tick_without_new_rows_keeps_the_checkpoint(sample):
+    _, checkpoint = prep.treat_data_incremental(sample.copy(), TAG_NAME)
+    replayed = sample[pd.to_datetime(sample['Timestamp'], unit='ms') > pd.Timestamp('2025-03-31 10:00')].copy()
+    part, unchanged = prep.treat_data_incremental(replayed, TAG_NAME, checkpoint)
+    assert part.empty
+    assert unchanged is checkpoint
+
+
+def test_checkpoint_of_other_windows_starts_cold(sample):
+    _, checkpoint = prep.treat_data_incremental(sample.copy(), TAG_NAME)
+    checkpoint['window_sizes'] = [1, 6]
+    last_day = sample[pd.to_datetime(sample['Timestamp'], unit='ms') >= pd.Timestamp('2025-03-31')].copy()
+    part, _ = prep.treat_data_incremental(last_day, TAG_NAME, checkpoint)
+    # Cold: every row of the data is aggregated again
+    assert part['Timestamp'].min() == pd.Timestamp('2025-03-31')
+
+
+def get_tick_data(tag_names, days=1, tick_minutes=15):
+    """
+    Returns the tick_data of synthetic tags checkpointed up to the last tick_minutes, as predict.fetch_tick_data does.
+    """
+    datasets = synthetic_data.generate_dataset(tag_names, days, seed=5)
+    cut = max(dataset['Timestamp'].max() for dataset in datasets.values()) - tick_minutes * 60 * 1000
+    tick_data = {}
+    for tag_name, dataset in datasets.items():
+        _, checkpoint = prep.treat_data_incremental(dataset[dataset['Timestamp'] <= cut].copy(), tag_name)
+        tick_data[tag_name] = (dataset[dataset['Timestamp'] > cut].reset_index(drop=True), checkpoint)
+    return tick_data
+
+
+def assert_same_features(tick_data, shared):
+    for tag_name, (dataset, checkpoint) in tick_data.items():
+        alone, _ = prep.treat_data_incremental(dataset.copy(), tag_name, checkpoint)
+        with_shared, _ = prep.treat_data_incremental(dataset.copy(), tag_name, checkpoint, shared=shared)
+        assert len(alone) > 10
+        pd.testing.assert_frame_equal(with_shared, alone)
+
+
+def test_shared_features_match_per_tag_features():
+    tick_data = get_tick_data(synthetic_data.get_tag_names(2))
+    shared = prep.SharedFeatures(tick_data)
+    assert_same_features(tick_data, shared)
+    # Both tags read the shared signals' statistics from the union
+    assert shared.hits == 2 * len(prep.SHARED_COLUMNS) and shared.misses == 0
+
+
+def test_tag_disagreeing_on_a_shared_signal_computes_its_own():
+    tick_data = get_tick_data(synthetic_data.get_tag_names(2))
+    tag_name = list(tick_data)[1]
+    dataset, checkpoint = tick_data[tag_name]
+    dataset = dataset.copy()
+    rows = dataset.index[dataset['Variable'] == synthetic_data.SHARED_SIGNAL]
+    dataset.loc[rows[-1], 'Value'] += 1
+    tick_data[tag_name] = (dataset, checkpoint)
+    shared = prep.SharedFeatures(tick_data)
+    # The union is dropped for that signal, every tag computes it
+    assert_same_features(tick_data, shared)
+    assert shared.hits == 0 and shared.misses == 2 * len(prep.SHARED_COLUMNS)
@@ -0,0 +1,229 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import data_fetch
+import helpers
+import predict
+import pre_processing as prep
+import synthetic_data
+
+TAGS = [(1, tag_name) for tag_name in synthetic_data.get_tag_names(2)]
+
+
+@pytest.fixture
+def inspections(pg_dsn):
+    with helpers.synthetic_inspections(pg_dsn, [tag_name for _, tag_name in TAGS], 1, 0) as conn:
+        yield conn
+
+
+def in_order(dataset):
+    # Variable is categorical over the descriptions fetched (fewer for one tag), and the
+    # rows of a minute come in no particular order
+    return dataset.astype({'Variable': str}).sort_values(['Timestamp', 'Variable'], ignore_index=True)
+
+
+def test_pipelined_fetch_reads_like_the_tick_fetch(inspections):
+    # One tag resumes from a checkpoint, the other one fetches its last 12 hours
+    checkpointed = TAGS[0][1]
+    with inspections.cursor() as cursor:
+        cursor.execute(f"SELECT max(dt) - interval '30 minutes' FROM {helpers.SCHEMA}.inspections;")
+        since = pd.Timestamp(cursor.fetchone()[0])
+        prep.save_checkpoint(checkpointed, {'last_timestamp': since})
+
+        resolver = data_fetch.ParamResolver()
+        tick_data = predict.fetch_tick_data(cursor, TAGS, resolver)
+        for _, tag_name in TAGS:
+            dataset, checkpoint = predict.fetch_tag_input(cursor, tag_name, None, resolver)
+            expected = tick_data[tag_name][0]
+            assert dataset['Value'].dtype == np.float64
+            pd.testing.assert_frame_equal(in_order(dataset), in_order(expected))
+            assert checkpoint == tick_data[tag_name][1]
+    assert (tick_data[checkpointed][0]['Timestamp'] > since).all()
+    assert len(tick_data[checkpointed][0]) < len(tick_data[TAGS[1][1]][0])
+
+
+""" ******************* Gap catch-up ******************* """
+
+def test_gaps_file_round_trip():
+    tag_name = TAGS[0][1]
+    day = pd.Timestamp('2025-03-01', tz='UTC')
+    gaps = predict.add_gap([], day, day + pd.Timedelta(hours=2))
+    gaps = predict.add_gap(gaps, day + pd.Timedelta(hours=5), day + pd.Timedelta(hours=6))
+    # Overlapping ranges merge
+    gaps = predict.add_gap(gaps, day + pd.Timedelta(hours=1), day + pd.Timedelta(hours=3))
+    assert gaps == [[day + pd.Timedelta(hours=5), day + pd.Timedelta(hours=6)], [day, day + pd.Timedelta(hours=3)]]
+
+    predict.save_gaps(tag_name, gaps)
+    assert predict.load_gaps(tag_name) == gaps
+    predict.save_gaps(tag_name, [])
+    assert not os.path.exists(predict.get_gaps_path(tag_name))
+    assert predict.load_gaps(tag_name) == []
+
+    # A damaged file is left to rewind.py rather than failing the tick
+    with open(predict.get_gaps_path(tag_name), 'w') as f:
+        f.write('[["2025-03-01')
+    assert predict.load_gaps(tag_name) == []
+
+
+@pytest.fixture
+def scoring(pg_dsn):
+    tag_names = [tag_name for _, tag_name in TAGS]
+    with helpers.scoring_database(pg_dsn, tag_names, 2, 0, 0) as (conn, models_dir, newest):
+        with conn.cursor() as cursor:
+            tags = predict.get_anomaly_tags(cursor)
+        conn.commit()
+        yield conn, predict.ModelCache(models_dir), [(tag_id, tag_name[:-3]) for tag_id, tag_name in tags], newest
+
+
+def get_scored_minutes(conn, tag_anomaly_id):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT min(dt), max(dt), count(*), count(DISTINCT dt) FROM {helpers.SCHEMA}.inspections_calc "
+                       f"WHERE id_param_fk = %s;", (tag_anomaly_id,))
+        row = cursor.fetchone()
+    conn.commit()
+    return row
+
+
+def test_cold_tag_starts_from_the_live_window(scoring, monkeypatch):
+    conn, model_cache, tags, newest = scoring
+    monkeypatch.setattr(predict, 'CATCHUP_LIVE_MINUTES', 60)
+    with conn.cursor() as cursor:
+        predict.skip_stale_checkpoints(cursor, tags, data_fetch.ParamResolver())
+    live_start = pd.Timestamp(newest) - pd.Timedelta(minutes=60)
+    for _, tag_name in tags:
+        assert predict.load_gaps(tag_name) == []
+        checkpoint = prep.load_checkpoint(tag_name)
+        assert live_start - pd.Timedelta(minutes=5) <= checkpoint['last_timestamp'] <= live_start
+
+
+def test_stale_checkpoint_and_watermark_gaps_are_caught_up(scoring, monkeypatch):
+    conn, model_cache, tags, newest = scoring
+    newest = pd.Timestamp(newest)
+    (scored_id, scored), (checkpointed_id, checkpointed) = tags
+    monkeypatch.setattr(predict, 'CATCHUP_LIVE_MINUTES', 600)
+    with conn.cursor() as cursor:
+        resolver = data_fetch.ParamResolver()
+        # Both tags skip to 10h before the newest data, nothing to catch up yet
+        predict.skip_stale_checkpoints(cursor, tags, resolver)
+        assert predict.load_gaps(scored) == predict.load_gaps(checkpointed) == []
+        skipped_to = prep.load_checkpoint(checkpointed)['last_timestamp']
+        # One tag was scored up to 12h before the newest data, the other one only has its checkpoint
+        watermark = newest - pd.Timedelta(hours=12)
+        cursor.execute(f"INSERT INTO {helpers.SCHEMA}.inspections_calc VALUES (%s, 0.5, %s);", (scored_id, watermark))
+        conn.commit()
+
+        monkeypatch.setattr(predict, 'CATCHUP_LIVE_MINUTES', 60)
+        predict.skip_stale_checkpoints(cursor, tags, resolver)
+        live_end = prep.load_checkpoint(scored)['last_timestamp'] + pd.Timedelta(microseconds=1)
+        assert predict.load_gaps(scored) == [[watermark + pd.Timedelta(microseconds=1), live_end]]
+        assert predict.load_gaps(checkpointed) == [[skipped_to + pd.Timedelta(microseconds=1), live_end]]
+
+        # Without budget nothing is caught up, the gaps wait for the next tick
+        monkeypatch.setattr(predict, 'CATCHUP_BUDGET_SECONDS', 0)
+        assert predict.catch_up_gaps(conn, cursor, model_cache, tags, resolver) == {}
+        assert len(predict.load_gaps(scored)) == 1
+
+        # In 4h batches, newest first, until the gaps are gone
+        monkeypatch.setattr(predict, 'CATCHUP_BUDGET_SECONDS', 300)
+        monkeypatch.setattr(predict, 'CATCHUP_BATCH_HOURS', 4)
+        caught_up = predict.catch_up_gaps(conn, cursor, model_cache, tags, resolver)
+    assert caught_up[scored] > caught_up[checkpointed] > 0
+    assert predict.load_gaps(scored) == predict.load_gaps(checkpointed) == []
+    first, last, count, distinct = get_scored_minutes(conn, scored_id)
+    assert first == watermark and last < live_end and count == distinct == caught_up[scored] + 1
+    first, last, count, distinct = get_scored_minutes(conn, checkpointed_id)
+    assert first > skipped_to and count == distinct == caught_up[checkpointed]
+
+
+def test_gaps_older_than_catchup_max_days_are_left_to_rewind(scoring, monkeypatch):
+    conn, model_cache, tags, newest = scoring
+    tag_anomaly_id, tag_name = tags[0]
+    monkeypatch.setattr(predict, 'CATCHUP_LIVE_MINUTES', 60)
+    monkeypatch.setattr(predict, 'CATCHUP_MAX_DAYS', 0.25)
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {helpers.SCHEMA}.inspections_calc VALUES (%s, 0.5, %s);",
+                       (tag_anomaly_id, pd.Timestamp(newest) - pd.Timedelta(days=1)))
+        conn.commit()
+        predict.skip_stale_checkpoints(cursor, tags[:1], data_fetch.ParamResolver())
+    (start, end), = predict.load_gaps(tag_name)
+    assert start == pd.Timestamp(newest) - pd.Timedelta(minutes=60) - pd.Timedelta(days=0.25)
+
+
+""" ******************* Failure isolation ******************* """
+
+@pytest.fixture
+def pool_scoring(pg_dsn):
+    tag_names = synthetic_data.get_tag_names(3)
+    with helpers.scoring_database(pg_dsn, tag_names, 1, 0, 0) as (conn, models_dir, newest):
+        with conn.cursor() as cursor:
+            tags = [(tag_id, tag_name[:-3]) for tag_id, tag_name in predict.get_anomaly_tags(cursor)]
+            tick_data = predict.fetch_tick_data(cursor, tags, data_fetch.ParamResolver())
+        conn.commit()
+        yield conn, models_dir, tags, tick_data
+
+
+def get_scored_tags(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT id_param_fk FROM {helpers.SCHEMA}.inspections_calc;")
+        scored = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return scored
+
+
+def test_failing_tag_does_not_stop_the_pool(pool_scoring, pg_dsn):
+    conn, models_dir, tags, tick_data = pool_scoring
+    # The second tag has no model
+    os.remove(os.path.join(models_dir, f'{tags[1][1]}.npz'))
+    pool = predict.TagScoringPool(2, {'dsn': pg_dsn}, models_dir)
+    try:
+        results = pool.score(tags, tick_data)
+    finally:
+        pool.shutdown()
+    assert results[tags[1][1]][0] == 'failed' and 'No model' in results[tags[1][1]][1]
+    assert [results[tag_name][0] for _, tag_name in (tags[0], tags[2])] == ['ok', 'ok']
+    assert get_scored_tags(conn) == {tags[0][0], tags[2][0]}
+
+
+def test_slow_tag_leaves_the_others_to_the_deadline(pool_scoring, pg_dsn, monkeypatch):
+    conn, models_dir, tags, tick_data = pool_scoring
+    compute_tag_scores = predict.compute_tag_scores
+
+    def slow_first_tag(tag_name, *args):
+        if tag_name == tags[0][1]:
+            time.sleep(3)
+        return compute_tag_scores(tag_name, *args)
+
+    # Inherited by the forked workers
+    monkeypatch.setattr(predict, 'compute_tag_scores', slow_first_tag)
+    pool = predict.TagScoringPool(1, {'dsn': pg_dsn}, models_dir)
+    try:
+        results = pool.score(tags, tick_data, deadline=time.time() + 1.5)
+    finally:
+        pool.shutdown()
+    # The slow tag was started before the deadline and finishes, the others never start
+    assert results == {tags[0][1]: results[tags[0][1]], tags[1][1]: ('skipped', 'deadline reached'),
+                       tags[2][1]: ('skipped', 'deadline reached')}
+    assert results[tags[0][1]][0] == 'ok'
+    assert get_scored_tags(conn) == {tags[0][0]}
+
+
+def test_serial_tick_isolates_a_raising_tag(pool_scoring, monkeypatch):
+    conn, models_dir, tags, tick_data = pool_scoring
+    compute_tag_scores = predict.compute_tag_scores
+
+    def raise_for_second_tag(tag_name, *args):
+        if tag_name == tags[1][1]:
+            raise ValueError("bad data")
+        return compute_tag_scores(tag_name, *args)
+
+    monkeypatch.setattr(predict, 'compute_tag_scores', raise_for_second_tag)
+    monkeypatch.setattr(predict, 'CATCHUP_LIVE_MINUTES', 0)
+    with conn.cursor() as cursor:
+        results = predict.score_tags(conn, cursor, predict.ModelCache(models_dir), tags,
+                                     resolver=data_fetch.ParamResolver())
+    assert results[tags[1][1]] == ('failed', 'bad data')
+    assert get_scored_tags(conn) == {tags[0][0], tags[2][0]}
+    # Its checkpoint didn't move: the next tick scores the same minutes again
+    assert prep.load_checkpoint(tags[1][1]) is None and prep.load_checkpoint(tags[0][1]) is not None
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+import data_fetch
+import helpers
+import pre_processing as prep
+import raw_cache
+
+TAG_NAME = 'PIC11151A'
+DAY = pd.Timestamp('2025-03-02', tz='UTC')
+
+
+@pytest.fixture
+def inspections(pg_dsn):
+    with helpers.synthetic_inspections(pg_dsn, [TAG_NAME], 3, 0) as conn:
+        yield conn
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return raw_cache.DataCache(str(tmp_path / 'cache'))
+
+
+def execute(conn, query, params=None):
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+    conn.commit()
+
+
+def get_features(conn, cache, start, end):
+    with conn.cursor() as cursor:
+        features = cache.get_features(cursor, data_fetch.ParamResolver(), TAG_NAME, start, end)
+    conn.commit()
+    return features
+
+
+def add_late_row(conn, dt, value):
+    """
+    Writes a late value of the tag's first signal at dt.
+    """
+    execute(conn, f"""INSERT INTO {helpers.SCHEMA}.inspections
+                      SELECT %s, id, %s FROM {helpers.SCHEMA}.params WHERE description LIKE %s ORDER BY id LIMIT 1;""",
+            (dt, value, f'{TAG_NAME}%'))
+
+
+def test_raw_days_match_the_database_and_complete_ones_are_fetched_once(inspections, cache):
+    # Partial days at both ends
+    start, end = DAY - pd.Timedelta(hours=3), DAY + pd.Timedelta(days=1, hours=5)
+    with inspections.cursor() as cursor:
+        resolver = data_fetch.ParamResolver()
+        raw = cache.get_raw(cursor, resolver, TAG_NAME, start, end)
+        expected = prep.pivot_dataframe_column(data_fetch.fetch_tag_range(cursor, resolver, TAG_NAME, start, end),
+                                               'Timestamp', 'Variable', 'Value')
+        pd.testing.assert_frame_equal(raw, expected[raw.columns], check_dtype=False)
+        assert cache.stats['raw'] == {'hits': 0, 'misses': 3}
+
+        fetched = cache.rows_fetched
+        again = cache.get_raw(cursor, resolver, TAG_NAME, start, end)
+        pd.testing.assert_frame_equal(again, raw)
+        # Only the last day, which the newest data is in, is fetched again
+        assert cache.stats['raw'] == {'hits': 2, 'misses': 4}
+        assert 0 < cache.rows_fetched - fetched < fetched / 2
+    inspections.commit()
+
+
+def test_unsettled_day_is_fetched_again(inspections, cache):
+    # The newest data is 30 minutes past the end of DAY, less than CACHE_SETTLE_HOURS
+    execute(inspections, f"DELETE FROM {helpers.SCHEMA}.inspections WHERE dt > %s;",
+            (DAY + pd.Timedelta(days=1, minutes=30),))
+    before = get_features(inspections, cache, DAY, DAY + pd.Timedelta(hours=23))
+    assert cache.load_manifest('raw', TAG_NAME)['days'][f'{DAY:%Y-%m-%d}']['complete'] is False
+
+    add_late_row(inspections, DAY + pd.Timedelta(hours=22, seconds=30), 1e6)
+    after = get_features(inspections, cache, DAY, DAY + pd.Timedelta(hours=23))
+    assert cache.stats['features'] == {'hits': 0, 'misses': 2}
+    assert len(after) == len(before) + 1
+
+
+def test_feature_day_follows_its_raw_days(inspections, cache):
+    days = (DAY, DAY + pd.Timedelta(hours=23))
+    first = get_features(inspections, cache, *days)
+    assert len(first) > 1000
+    pd.testing.assert_frame_equal(get_features(inspections, cache, *days), first)
+    assert cache.stats['features'] == {'hits': 1, 'misses': 1}
+
+    # Late rows of the previous day, pulled in by fetching the raw days again
+    add_late_row(inspections, DAY - pd.Timedelta(minutes=10, seconds=30), 1e6)
+    manifest = cache.load_manifest('raw', TAG_NAME)
+    del manifest['days'][f'{DAY - pd.Timedelta(days=1):%Y-%m-%d}']
+    cache.save_manifest('raw', TAG_NAME, manifest)
+    after = get_features(inspections, cache, *days)
+    assert cache.stats['features'] == {'hits': 1, 'misses': 2}
+    # The rolling windows of the first minutes of the day now see the late value
+    changed = (after.drop(columns=['Timestamp']) != first.drop(columns=['Timestamp'])).any(axis=1)
+    assert changed.iloc[:10].all() and not changed.iloc[-10:].any()
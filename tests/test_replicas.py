@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+import helpers
+import migrations
+import predict
+import pre_processing as prep
+import replicas
+
+TAGS = [f'PIC{number}A' for number in range(90000, 90200)]
+# Recent: claims older than CLAIMS_RETENTION_DAYS are pruned
+TICK_AT = pd.Timestamp.now(tz='UTC').floor('15min').to_pydatetime()
+
+
+def get_owners(replica_ids):
+    return {tag_name: replicas.get_rendezvous_owner(tag_name, replica_ids) for tag_name in TAGS}
+
+
+def test_rendezvous_ownership_is_stable_and_balanced():
+    owners = get_owners(['replica-a', 'replica-b', 'replica-c'])
+    # The order the replicas are listed in doesn't matter
+    assert owners == get_owners(['replica-c', 'replica-a', 'replica-b'])
+    counts = pd.Series(owners).value_counts()
+    assert set(counts.index) == {'replica-a', 'replica-b', 'replica-c'}
+    assert counts.min() > len(TAGS) / 3 * 0.7
+
+
+def test_rendezvous_moves_only_the_tags_of_the_replica_leaving_or_joining():
+    owners = get_owners(['replica-a', 'replica-b', 'replica-c'])
+    without_c = get_owners(['replica-a', 'replica-b'])
+    assert {tag_name for tag_name in TAGS if owners[tag_name] != without_c[tag_name]} == \
+           {tag_name for tag_name in TAGS if owners[tag_name] == 'replica-c'}
+    with_d = get_owners(['replica-a', 'replica-b', 'replica-c', 'replica-d'])
+    assert all(with_d[tag_name] in (owners[tag_name], 'replica-d') for tag_name in TAGS)
+
+
+@pytest.fixture
+def conn(schema_conn):
+    migrations.apply_migrations(schema_conn)
+    return schema_conn
+
+
+def expire_heartbeat(cursor, replica_id):
+    cursor.execute(f"UPDATE {helpers.SCHEMA}.anomaly_monitor_replicas SET heartbeat_at = now() - interval '1 hour' "
+                   f"WHERE replica_id = %s;", (replica_id,))
+    cursor.connection.commit()
+
+
+def test_replicas_claim_disjoint_tags(conn):
+    tag_names = TAGS[:30]
+    with conn.cursor() as cursor:
+        for replica_id in ('replica-a', 'replica-b'):
+            replicas.send_heartbeat(cursor, replica_id)
+        conn.commit()
+        own_a = replicas.TagClaims(TICK_AT, 'replica-a').claim_own(cursor, tag_names)
+        own_b = replicas.TagClaims(TICK_AT, 'replica-b').claim_own(cursor, tag_names)
+        assert own_a and own_b and not set(own_a) & set(own_b)
+        assert sorted(own_a + own_b) == sorted(tag_names)
+        # Every tag is taken: claiming the rest gets nothing while both are alive
+        assert replicas.TagClaims(TICK_AT, 'replica-a').claim(cursor, tag_names) == []
+
+
+def test_tags_of_a_dead_replica_fail_over(conn):
+    tag_names = TAGS[:30]
+    with conn.cursor() as cursor:
+        for replica_id in ('replica-a', 'replica-b'):
+            replicas.send_heartbeat(cursor, replica_id)
+        conn.commit()
+        claims_a = replicas.TagClaims(TICK_AT, 'replica-a', ttl=30)
+        own_a = claims_a.claim_own(cursor, tag_names)
+        claims_a.finish(cursor, {tag_name: ('ok', 1) for tag_name in own_a[:5]})
+        expire_heartbeat(cursor, 'replica-a')
+        assert replicas.get_live_replicas(cursor, 30) == ['replica-b']
+
+        # In the same tick, b takes over the unfinished claims only
+        claimed = replicas.TagClaims(TICK_AT, 'replica-b', ttl=30).claim(cursor, own_a)
+        assert sorted(claimed) == sorted(own_a[5:])
+        # In the next one, every tag is b's
+        next_tick = TICK_AT + pd.Timedelta(minutes=15)
+        assert sorted(replicas.TagClaims(next_tick, 'replica-b', ttl=30).claim_own(cursor, tag_names)) == sorted(tag_names)
+
+
+def test_stalled_replica_does_not_write_a_tag_taken_over(conn):
+    tag_name = TAGS[0]
+    predictions = pd.DataFrame({'Timestamp': pd.date_range('2025-03-02 00:00', periods=3, freq='min', tz='UTC'),
+                                'Anomaly_Score': [0.1, 0.2, 0.3]})
+    with conn.cursor() as cursor:
+        replicas.send_heartbeat(cursor, 'replica-a')
+        conn.commit()
+        claims_a = replicas.TagClaims(TICK_AT, 'replica-a', ttl=30)
+        assert claims_a.claim_own(cursor, [tag_name]) == [tag_name]
+        # a stalls while scoring the tag, its heartbeat lapses and b takes the tag over
+        expire_heartbeat(cursor, 'replica-a')
+        replicas.send_heartbeat(cursor, 'replica-b')
+        conn.commit()
+        claims_b = replicas.TagClaims(TICK_AT, 'replica-b', ttl=30)
+        assert claims_b.claim(cursor, [tag_name]) == [tag_name]
+
+        with pytest.raises(RuntimeError, match='taken over'):
+            predict.write_tag_scores(conn, cursor, 1, tag_name, predictions, {'last_timestamp': 'a'}, claims_a)
+        assert prep.load_checkpoint(tag_name) is None
+        assert predict.write_tag_scores(conn, cursor, 1, tag_name, predictions, None, claims_b) == 3
+        # Finished with the scores, the claim can no longer be taken over
+        expire_heartbeat(cursor, 'replica-b')
+        assert claims_a.claim(cursor, [tag_name]) == []
+        cursor.execute(f"SELECT count(*) FROM {helpers.SCHEMA}.inspections_calc;")
+        assert cursor.fetchone()[0] == 3
@@ -0,0 +1,79 @@
+import json
+import pandas as pd
+import pytest
+import raw_cache
+import rewind
+
+TAGS = [(1, 'PIC11151A'), (2, 'PIC90001A')]
+
+
+class ChunkRecorder:
+    """
+    Stands in for the scoring of a chunk (it needs PostgreSQL), recording the chunks
+    scored and raising KeyboardInterrupt (Ctrl+C) after interrupt_after of them.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.interrupt_after = None
+
+    def __call__(self, tag_anomaly_id, tag_name, chunk_start, chunk_end, run_id=None):
+        if self.interrupt_after is not None and len(self.chunks) == self.interrupt_after:
+            raise KeyboardInterrupt
+        self.chunks.append((tag_name, chunk_start))
+        return 60
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    monkeypatch.setattr(raw_cache, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(rewind, '_setup_worker', lambda db_config: rewind._worker_state.update(conn=None))
+    recorder = ChunkRecorder()
+    monkeypatch.setattr(rewind, '_worker_score_chunk', recorder)
+    return recorder
+
+
+def backfill(state_path, newest, restart=False):
+    """
+    Runs the backfill of the command without --start/--end, the newest data being newest.
+    """
+    start, end = rewind.resolve_range(state_path, [tag_name for _, tag_name in TAGS], 24, newest=newest,
+                                      restart=restart)
+    return start, end, rewind.run_backfill({}, TAGS, start, end, 24, 1, state_path, restart)
+
+
+def test_interrupted_default_backfill_resumes(tmp_path, scored):
+    state_path = str(tmp_path / 'backfill.json')
+    newest = pd.Timestamp('2025-04-01 00:00', tz='UTC')
+    scored.interrupt_after = 20
+    start, end, _ = backfill(state_path, newest)
+    assert len(scored.chunks) == 20
+
+    # New data landed meanwhile: the default range must not move
+    scored.interrupt_after = None
+    resumed_start, resumed_end, result = backfill(state_path, newest + pd.Timedelta(hours=5))
+    assert (resumed_start, resumed_end) == (start, end)
+    chunks = rewind.split_chunks(start, end, 24)
+    assert sorted(scored.chunks) == sorted((tag_name, chunk_start) for _, tag_name in TAGS for chunk_start, _ in chunks)
+    assert len(set(scored.chunks)) == len(scored.chunks)
+    assert result['failed'] == []
+    with open(state_path) as f:
+        assert json.load(f)['complete']
+
+
+def test_completed_backfill_starts_a_new_range(tmp_path, scored):
+    state_path = str(tmp_path / 'backfill.json')
+    newest = pd.Timestamp('2025-04-01 00:00', tz='UTC')
+    backfill(state_path, newest)
+    later = newest + pd.Timedelta(days=2)
+    start, end, result = backfill(state_path, later)
+    assert end == later and start == later - pd.Timedelta(weeks=4)
+    assert result['minutes'] > 0
+
+
+def test_explicit_bounds_are_kept(tmp_path, scored):
+    state_path = str(tmp_path / 'backfill.json')
+    scored.interrupt_after = 3
+    backfill(state_path, pd.Timestamp('2025-04-01 00:00', tz='UTC'))
+    start, end = rewind.resolve_range(state_path, [tag_name for _, tag_name in TAGS], 24, '2025-01-01', '2025-01-03')
+    assert (start, end) == (pd.Timestamp('2025-01-01', tz='UTC'), pd.Timestamp('2025-01-03', tz='UTC'))
@@ -0,0 +1,110 @@
+import types
+import numpy as np
+import pandas as pd
+import pytest
+import pre_processing as prep
+import predict
+from test_pre_processing import SAMPLE_CSV, TAG_NAME
+
+COLUMNS = ['quantized', 'gappy', 'step']
+
+
+def assert_same_features(df, columns_to_aggregate, window_sizes=prep.WINDOW_SIZES):
+    """
+    Checks the rolling_kernel path of create_aggregated_df against the pandas reference.
+    """
+    kernel = prep.create_aggregated_df(df.copy(), columns_to_aggregate, window_sizes)
+    reference = prep.create_aggregated_df_pandas(df.copy(), columns_to_aggregate, window_sizes)
+
+    assert sorted(kernel.columns) == sorted(reference.columns)
+    assert kernel['Timestamp'].tolist() == reference['Timestamp'].tolist()
+    for feature in kernel.columns.drop('Timestamp'):
+        got = kernel[feature].to_numpy(dtype=np.float64)
+        expected = reference[feature].to_numpy(dtype=np.float64)
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(expected), err_msg=feature)
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-9, err_msg=feature)
+    return kernel
+
+
+def make_signals(minutes, seed=7):
+    """
+    Pivoted one-minute signals with jittered timestamps: a quantized sine (ties for the
+    median and many 6h crossings), one with scattered NaNs and a 2h hole, and a step.
+    """
+    rng = np.random.default_rng(seed)
+    jitter = rng.integers(0, 20, minutes)
+    timestamps = pd.Timestamp('2025-03-29') + pd.to_timedelta(np.arange(minutes) * 60 + jitter, unit='s')
+    phase = np.arange(minutes) / 90.0
+    quantized = np.round(np.sin(phase) * 4 + rng.normal(0, 0.3, minutes)) / 4
+    gappy = 50 + rng.normal(0, 2, minutes)
+    gappy[rng.random(minutes) < 0.1] = np.nan
+    gappy[minutes // 3:minutes // 3 + 120] = np.nan
+    step = np.where(np.arange(minutes) < minutes // 2, 3.0, 7.5)
+    return pd.DataFrame({'Timestamp': timestamps, 'quantized': quantized, 'gappy': gappy, 'step': step})
+
+
+def test_kernel_matches_pandas_on_sample_data():
+    df = prep.read_pivot_csv_file(SAMPLE_CSV)
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
+    assert_same_features(df, prep.get_columns_to_aggregate(TAG_NAME))
+
+
+def test_kernel_matches_pandas_with_nan_gaps():
+    kernel = assert_same_features(make_signals(2 * 24 * 60), COLUMNS)
+    # The 2h hole empties the 1h windows inside it, not the longer ones
+    assert kernel['gappy_mean_1h'].isna().any()
+    assert kernel['gappy_mean_6h'].notna().all()
+
+
+def test_kernel_matches_pandas_on_an_all_nan_column():
+    df = make_signals(600)
+    df['gappy'] = np.nan
+    assert_same_features(df, COLUMNS)
+
+
+@pytest.mark.parametrize('minutes', [1, 2, 40, 3 * 60, 9 * 60])
+def test_kernel_matches_pandas_on_data_shorter_than_the_windows(minutes):
+    assert_same_features(make_signals(minutes), COLUMNS)
+
+
+def test_kernel_matches_pandas_on_crossings():
+    kernel = assert_same_features(make_signals(24 * 60), COLUMNS)
+    assert kernel['quantized_crossings_6h'].max() > 1
+    # A step crosses its own 6h average upwards once, at the step
+    assert kernel['step_crossings_6h'].max() == 1
+
+
+def test_feature_plan_computes_the_model_features_only():
+    df = prep.read_pivot_csv_file(SAMPLE_CSV)
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='ms')
+    df = df[df['Timestamp'] < df['Timestamp'].min() + pd.Timedelta(days=3)].reset_index(drop=True)
+    columns_to_aggregate = prep.get_columns_to_aggregate(TAG_NAME)
+    # A pipeline reading some of the features, in an order of its own
+    every_feature = prep.get_feature_names(columns_to_aggregate, prep.WINDOW_SIZES)
+    features = list(np.random.default_rng(0).choice(every_feature, 20, replace=False))
+    features += [f'{TAG_NAME}_MV_crossings_6h', f'{prep.SHARED_COLUMNS[0]}_median_12h']
+    model = types.SimpleNamespace(_feature_names_in=list(dict.fromkeys(features)))
+    features = predict.get_model_features(model)
+    plan = prep.build_feature_plan(features, columns_to_aggregate, prep.WINDOW_SIZES)
+
+    planned = prep.create_aggregated_df(df.copy(), columns_to_aggregate, prep.WINDOW_SIZES, plan)
+    assert list(planned.columns) == ['Timestamp'] + features
+    model_input = prep.select_model_input(planned, plan)
+    assert list(model_input.columns) == features
+    reference = prep.create_aggregated_df_pandas(df.copy(), columns_to_aggregate, prep.WINDOW_SIZES)
+    assert planned['Timestamp'].tolist() == reference['Timestamp'].tolist()
+    expected = reference[features].to_numpy(dtype=np.float64)
+    got = model_input.to_numpy(dtype=np.float64)
+    np.testing.assert_array_equal(np.isnan(got), np.isnan(expected))
+    np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-9)
+
+
+def test_feature_plan_rejects_features_it_cannot_build():
+    columns_to_aggregate = prep.get_columns_to_aggregate(TAG_NAME)
+    for feature in [f'{TAG_NAME}_MV_mean_3h', f'{TAG_NAME}_MV_crossings_1h', f'{TAG_NAME}_OP_mean_1h']:
+        with pytest.raises(ValueError, match=feature):
+            prep.build_feature_plan([f'{TAG_NAME}_MV_mean_1h', feature], columns_to_aggregate, prep.WINDOW_SIZES)
+    # Nor can the model read features of signals the data lacks
+    plan = prep.build_feature_plan([f'{TAG_NAME}_SP_max_1h'], columns_to_aggregate, prep.WINDOW_SIZES)
+    with pytest.raises(ValueError, match=f'{TAG_NAME}_SP_max_1h'):
+        prep.select_model_input(pd.DataFrame({'Timestamp': []}), plan)
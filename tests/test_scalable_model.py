@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import pre_processing as prep
+import scalable_model
+import lean_model
+import synthetic_data
+from test_pre_processing import SAMPLE_CSV, TAG_NAME
+
+
+def training_matrix(long):
+    return scalable_model.get_training_matrix(prep.filter_columns(prep.treat_data(long, TAG_NAME)))
+
+
+def test_agreement_is_the_share_of_reference_anomalies_flagged():
+    reference = np.arange(100, dtype=np.float64)
+    # The reference flags rows 95-99, the scores 94-98 (on another scale)
+    scores = 3 * np.roll(reference, -1)
+    scores[-1] = 0
+    assert scalable_model.check_agreement(scores, reference, 0.8) == pytest.approx(0.8)
+    with pytest.raises(ValueError, match='80% of the reference'):
+        scalable_model.check_agreement(scores, reference, 0.81)
+
+
+def test_nystroem_is_kept_when_it_follows_the_ocsvm():
+    features, fill_values, X = training_matrix(pd.read_csv(SAMPLE_CSV))
+    parameters = scalable_model.fit_scalable_model('nystroem', features, fill_values, X)
+    scores = lean_model.LeanModel.from_arrays(features, fill_values, *parameters).decision_scores(X)
+    assert np.mean(scores > parameters[-1]) == pytest.approx(scalable_model.CONTAMINATION, abs=0.01)
+
+
+def test_nystroem_is_refused_below_the_agreement_threshold():
+    # A week of one-minute rows: the narrow kernel's Nystroem model flags about a third
+    # of the OCSVM's anomalies there
+    long = synthetic_data.generate_dataset([TAG_NAME], 7, seed=0)[TAG_NAME]
+    features, fill_values, X = training_matrix(long)
+    assert scalable_model.NYSTROEM_MIN_AGREEMENT >= 0.8
+    with pytest.raises(ValueError, match="reference OCSVM's anomalies"):
+        scalable_model.fit_scalable_model('nystroem', features, fill_values, X)
+
+
+def test_models_are_fitted_on_the_rows_the_pipeline_keeps(tmp_path, monkeypatch):
+    dftrain_filtered = prep.filter_columns(prep.treat_data(pd.read_csv(SAMPLE_CSV), TAG_NAME))
+    features, fill_values, X = scalable_model.get_training_matrix(dftrain_filtered)
+    kept = scalable_model.remove_outliers(X)
+    # pycaret's isolation forest drops 5% of the rows, the others stay in time order
+    assert len(kept) == pytest.approx(0.95 * len(X), abs=1)
+    positions = [np.flatnonzero((X == row).all(axis=1))[0] for row in kept[::500]]
+    assert positions == sorted(positions)
+    fitted = []
+    fit_scalable_model = scalable_model.fit_scalable_model
+
+    def recording_fit(kind, features, fill_values, X, seed=0):
+        fitted.append(X)
+        return fit_scalable_model(kind, features, fill_values, X, seed, subsample_rows=500)
+
+    monkeypatch.setattr(scalable_model, 'fit_scalable_model', recording_fit)
+    path = lean_model.get_artifact_path(str(tmp_path / TAG_NAME))
+    scalable_model.train_scalable_model('subsample', dftrain_filtered, path)
+    np.testing.assert_array_equal(fitted[0], kept)
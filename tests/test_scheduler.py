@@ -0,0 +1,69 @@
+import datetime
+import pytest
+from scheduler import CronSchedule, parse_cron_field
+
+
+def at(text):
+    return datetime.datetime.fromisoformat(text)
+
+
+def fire_times(expression, start, count):
+    schedule = CronSchedule(expression)
+    times = []
+    moment = at(start)
+    for _ in range(count):
+        moment = schedule.next_after(moment)
+        times.append(moment)
+    return times
+
+
+def test_parse_cron_field():
+    assert parse_cron_field('*', 0, 5) == {0, 1, 2, 3, 4, 5}
+    assert parse_cron_field('0,30', 0, 59) == {0, 30}
+    assert parse_cron_field('1-5', 0, 7) == {1, 2, 3, 4, 5}
+    assert parse_cron_field('*/15', 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field('10-50/10', 0, 59) == {10, 20, 30, 40, 50}
+    assert parse_cron_field('1-10/4,30', 0, 59) == {1, 5, 9, 30}
+    # 'a/n' starts at a and runs to the highest value
+    assert parse_cron_field('5/20', 0, 59) == {5, 25, 45}
+
+
+@pytest.mark.parametrize('field', ['60', '5-1', '*/0', '0-70/5'])
+def test_invalid_cron_fields(field):
+    with pytest.raises(ValueError):
+        parse_cron_field(field, 0, 59)
+
+
+def test_invalid_expressions():
+    with pytest.raises(ValueError, match='5 fields'):
+        CronSchedule('*/5 * * *')
+    with pytest.raises(ValueError, match='never fires'):
+        CronSchedule('0 0 31 2 *').next_after(at('2025-01-01 00:00'))
+
+
+def test_next_after_is_strictly_after():
+    schedule = CronSchedule('*/5 * * * *')
+    assert schedule.next_after(at('2025-03-01 10:00')) == at('2025-03-01 10:05')
+    assert schedule.next_after(at('2025-03-01 10:04:59.5')) == at('2025-03-01 10:05')
+    assert schedule.next_after(at('2025-03-01 23:57')) == at('2025-03-02 00:00')
+
+
+def test_steps_over_a_range():
+    assert fire_times('0 8-18/4 * * *', '2025-03-01 09:00', 4) == [
+        at('2025-03-01 12:00'), at('2025-03-01 16:00'), at('2025-03-02 08:00'), at('2025-03-02 12:00')]
+
+
+def test_day_of_month_or_day_of_week():
+    # The 1st of the month or any Monday (2025-03-03 and 2025-03-10 are Mondays)
+    assert fire_times('0 3 1 * 1', '2025-02-27 00:00', 4) == [
+        at('2025-03-01 03:00'), at('2025-03-03 03:00'), at('2025-03-10 03:00'), at('2025-03-17 03:00')]
+    # Only one of them restricted: that one alone decides
+    assert fire_times('0 3 * * 0', '2025-03-01 00:00', 2) == [at('2025-03-02 03:00'), at('2025-03-09 03:00')]
+    assert fire_times('0 3 15 * *', '2025-03-01 00:00', 2) == [at('2025-03-15 03:00'), at('2025-04-15 03:00')]
+    # 7 is Sunday too
+    assert CronSchedule('0 3 * * 7').next_after(at('2025-03-01 00:00')) == at('2025-03-02 03:00')
+
+
+def test_stepped_day_field_is_not_restricted():
+    # Like cron, '*/10' in the day field is anded with the weekday: days 1, 11, 21, 31 that are Mondays
+    assert fire_times('0 0 */10 * 1', '2025-01-01 00:00', 2) == [at('2025-03-31 00:00'), at('2025-04-21 00:00')]
@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+import helpers
+import migrations
+import score_writer
+
+TAG_ID = 3
+MINUTES = pd.date_range('2025-03-01', periods=10, freq='min', tz='UTC')
+
+
+@pytest.fixture(params=[False, True], ids=['statements', 'prepared'])
+def conn(schema_conn, request):
+    migrations.apply_migrations(schema_conn)
+    if request.param:
+        score_writer.prepare_statements(schema_conn)
+        # Once per connection
+        score_writer.prepare_statements(schema_conn)
+    return schema_conn
+
+
+def get_scores(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT dt, value FROM {helpers.SCHEMA}.inspections_calc WHERE id_param_fk = %s ORDER BY dt;",
+                       (TAG_ID,))
+        scores = cursor.fetchall()
+    conn.commit()
+    return [(pd.Timestamp(dt), value) for dt, value in scores]
+
+
+def write(conn, minutes, values, mode):
+    predictions = pd.DataFrame({'Anomaly_Score': values, 'Timestamp': minutes})
+    with conn.cursor() as cursor:
+        result = score_writer.write_scores(cursor, TAG_ID, predictions, mode=mode)
+    conn.commit()
+    return result
+
+
+def test_append_only_writes_after_the_watermark(conn):
+    assert write(conn, MINUTES[:6], [0.0] * 6, 'append') == (6, 0)
+    # Rescored minutes are left alone, only the new ones are written
+    assert write(conn, MINUTES, [1.0] * 10, 'append') == (4, 6)
+    assert get_scores(conn) == [(minute, 0.0) for minute in MINUTES[:6]] + [(minute, 1.0) for minute in MINUTES[6:]]
+    # A rerun writes nothing
+    assert write(conn, MINUTES, [1.0] * 10, 'append') == (0, 10)
+    assert len(get_scores(conn)) == 10
+    with conn.cursor() as cursor:
+        assert score_writer.get_watermark(cursor, TAG_ID) == MINUTES[-1]
+        assert score_writer.get_watermark(cursor, TAG_ID + 1) is None
+    conn.commit()
+
+
+def test_replace_only_rewrites_changed_scores(conn):
+    write(conn, MINUTES, [0.0] * 10, 'append')
+    values = [0.0] * 8 + [2.0] * 2
+    assert write(conn, MINUTES, values, 'replace') == (2, 8)
+    assert get_scores(conn) == list(zip(MINUTES, values))
+    # A rerun of the same range rewrites nothing, nor duplicates a row
+    assert write(conn, MINUTES, values, 'replace') == (0, 10)
+    assert get_scores(conn) == list(zip(MINUTES, values))
+
+
+def test_pages_of_one_batch(conn, monkeypatch):
+    monkeypatch.setattr(score_writer, 'PAGE_SIZE', 3)
+    assert write(conn, MINUTES, [float(i) for i in range(10)], 'replace') == (10, 0)
+    assert get_scores(conn) == [(minute, float(i)) for i, minute in enumerate(MINUTES)]
+
+
+def test_delete_stale_scores_keeps_the_minutes_of_the_rewrite(conn):
+    write(conn, MINUTES, [0.0] * 10, 'append')
+    # The rewrite of [2, 8) only produced minutes 2, 4 and 6
+    keep = [MINUTES[2], MINUTES[4], MINUTES[6]]
+    with conn.cursor() as cursor:
+        assert score_writer.delete_stale_scores(cursor, TAG_ID, MINUTES[2], MINUTES[8], keep) == 3
+    conn.commit()
+    assert [dt for dt, _ in get_scores(conn)] == list(MINUTES[:3]) + [MINUTES[4], MINUTES[6]] + list(MINUTES[8:])
+
+
+def test_unknown_mode(conn):
+    with pytest.raises(ValueError, match='Unknown write mode'):
+        write(conn, MINUTES, [0.0] * 10, 'upsert')
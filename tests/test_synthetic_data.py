@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pre_processing as prep
+import synthetic_data
+from test_pre_processing import SAMPLE_CSV, TAG_NAME
+
+
+def test_same_seed_same_data():
+    tag_names = synthetic_data.get_tag_names(2)
+    first = synthetic_data.generate_dataset(tag_names, 0.5, seed=3)
+    again = synthetic_data.generate_dataset(tag_names, 0.5, seed=3)
+    other = synthetic_data.generate_dataset(tag_names, 0.5, seed=4)
+    for tag_name in tag_names:
+        pd.testing.assert_frame_equal(first[tag_name], again[tag_name])
+        assert not first[tag_name]['Value'].equals(other[tag_name]['Value'])
+
+
+def test_layout_of_the_sample_csv():
+    sample = pd.read_csv(SAMPLE_CSV, nrows=50000)
+    dataset = synthetic_data.generate_dataset([TAG_NAME], 1)[TAG_NAME]
+    assert list(dataset.columns) == list(sample.columns)
+    assert dict(dataset.dtypes) == dict(sample.dtypes)
+    assert set(dataset['Variable']) == set(sample['Variable'])
+    assert dataset['Timestamp'].is_monotonic_increasing
+    # The features of the predictor can be built from it
+    features = prep.filter_columns(prep.treat_data(dataset.copy(), TAG_NAME))
+    assert len(features) > 1000 and features.drop(columns=['Timestamp']).notna().any().all()
+
+
+def test_shared_signal_is_the_same_for_every_tag():
+    datasets = synthetic_data.generate_dataset(synthetic_data.get_tag_names(3), 1, seed=0, timestamp_unit=None)
+    shared = [dataset[dataset['Variable'] == synthetic_data.SHARED_SIGNAL].reset_index(drop=True)
+              for dataset in datasets.values()]
+    for other in shared[1:]:
+        pd.testing.assert_frame_equal(other, shared[0])
+    assert shared[0]['Timestamp'].dtype.kind == 'M'
+    # Each tag only has its own loop's signals besides the shared one
+    for tag_name, dataset in datasets.items():
+        assert all(variable.startswith(tag_name) for variable in set(dataset['Variable']) - {synthetic_data.SHARED_SIGNAL})
+
+
+def test_timeline_has_gaps_and_jitter():
+    rng = np.random.default_rng(0)
+    timestamps = synthetic_data.generate_timeline('2025-03-01', 7, rng, outages_per_day=1)
+    minutes = 7 * 24 * 60
+    assert 0.7 * minutes < len(timestamps) < 0.99 * minutes
+    offsets = pd.Series(timestamps - timestamps.floor('min')).dt.total_seconds()
+    assert (offsets < 30).all() and 0 < (offsets > 0).mean() < 0.05
+    # At least one multi-hour outage
+    assert pd.Series(timestamps).diff().max() >= pd.Timedelta(minutes=30)
+
+
+def test_tag_names():
+    assert synthetic_data.get_tag_names(3) == ['PIC11151A', 'PIC90001A', 'PIC90002A']
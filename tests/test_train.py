@@ -0,0 +1,137 @@
+import os
+import pandas as pd
+import pytest
+import data_fetch
+import drift
+import helpers
+import train
+
+TAG_NAME = 'PIC11151A'
+
+
+@pytest.fixture
+def inspections(pg_dsn):
+    with helpers.synthetic_inspections(pg_dsn, [TAG_NAME, 'PIC90001A'], 2, 0) as conn:
+        yield conn
+
+
+def get_score_params(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT id, description, type FROM {helpers.SCHEMA}.params_calc ORDER BY id;")
+        rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def test_training_a_new_tag_creates_its_score_param(inspections, pg_dsn, tmp_path):
+    with inspections.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {helpers.SCHEMA}.params_calc VALUES (7, 'PIC90001A\\AS', 'anomaly');")
+        cursor.execute(f"SELECT min(dt), max(dt) FROM {helpers.SCHEMA}.inspections;")
+        start_date, end_date = (str(value) for value in cursor.fetchone())
+    inspections.commit()
+
+    rows = train.train_tag({'dsn': pg_dsn}, TAG_NAME, start_date, end_date, 'subsample', str(tmp_path))
+    assert rows > 1000
+    assert os.path.exists(tmp_path / f'{TAG_NAME}.npz')
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.')]
+    assert get_score_params(inspections) == [(7, 'PIC90001A\\AS', 'anomaly'), (8, f'{TAG_NAME}\\AS', 'anomaly')]
+
+    # Retrained, the tag keeps its param
+    train.train_tag({'dsn': pg_dsn}, TAG_NAME, start_date, end_date, 'subsample', str(tmp_path))
+    assert len(get_score_params(inspections)) == 2
+
+
+def test_first_score_param_of_an_empty_table(schema_conn):
+    with schema_conn.cursor() as cursor:
+        assert train.add_anomaly_score_tag(cursor, TAG_NAME) == 1
+        assert train.add_anomaly_score_tag(cursor, TAG_NAME) == 1
+        # A description with a quote is a parameter, not SQL
+        assert train.add_anomaly_score_tag(cursor, "PIC'1") == 2
+    schema_conn.commit()
+
+
+def test_failed_training_leaves_no_score_param(inspections, pg_dsn, tmp_path):
+    with pytest.raises(ValueError, match='No data'):
+        train.train_tag({'dsn': pg_dsn}, TAG_NAME, '2020-01-01', '2020-01-02', 'subsample', str(tmp_path))
+    assert get_score_params(inspections) == []
+
+
+def write_model(models_dir, entry, info):
+    open(os.path.join(models_dir, f"{entry['tag']}.npz"), 'w').close()
+    train.write_training_info(str(models_dir), entry['tag'], {'model': entry['model'], **info})
+
+
+def test_moving_end_is_fresh_until_newer_data(tmp_path):
+    entry = {'tag': TAG_NAME, 'start': None, 'end': None, 'days': 30, 'model': 'subsample'}
+    start_date, end_date = train.resolve_range(entry, '2025-04-01 00:00:00+00')
+    write_model(tmp_path, entry, {'start': start_date, 'end': end_date, 'manifest_spec': train.get_manifest_spec(entry)})
+    model_time = os.path.getmtime(tmp_path / f'{TAG_NAME}.npz')
+
+    # The end moved with the data, the spec didn't: only newer data makes it stale
+    start_date, end_date = train.resolve_range(entry, '2025-04-02 00:00:00+00')
+    older = pd.Timestamp(model_time - 60, unit='s', tz='UTC')
+    newer = pd.Timestamp(model_time + 60, unit='s', tz='UTC')
+    assert train.is_model_fresh(str(tmp_path), entry, start_date, end_date, older)
+    assert not train.is_model_fresh(str(tmp_path), entry, start_date, end_date, newer)
+
+    # An edited entry is retrained
+    assert not train.is_model_fresh(str(tmp_path), {**entry, 'days': 60}, start_date, end_date, older)
+    assert not train.is_model_fresh(str(tmp_path), {**entry, 'model': 'nystroem'}, start_date, end_date, older)
+
+
+def test_fixed_range_retrained_for_drift_stays_fresh(tmp_path):
+    entry = {'tag': TAG_NAME, 'start': '2025-03-01 00:00:00', 'end': '2025-04-01 00:00:00', 'days': None,
+             'model': 'subsample'}
+    start_date, end_date = train.resolve_range(entry, '2025-05-01 00:00:00+00')
+    # Retrained on a more recent range than the manifest's
+    write_model(tmp_path, entry, {'start': '2025-04-01 00:00:00', 'end': '2025-05-01 00:00:00',
+                                  'manifest_spec': train.get_manifest_spec(entry)})
+    assert train.is_model_fresh(str(tmp_path), entry, start_date, end_date, pd.Timestamp(end_date, tz='UTC'))
+    edited = {**entry, 'end': '2025-04-15 00:00:00'}
+    assert not train.is_model_fresh(str(tmp_path), edited, *train.resolve_range(edited, None), None)
+
+
+def test_models_trained_before_the_spec_was_recorded(tmp_path):
+    entry = {'tag': TAG_NAME, 'start': '2025-03-01 00:00:00', 'end': None, 'days': None, 'model': 'subsample'}
+    write_model(tmp_path, entry, {'start': '2025-03-01 00:00:00', 'end': '2025-04-01 00:00:00+00:00'})
+    start_date, end_date = train.resolve_range(entry, '2025-04-02 00:00:00+00')
+    assert train.is_model_fresh(str(tmp_path), entry, start_date, end_date, None)
+    fixed = {**entry, 'end': '2025-04-02 00:00:00'}
+    assert not train.is_model_fresh(str(tmp_path), fixed, *train.resolve_range(fixed, None), None)
+
+
+def test_drift_retraining_keeps_the_manifest_spec(pg_dsn, tmp_path, monkeypatch):
+    entries = [{'tag': tag_name, 'start': '2025-03-01 00:00:00', 'end': '2025-03-03 00:00:00', 'days': None,
+                'model': 'subsample'} for tag_name in [TAG_NAME, 'PIC90001A']]
+    models_dir = str(tmp_path / 'models')
+    with helpers.synthetic_inspections(pg_dsn, [entry['tag'] for entry in entries], 5, 0) as conn:
+        result = train.run_training({'dsn': pg_dsn}, entries, models_dir, workers=1)
+        assert sorted(result['trained']) == sorted(entry['tag'] for entry in entries)
+        info = train.read_training_info(models_dir, TAG_NAME)
+        assert info['manifest_spec'] == train.get_manifest_spec(entries[0]) and 'profile' in info
+
+        # Any PSI is a drift, but the budget only covers one of the two retrains
+        monkeypatch.setattr(drift, 'DRIFT_PSI_THRESHOLD', 1e-9)
+        monkeypatch.setattr(drift, 'RETRAIN_MIN_HOURS', 0)
+        for name in os.listdir(models_dir):
+            if name.endswith('.train.json'):
+                tag_name = name[:-len('.train.json')]
+                train.write_training_info(models_dir, tag_name, {**train.read_training_info(models_dir, tag_name),
+                                                                 'cpu_seconds': 10})
+        result = train.run_drift_retraining({'dsn': pg_dsn}, entries, models_dir, workers=1, budget=15)
+        decisions = sorted(assessment['decision'] for assessment in result['assessments'])
+        assert decisions == ['deferred', 'retrain'] and len(result['trained']) == 1
+        retrained = result['trained'][0]
+        with conn.cursor() as cursor:
+            upper_bound = data_fetch.get_upper_bound(cursor)
+            # Retrained on as many days as the manifest's, ending at the newest data
+            info = train.read_training_info(models_dir, retrained)
+            assert pd.Timestamp(info['end']) == pd.Timestamp(upper_bound)
+            assert pd.Timestamp(info['end']) - pd.Timestamp(info['start']) == pd.Timedelta(days=2)
+            assert info['manifest_spec'] == train.get_manifest_spec(entries[0]) and info['retrained_for']
+            # ...which the manifest's training still takes for its own
+            to_train, skipped, _ = train.plan_training(cursor, entries, models_dir)
+        conn.commit()
+        assert skipped == [entry['tag'] for entry in entries] and to_train == []
+        with open(drift.DRIFT_LOG) as f:
+            assert len(f.readlines()) == 2
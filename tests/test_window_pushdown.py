@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+import data_fetch
+import helpers
+import pre_processing as prep
+import window_pushdown
+
+TAG_NAME = 'PIC11151A'
+
+
+@pytest.fixture
+def inspections(pg_dsn):
+    with helpers.synthetic_inspections(pg_dsn, [TAG_NAME], 1, 0) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT min(dt), max(dt) FROM {helpers.SCHEMA}.inspections;")
+            start_date, end_date = (pd.Timestamp(value) for value in cursor.fetchone())
+            yield cursor, start_date, end_date
+
+
+def assert_same_features(pushed, expected, tolerance=1e-9):
+    """
+    Checks window_pushdown's features against create_aggregated_df's, relative to max(1, |value|).
+    """
+    assert pushed['Timestamp'].tolist() == expected['Timestamp'].tolist()
+    assert list(pushed.columns) == list(expected.columns)
+    for feature in expected.columns.drop('Timestamp'):
+        reference = expected[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = pushed[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        np.testing.assert_array_equal(np.isnan(values), np.isnan(reference), err_msg=feature)
+        both = ~np.isnan(reference)
+        difference = np.abs(values[both] - reference[both]) / np.maximum(1.0, np.abs(reference[both]))
+        assert difference.max(initial=0) <= tolerance, feature
+
+
+def test_pushdown_matches_the_kernel_on_a_range(inspections):
+    cursor, start_date, end_date = inspections
+    resolver = data_fetch.ParamResolver()
+    expected = prep.treat_data(data_fetch.fetch_tag_range(cursor, resolver, TAG_NAME, start_date, end_date), TAG_NAME)
+    pushed, _, _ = window_pushdown.fetch_window_features(cursor, resolver, TAG_NAME, start_date, end_date)
+    assert_same_features(pushed, expected)
+
+
+def test_pushdown_matches_the_kernel_on_a_tick(inspections):
+    cursor, start_date, end_date = inspections
+    resolver = data_fetch.ParamResolver()
+    since = end_date - pd.Timedelta(minutes=15)
+    _, checkpoint = prep.treat_data_incremental(data_fetch.fetch_tag_range(cursor, resolver, TAG_NAME, start_date, since),
+                                                TAG_NAME)
+    new = data_fetch.fetch_tag_range(cursor, resolver, TAG_NAME, since + pd.Timedelta(microseconds=1), end_date)
+    expected, expected_checkpoint = prep.treat_data_incremental(new, TAG_NAME, checkpoint)
+
+    pushed, pushed_checkpoint = window_pushdown.treat_data_pushdown(cursor, resolver, TAG_NAME, checkpoint)
+    assert len(pushed) == 15
+    assert_same_features(pushed, expected)
+    assert pushed_checkpoint['last_timestamp'] == expected_checkpoint['last_timestamp']
+
+
+def test_pushdown_follows_the_feature_plan(inspections):
+    cursor, start_date, end_date = inspections
+    resolver = data_fetch.ParamResolver()
+    columns = prep.get_columns_to_aggregate(TAG_NAME)
+    features = [f'{TAG_NAME}_PV_IN_median_6h', f'{TAG_NAME}_MV_crossings_6h', 'II113RC001_U_std_12h',
+                f'{TAG_NAME}_SP_mean_1h']
+    plan = prep.build_feature_plan(features, columns, prep.WINDOW_SIZES)
+    expected = prep.treat_data(data_fetch.fetch_tag_range(cursor, resolver, TAG_NAME, start_date, end_date), TAG_NAME, plan)
+    pushed, _, _ = window_pushdown.fetch_window_features(cursor, resolver, TAG_NAME, start_date, end_date, plan=plan)
+    assert list(pushed.columns) == ['Timestamp'] + features
+    assert_same_features(pushed, expected)
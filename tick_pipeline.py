@@ -0,0 +1,90 @@
+import asyncio
+import concurrent.futures
+
+""" ******************* Pipelined tick ******************* """
+
+# Marks the end of the jobs on a stage's queue
+_DONE = object()
+
+
+async def _run_stages(jobs, stages, depth, should_skip, fatal):
+    loop = asyncio.get_running_loop()
+    # One thread per stage: a psycopg2 connection runs one query at a time anyway, and the
+    # database stages release the GIL while they wait, so the scoring runs in the meantime
+    executors = [concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}-stage')
+                 for name, _ in stages]
+    queues = [asyncio.Queue(maxsize=depth) for _ in stages[1:]]
+    results = {}
+
+    async def inbound(index):
+        if index == 0:
+            for job_name, value in jobs:
+                reason = should_skip() if should_skip is not None else None
+                if reason is not None:
+                    results[job_name] = ('skipped', reason)
+                    continue
+                yield job_name, value, None
+            return
+        while True:
+            item = await queues[index - 1].get()
+            if item is _DONE:
+                return
+            yield item
+
+    async def run_stage(index):
+        name, function = stages[index]
+        try:
+            async for job_name, value, previous in inbound(index):
+                try:
+                    output = await loop.run_in_executor(executors[index], function, value, previous)
+                except fatal:
+                    raise
+                except Exception as e:
+                    print(f"{name} failed for {job_name}: {e}")
+                    results[job_name] = ('failed', str(e))
+                    continue
+                if index < len(queues):
+                    # Waits while the next stage is depth jobs behind (backpressure)
+                    await queues[index].put((job_name, value, output))
+                else:
+                    results[job_name] = ('ok', output)
+        finally:
+            if index < len(queues):
+                # Also when this stage stops on a fatal error: the next one drains its
+                # queue and ends instead of waiting forever
+                await queues[index].put(_DONE)
+
+    tasks = [asyncio.ensure_future(run_stage(index)) for index in range(len(stages))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        for executor in executors:
+            # Lets a job already running in a thread finish, e.g. a write and its commit
+            executor.shutdown(wait=True)
+    return results
+
+
+def run_pipeline(jobs, stages, depth=2, should_skip=None, fatal=()):
+    """
+    Runs every job through a chain of blocking stages, each in its own thread, with
+    bounded queues between them: while job N is in the second stage, job N + 1 is in
+    the first and job N - 1 in the third.
+
+    Args:
+        jobs: [(job_name, value)], in order.
+        stages: [(stage_name, function)]; function(value, previous output) runs in the
+                stage's thread, previous is None in the first stage.
+        depth: Jobs waiting between two stages, which bounds the memory held in flight.
+        should_skip: Called before a job enters the first stage, returns the reason to
+                     skip it (e.g. 'deadline reached') or None.
+        fatal: Exception types that stop the whole run (re-raised) instead of failing the job.
+
+    Returns:
+        dict: {job_name: (status, detail)} with status 'ok' (detail = the last stage's
+              output), 'failed' or 'skipped'.
+    """
+    return asyncio.run(_run_stages(jobs, stages, max(depth, 1), should_skip, fatal))
@@ -1,12 +1,27 @@
-from pycaret.anomaly import setup, create_model, save_model
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
 import numpy as np
 import scipy.signal
 import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import resource
+import multiprocessing
+import concurrent.futures
 import pre_processing as prep
+import data_fetch
+import raw_cache
+import lean_model
+import model_store
+import scalable_model
+import instrumentation
+import drift
 import psycopg2 as pg
 from dotenv import load_dotenv
+from scheduler import CronSchedule
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -18,6 +33,20 @@ MENDIX_SCHEMA = os.environ.get("MENDIX_SCHEMA")
 VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
 POSTGRES_DB = os.environ.get("POSTGRES_DB")
 POSTGRES_PORT = os.environ.get("POSTGRES_PORT")
+# 'stream' reads the training range in bounded time chunks (data_fetch.stream_tag_range),
+# 'columnar' fetches it in one go
+TRAIN_FETCH_MODE = os.environ.get("TRAIN_FETCH_MODE", "stream")
+# Tags and date ranges to train (see load_manifest)
+TRAIN_MANIFEST = os.environ.get("TRAIN_MANIFEST", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'training_manifest.json'))
+# Tags trained concurrently, each in its own process
+TRAIN_WORKERS = int(os.environ.get("TRAIN_WORKERS", "1"))
+# Model of the tags whose manifest entry doesn't name one (scalable_model.MODEL_KINDS)
+TRAIN_MODEL = os.environ.get("TRAIN_MODEL", "ocsvm")
+MODELS_DIR = os.environ.get("MODELS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+# CPU seconds a drift check may spend retraining (train.py --drift)
+RETRAIN_BUDGET_SECONDS = float(os.environ.get("RETRAIN_BUDGET_SECONDS") or 3600)
+# When train.py --drift --daemon checks the drift
+RETRAIN_CRON = os.environ.get("RETRAIN_CRON", "0 3 * * *")
 
 """ Query training data from postgreSQL database """
 def get_training_data(conn, cursor,start_date, end_date, tag_name):
@@ -118,26 +147,35 @@ def set_negative_II113RC001_U_mean_to_zero(df):
   return df
 
 def add_anomaly_score_tag(cursor, tag_name):
-    query = f"""
-      SELECT id FROM {VARIABLES_SCHEMA}.params_calc WHERE description = '{tag_name}\\AS';
-    """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    if result == []:
-        print(f"Tag {tag_name}\\AS not found in the database, creating one...")
-        query = f""" SELECT max(id) from {VARIABLES_SCHEMA}.params_calc"""
-        cursor.execute(query)
-        result = cursor.fetchall()
-        new_id = result[0] + 1
-        anomaly_tag = f'{tag_name}\\AS'
-        tag_type = 'anomaly'
-        query = f"""
-            INSERT INTO {VARIABLES_SCHEMA}.params_calc (id, description, type) VALUES ({new_id}, {anomaly_tag}, {tag_type}) 
-            """
-        cursor.execute(query)
-    return
+    """
+    Creates the tag's \\AS param in params_calc (the one predict.py writes the scores to)
+    with the next free id, unless it exists. params_calc stays locked until the caller
+    commits, so two trainings can't take the same id.
+
+    Returns:
+        int: The id of the tag's \\AS param.
+    """
+    anomaly_tag = f'{tag_name}\\AS'
+    query = f"SELECT id FROM {VARIABLES_SCHEMA}.params_calc WHERE description = %s;"
+    cursor.execute(query, (anomaly_tag,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f"LOCK TABLE {VARIABLES_SCHEMA}.params_calc IN SHARE ROW EXCLUSIVE MODE;")
+        # Another training may have created it while this one waited for the lock
+        cursor.execute(query, (anomaly_tag,))
+        row = cursor.fetchone()
+    if row is None:
+        print(f"Tag {anomaly_tag} not found in the database, creating one...")
+        cursor.execute(f"""
+            INSERT INTO {VARIABLES_SCHEMA}.params_calc (id, description, type)
+            SELECT COALESCE(max(id), 0) + 1, %s, 'anomaly' FROM {VARIABLES_SCHEMA}.params_calc
+            RETURNING id;""", (anomaly_tag,))
+        row = cursor.fetchone()
+    return row[0]
+
 
 def train():
+    from pycaret.anomaly import setup, create_model
     # Load the data
     # df = pd.read_csv('training_data.csv')
     # df = prep.treat_data(df, tag_name)
@@ -157,49 +195,536 @@ def train():
 
 
 
-if __name__ == "__main__":
-    db_config = {
-        'database': POSTGRES_DB ,
-        'user': POSTGRES_USER,
-        'password': POSTGRES_PASSWORD,
-        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
-        'port': POSTGRES_PORT       # Default PostgreSQL port
-    }
-    conn = None
-    cursor = None
+""" ******************* Training manifest ******************* """
+
+def load_manifest(path):
+    """
+    Reads the tags to train and their date ranges from a JSON manifest:
+
+        {"defaults": {"start": "2025-03-12 12:20:00", "end": null},
+         "tags": [{"tag": "PIC11151A", "end": "2025-04-01 00:00:00"},
+                  {"tag": "PIC11152A", "days": 120, "model": "nystroem"}]}
+
+    A tag without "start"/"end"/"model" takes the defaults. "end": null trains up to the
+    newest data, and "days" instead of "start" covers that many days before the end.
+    "model" is the pycaret 'ocsvm' (TRAIN_MODEL by default) or one of the scalable models
+    of scalable_model.py, for ranges too long for the exact OCSVM.
+
+    Returns:
+        list: [{'tag', 'start', 'end', 'days', 'model'}] in manifest order.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = manifest.get('defaults', {})
+    entries = []
+    for entry in manifest['tags']:
+        if 'days' in entry and 'start' not in entry:
+            # The tag's own "days" wins over a default "start"
+            entry = {**entry, 'start': None}
+        entry = {**defaults, **entry}
+        if entry.get('start') is None and entry.get('days') is None:
+            raise ValueError(f"{entry['tag']} in {path} has neither 'start' nor 'days'")
+        model = entry.get('model', TRAIN_MODEL)
+        if model not in scalable_model.MODEL_KINDS:
+            raise ValueError(f"{entry['tag']} in {path} has an unknown model '{model}'")
+        entries.append({'tag': entry['tag'], 'start': entry.get('start'), 'end': entry.get('end'),
+                        'days': entry.get('days'), 'model': model})
+    return entries
+
+
+def resolve_range(entry, upper_bound):
+    """
+    Returns the (start, end) strings of a manifest entry, upper_bound being the newest dt in inspections.
+    """
+    end = pd.Timestamp(entry['end']) if entry['end'] is not None else pd.Timestamp(upper_bound)
+    start = pd.Timestamp(entry['start']) if entry['start'] is not None else end - pd.Timedelta(days=entry['days'])
+    return str(start), str(end)
+
+
+def get_training_info_path(models_dir, tag_name):
+    return os.path.join(models_dir, f'{tag_name}.train.json')
+
+
+def read_training_info(models_dir, tag_name):
+    """
+    Returns the tag's .train.json, None for a model trained before it existed (or no model).
+    """
+    info_path = get_training_info_path(models_dir, tag_name)
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path) as f:
+        return json.load(f)
+
+
+def write_training_info(models_dir, tag_name, info):
+    info_path = get_training_info_path(models_dir, tag_name)
+    with open(f'{info_path}.tmp', 'w') as f:
+        json.dump(info, f, indent=1)
+    os.replace(f'{info_path}.tmp', info_path)
+
+
+def get_manifest_spec(entry):
+    """
+    Returns the range of a manifest entry as written ("end": None for the newest data),
+    recorded in the .train.json of the models trained for it.
+    """
+    return {'start': entry['start'], 'end': entry['end'], 'days': entry['days']}
+
+
+def is_trained_for(info, entry, start_date, end_date):
+    """
+    Whether the model of a .train.json was trained for the manifest entry as it is now:
+    same model and same range spec. A model retrained for drift, on a more recent range,
+    keeps the spec of the entry it was retrained for.
+    """
+    if info.get('model', 'ocsvm') != entry['model']:
+        return False
+    if 'manifest_spec' in info:
+        return info['manifest_spec'] == get_manifest_spec(entry)
+    # Trained before the spec was recorded: only a fixed range can be compared
+    trained_range = info.get('manifest_range', [info['start'], info['end']])
+    return entry['end'] is None or trained_range == [start_date, end_date]
+
+
+def is_model_fresh(models_dir, entry, start_date, end_date, newest):
+    """
+    A model is fresh if it was trained for the manifest entry as it is now (is_trained_for)
+    and written after the newest data of its range (newest). With "end": null, data newer
+    than the model is what makes it stale.
+    """
+    # The scalable models only have the lean artifact
+    model_path = os.path.join(models_dir, f"{entry['tag']}.pkl" if entry['model'] == 'ocsvm' else f"{entry['tag']}.npz")
+    if not os.path.exists(model_path):
+        return False
+    info = read_training_info(models_dir, entry['tag'])
+    if info is not None:
+        if not is_trained_for(info, entry, start_date, end_date):
+            return False
+    elif entry['model'] != 'ocsvm':
+        return False
+    # Models trained before the manifest have no .train.json, only their date tells
+    return newest is None or os.path.getmtime(model_path) > pd.Timestamp(newest).timestamp()
+
+
+""" ******************* Training of one tag ******************* """
+
+def publish_model(model_path):
+    """
+    Publishes the new lean artifact to the memory-mapped model store, so the predictor's
+    workers map it instead of each publishing it on their first load.
+    """
+    if not model_store.MODEL_MMAP:
+        return
     try:
+        model_store.publish_artifact(model_path)
+    except OSError as e:
+        print(f"Could not publish {model_path} to the model store, the predictor will: {e}")
 
-        tags = [('2025-03-12 12:20:00', '2025-04-01 00:00:00', 'PIC11151A')]
-        conn = pg.connect(**db_config)
-        cursor = conn.cursor()
-        current_path = os.path.dirname(os.path.abspath(__file__))
-        # Create dftrain using the first function
-        folder_path = os.getcwd()
 
-        for start_date, end_date, tag_name in tags:
-            dataset= get_training_data(conn, cursor, start_date, end_date, tag_name)
-            dataset = prep.treat_data(dataset, tag_name)
-            # dataset = prep.treat_data(pd.read_csv(os.path.join(folder_path,'training_data', f'{tag_name}.csv')), tag_name)
-            dftrain = dataset
+def save_model_files(m, dftrain_filtered, models_dir, tag_name, info):
+    """
+    Writes the tag's .pkl, lean .npz and .train.json without a reader ever seeing a
+    half-written file: everything is written under a temporary name, then moved in place.
 
-            # Filter columns using the second functio
-            dftrain_filtered = prep.filter_columns(dftrain)
+    The .npz is moved first. Being newer than the old .pkl, it's what ModelCache loads,
+    and it stays newer than the new .pkl (written before it), so the predictor switches
+    to the new model in one step.
+    """
+    from pycaret.anomaly import save_model, load_model, predict_model
 
+    model_path = os.path.join(models_dir, tag_name)
+    tmp_path = os.path.join(models_dir, f'.{tag_name}.{os.getpid()}.tmp')
+    tmp_artifact_path = lean_model.get_artifact_path(tmp_path)
+    try:
+        with instrumentation.stage('save_model'):
+            save_model(m, tmp_path)
+        # NumPy-only artifact scored by predict.py without importing pycaret
+        with instrumentation.stage('export_artifact', rows=len(dftrain_filtered)):
+            pipeline = load_model(tmp_path)
+            lean_model.export_artifact(pipeline, tmp_artifact_path)
+            sample = dftrain_filtered.drop(columns=['Timestamp'])
+            verified = lean_model.verify_artifact(tmp_artifact_path, sample,
+                                                  predict_model(pipeline, data=sample)['Anomaly_Score'])
+        if verified:
+            os.replace(tmp_artifact_path, lean_model.get_artifact_path(model_path))
+        os.replace(f'{tmp_path}.pkl', f'{model_path}.pkl')
+        write_training_info(models_dir, tag_name, info)
+        if verified:
+            publish_model(model_path)
+    finally:
+        for leftover in (f'{tmp_path}.pkl', tmp_artifact_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def fetch_features(conn, cursor, resolver, cache, tag_name, start_date, end_date):
+    """
+    Returns the rolling features of a tag between two dates, through the local cache
+    (DATA_CACHE=1, TRAIN_FETCH_MODE is then ignored), or streamed or fetched at once from
+    PostgreSQL (TRAIN_FETCH_MODE).
+    """
+    # get_training_data is the former row-by-row path
+    if raw_cache.CACHE_ENABLED:
+        return cache.get_features(cursor, resolver, tag_name, start_date, end_date)
+    if TRAIN_FETCH_MODE == 'stream':
+        chunks = data_fetch.stream_tag_range(conn, resolver, tag_name, start_date, end_date)
+        return prep.treat_data_streaming(chunks, tag_name)
+    dataset = data_fetch.fetch_tag_range(cursor, resolver, tag_name, start_date, end_date)
+    return prep.treat_data(dataset, tag_name)
+
+
+def get_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def write_drift_profile(models_dir, tag_name, info, dftrain_filtered):
+    """
+    Adds the drift profile of the training window (drift.build_profile) to the tag's
+    .train.json, with the new model's anomaly rate on a sample of the training rows
+    when it has a lean artifact.
+    """
+    model_path = os.path.join(models_dir, tag_name)
+    artifact_path = lean_model.get_artifact_path(model_path)
+    scores = threshold = None
+    # An artifact older than the .pkl is the previous model's (the new one failed verification)
+    if os.path.exists(artifact_path) and (not os.path.exists(f'{model_path}.pkl')
+                                          or os.path.getmtime(artifact_path) >= os.path.getmtime(f'{model_path}.pkl')):
+        model = lean_model.LeanModel(artifact_path)
+        sample = dftrain_filtered.iloc[scalable_model.stratified_sample(len(dftrain_filtered), drift.PROFILE_SCORE_ROWS)]
+        scores = model.predict(sample.drop(columns=['Timestamp']))['Anomaly_Score'].to_numpy()
+        threshold = model.threshold
+    write_training_info(models_dir, tag_name, {**info, 'profile': drift.build_profile(dftrain_filtered, scores, threshold)})
+
+
+def create_score_param(conn, cursor, tag_name):
+    """
+    Commits the tag's \\AS param before its model files are written: a tag whose model
+    exists is always scored. If writing the model then fails, the tag has no model and
+    the next training run trains it again.
+    """
+    add_anomaly_score_tag(cursor, tag_name)
+    conn.commit()
+
+
+def train_tag(db_config, tag_name, start_date, end_date, model, models_dir, run_id=None, extra_info=None):
+    """
+    Fetches the features of one tag, trains its model (pycaret's OCSVM or a scalable
+    one) and writes the model files.
 
-            s = setup(data=dftrain_filtered, session_id=123, normalize=False, ignore_features=['Timestamp'], remove_outliers = True)
-            m = create_model('svm')
-            model_path = os.path.join(current_path,'models', tag_name)
-            save_model(m, model_path)
-            add_anomaly_score_tag(cursor, tag_name)
+    Meant to run in a process of its own: pycaret keeps its experiment in module globals,
+    so two tags can't be set up concurrently in the same process.
+
+    Args:
+        extra_info: Added to the .train.json, e.g. why a drift check retrained the tag.
+
+    Returns:
+        int: The number of training rows.
+    """
+    # The stage records of a worker share the run id of the training run
+    run = instrumentation.get_run()
+    if run_id is not None and (run is None or run.run_id != run_id):
+        instrumentation.start_run('train', run_id)
+    started_cpu = get_cpu_seconds()
+    conn = pg.connect(**db_config)
+    try:
+        with conn.cursor() as cursor, instrumentation.tag(tag_name):
+            resolver = data_fetch.ParamResolver()
+            cache = raw_cache.DataCache()
+            with instrumentation.stage('fetch_features') as stage:
+                dataset = fetch_features(conn, cursor, resolver, cache, tag_name, start_date, end_date)
+                stage['rows'] = len(dataset)
+            if dataset.empty:
+                raise ValueError(f"No data for {tag_name} between {start_date} and {end_date}")
+
+            with instrumentation.stage('filter_columns', rows=len(dataset)):
+                dftrain_filtered = prep.filter_columns(dataset)
+
+            info = {
+                'start': start_date,
+                'end': end_date,
+                'model': model,
+                'rows': len(dftrain_filtered),
+                'trained_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                **(extra_info or {}),
+            }
+            if model == 'ocsvm':
+                # Only imported when a tag trains pycaret's OCSVM
+                from pycaret.anomaly import setup, create_model
+
+                with instrumentation.stage('setup', rows=len(dftrain_filtered)):
+                    setup(data=dftrain_filtered, session_id=123, normalize=False, ignore_features=['Timestamp'],
+                          remove_outliers=True)
+                with instrumentation.stage('create_model', rows=len(dftrain_filtered)):
+                    m = create_model('svm')
+                create_score_param(conn, cursor, tag_name)
+                save_model_files(m, dftrain_filtered, models_dir, tag_name, info)
+            else:
+                # Only the lean artifact, moved in place once fitted; being newer than a former
+                # .pkl, it's what the predictor loads
+                tmp_artifact_path = lean_model.get_artifact_path(os.path.join(models_dir, f'.{tag_name}.{os.getpid()}.tmp'))
+                try:
+                    with instrumentation.stage(f'fit_{model}', rows=len(dftrain_filtered)):
+                        centres = scalable_model.train_scalable_model(model, dftrain_filtered, tmp_artifact_path)
+                    create_score_param(conn, cursor, tag_name)
+                    os.replace(tmp_artifact_path, lean_model.get_artifact_path(os.path.join(models_dir, tag_name)))
+                finally:
+                    if os.path.exists(tmp_artifact_path):
+                        os.remove(tmp_artifact_path)
+                info['centres'] = centres
+                write_training_info(models_dir, tag_name, info)
+                publish_model(os.path.join(models_dir, tag_name))
+            # What a retrain of the tag costs, for the drift checks' CPU budget
+            info['cpu_seconds'] = round(get_cpu_seconds() - started_cpu, 1)
+            with instrumentation.stage('drift_profile', rows=len(dftrain_filtered)):
+                write_drift_profile(models_dir, tag_name, info, dftrain_filtered)
         conn.commit()
-    except Exception as e:
-        print("failed to get training data, error: ")
-        print(e)
-        if conn:
-            conn.rollback()
+        instrumentation.flush(conn)
+        cache.report()
+        return len(dftrain_filtered)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+""" ******************* Training runner ******************* """
+
+def plan_training(cursor, entries, models_dir, force=False):
+    """
+    Resolves the manifest's date ranges and splits the tags into the ones to train and
+    the ones whose model is newer than their data.
+
+    Returns:
+        tuple: ([(tag_name, start, end, model)] to train, [tag_name] skipped,
+                {tag_name: {'manifest_spec'}} for the .train.json of the ones trained).
+    """
+    resolver = data_fetch.ParamResolver()
+    upper_bound = data_fetch.get_upper_bound(cursor)
+    to_train = []
+    skipped = []
+    extra_info = {}
+    for entry in entries:
+        start_date, end_date = resolve_range(entry, upper_bound)
+        newest = data_fetch.get_newest_timestamp(cursor, resolver, entry['tag'], start_date, end_date)
+        if not force and is_model_fresh(models_dir, entry, start_date, end_date, newest):
+            skipped.append(entry['tag'])
+        else:
+            to_train.append((entry['tag'], start_date, end_date, entry['model']))
+            extra_info[entry['tag']] = {'manifest_spec': get_manifest_spec(entry)}
+    return to_train, skipped, extra_info
+
+
+def run_training(db_config, entries, models_dir=MODELS_DIR, workers=TRAIN_WORKERS, force=False):
+    """
+    Trains the manifest's tags whose model is missing or stale, each one in a fresh worker
+    process when workers > 1.
+
+    Args:
+        entries: load_manifest's entries.
+        force: Train every tag, fresh or not.
+
+    Returns:
+        dict: The tags trained, skipped and failed ((tag, error)).
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    conn = pg.connect(**db_config)
+    try:
+        with conn.cursor() as cursor:
+            to_train, skipped, extra_info = plan_training(cursor, entries, models_dir, force)
+        conn.commit()
+        if skipped:
+            print(f"Models up to date, not retrained: {', '.join(skipped)}")
+        trained, failed = train_tasks(conn, db_config, to_train, models_dir, workers, extra_info)
+    finally:
+        conn.close()
+    return {'trained': trained, 'skipped': skipped, 'failed': failed}
+
+
+def train_tasks(conn, db_config, tasks, models_dir, workers, extra_info=None):
+    """
+    Trains the tasks ([(tag_name, start, end, model)]) as one training run, each one in
+    a fresh worker process when workers > 1.
+
+    Args:
+        extra_info: {tag_name: dict added to its .train.json}.
+
+    Returns:
+        tuple: ([tag_name] trained, [(tag_name, error)] failed).
+    """
+    extra_info = extra_info or {}
+    print(f"Training {len(tasks)} tag(s) with {workers} worker(s)")
+    run = instrumentation.start_run('train')
+    trained = []
+    failed = []
+
+    def record(task, rows, error):
+        tag_name, start_date, end_date, model = task
+        if error is not None:
+            print(f"Training of {tag_name} failed: {error}")
+            failed.append((tag_name, str(error)))
+        else:
+            print(f"Trained {tag_name} ({model}) on {rows} rows ({start_date} to {end_date})")
+            trained.append(tag_name)
+
+    if workers > 1 and len(tasks) > 1:
+        # One fresh process per tag: no pycaret state nor memory carried over
+        options = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context('spawn'),
+                                                    **options) as executor:
+            futures = {executor.submit(train_tag, db_config, *task, models_dir, run.run_id, extra_info.get(task[0])): task
+                       for task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    record(futures[future], future.result(), None)
+                except Exception as e:
+                    record(futures[future], None, e)
+    else:
+        for task in tasks:
+            try:
+                record(task, train_tag(db_config, *task, models_dir, run.run_id, extra_info.get(task[0])), None)
+            except Exception as e:
+                record(task, None, e)
+    instrumentation.finish_run(conn)
+    return trained, failed
+
+
+""" ******************* Drift retraining ******************* """
+
+def assess_tag(conn, cursor, resolver, cache, entry, models_dir, upper_bound, now):
+    """
+    Measures the drift of one manifest tag since its model was trained (drift.assess_drift),
+    with the task that would retrain it: a range as long as the manifest's, ending at the
+    newest data.
+
+    Returns:
+        dict: The assessment, 'decision' already 'skipped' when the drift can't be measured.
+    """
+    tag_name = entry['tag']
+    start_date, end_date = resolve_range(entry, upper_bound)
+    info = read_training_info(models_dir, tag_name)
+    if info is None:
+        return {'tag': tag_name, 'decision': 'skipped', 'reason': "no model trained from the manifest, train.py trains it"}
+    # An entry edited in the manifest is retrained by train.py, drift or not
+    if not is_trained_for(info, entry, start_date, end_date):
+        return {'tag': tag_name, 'decision': 'skipped', 'reason': "the manifest changed since training, train.py retrains it"}
+    if 'profile' not in info:
+        return {'tag': tag_name, 'decision': 'skipped',
+                'reason': "trained before the drift profiles, retrain it once (--force) to track its drift"}
+
+    upper_bound = raw_cache.to_utc(upper_bound)
+    # As many days as the training window's stretches it is compared with
+    window_start = upper_bound - pd.Timedelta(days=info['profile']['window_days'])
+    # The first rows of the window need the history of their rolling windows
+    dataset = fetch_features(conn, cursor, resolver, cache, tag_name,
+                             str(window_start - prep.get_history_horizon(prep.WINDOW_SIZES)), str(upper_bound))
+    if len(dataset):
+        dataset = prep.filter_columns(dataset[dataset['Timestamp'] >= window_start])
+    rates = pd.DataFrame(columns=['day', 'minutes', 'anomalies'])
+    if info['profile']['threshold'] is not None:
+        # Scores written by an earlier model don't tell about this one
+        since = max(window_start, raw_cache.to_utc(info['trained_at']))
+        rates = drift.get_anomaly_rates(cursor, tag_name, since, info['profile']['threshold'])
+    assessment = drift.assess_drift(tag_name, info, dataset, rates, now)
+
+    retrain_start = upper_bound - (pd.Timestamp(end_date) - pd.Timestamp(start_date))
+    assessment['task'] = (tag_name, str(retrain_start), str(upper_bound), entry['model'])
+    assessment['manifest_spec'] = get_manifest_spec(entry)
+    assessment['cost_s'] = info.get('cpu_seconds') or drift.RETRAIN_DEFAULT_CPU_SECONDS
+    return assessment
+
+
+def run_drift_retraining(db_config, entries, models_dir=MODELS_DIR, workers=TRAIN_WORKERS,
+                         budget=RETRAIN_BUDGET_SECONDS, dry_run=False):
+    """
+    Retrains only the manifest's tags that drifted from their model's training window
+    (feature distributions or anomaly rate, see drift.py), the most drifted first, within
+    a budget of CPU seconds estimated from each model's last training. Why every tag is
+    or isn't retrained is printed and appended to drift.DRIFT_LOG.
+
+    Args:
+        dry_run: Only assess and log, retrain nothing.
 
+    Returns:
+        dict: The assessments, and the tags trained and failed ((tag, error)).
+    """
+    conn = pg.connect(**db_config)
+    try:
+        with conn.cursor() as cursor:
+            resolver = data_fetch.ParamResolver()
+            cache = raw_cache.DataCache()
+            upper_bound = data_fetch.get_upper_bound(cursor)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            assessments = []
+            for entry in entries:
+                try:
+                    assessments.append(assess_tag(conn, cursor, resolver, cache, entry, models_dir, upper_bound, now))
+                except Exception as e:
+                    conn.rollback()
+                    assessments.append({'tag': entry['tag'], 'decision': 'skipped', 'reason': f"drift check failed: {e}"})
+        conn.commit()
+        selected = drift.select_retraining(assessments, budget)
+        drift.log_decisions(assessments)
+        trained, failed = [], []
+        if selected and not dry_run:
+            extra_info = {assessment['tag']: {'manifest_spec': assessment['manifest_spec'],
+                                              'retrained_for': assessment['reason']} for assessment in selected}
+            trained, failed = train_tasks(conn, db_config, [assessment['task'] for assessment in selected], models_dir,
+                                          workers, extra_info)
     finally:
-        if conn and cursor:
-            cursor.close()
-            conn.close()
-            print("PostgreSQL connection closed")
+        conn.close()
+    return {'assessments': assessments, 'trained': trained, 'failed': failed}
+
+
+def run_drift_daemon(db_config, entries, schedule, models_dir=MODELS_DIR, workers=TRAIN_WORKERS,
+                     budget=RETRAIN_BUDGET_SECONDS):
+    """
+    Runs the drift retraining on a cron schedule (RETRAIN_CRON) until interrupted.
+    """
+    print(f"Drift retraining scheduled '{schedule.expression}', budget {budget:.0f} CPU s")
+    while True:
+        next_run = schedule.next_after(datetime.datetime.now())
+        time.sleep(max((next_run - datetime.datetime.now()).total_seconds(), 0))
+        print(f"Drift check {next_run:%Y-%m-%d %H:%M}")
+        try:
+            run_drift_retraining(db_config, entries, models_dir, workers, budget)
+        except Exception as e:
+            # The next check retries
+            print(f"Drift check failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the anomaly models of the tags in a manifest")
+    parser.add_argument('--manifest', default=TRAIN_MANIFEST)
+    parser.add_argument('--tags', nargs='*', help="Only these tags of the manifest")
+    parser.add_argument('--workers', type=int, default=TRAIN_WORKERS)
+    parser.add_argument('--force', action='store_true', help="Retrain fresh models too")
+    parser.add_argument('--drift', action='store_true', help="Only retrain the tags that drifted, within --budget")
+    parser.add_argument('--budget', type=float, default=RETRAIN_BUDGET_SECONDS, help="CPU seconds of --drift retraining")
+    parser.add_argument('--dry-run', action='store_true', help="With --drift, log the decisions without retraining")
+    parser.add_argument('--daemon', action='store_true', help="With --drift, check on the RETRAIN_CRON schedule")
+    args = parser.parse_args()
+
+    db_config = {
+        'database': POSTGRES_DB ,
+        'user': POSTGRES_USER,
+        'password': POSTGRES_PASSWORD,
+        'host': POSTGRES_HOST,  # e.g., 'localhost' or an IP address
+        'port': POSTGRES_PORT       # Default PostgreSQL port
+    }
+    entries = load_manifest(args.manifest)
+    if args.tags:
+        entries = [entry for entry in entries if entry['tag'] in args.tags]
+    if args.drift and args.daemon:
+        run_drift_daemon(db_config, entries, CronSchedule(RETRAIN_CRON), workers=args.workers, budget=args.budget)
+    if args.drift:
+        result = run_drift_retraining(db_config, entries, workers=args.workers, budget=args.budget, dry_run=args.dry_run)
+        decisions = [assessment['decision'] for assessment in result['assessments']]
+        print(f"{len(result['trained'])} retrained, {decisions.count('deferred')} deferred by the budget, "
+              f"{decisions.count('keep')} kept, {decisions.count('skipped')} not assessed, {len(result['failed'])} failed")
+        sys.exit(1 if result['failed'] else 0)
+    result = run_training(db_config, entries, workers=args.workers, force=args.force)
+    print(f"{len(result['trained'])} trained, {len(result['skipped'])} up to date, {len(result['failed'])} failed")
+    sys.exit(1 if result['failed'] else 0)
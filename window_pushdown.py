@@ -0,0 +1,246 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+import data_fetch
+import pre_processing as prep
+
+# Load environment variables from the .env file
+load_dotenv()
+VARIABLES_SCHEMA = os.environ.get("VARIABLES_SCHEMA")
+
+# Window aggregates PostgreSQL computes, by statistic. On numeric, avg and stddev_samp can
+# drop the rows leaving a moving frame, so each window is a single pass over the rows.
+SQL_STATISTICS = {
+    'mean': '(avg(value::numeric) OVER {window})::float8',
+    'std': '(stddev_samp(value::numeric) OVER {window})::float8',
+}
+# Rolled here by rolling_kernel over the minute values the query returns: the median has no
+# window form in PostgreSQL (percentile_cont is an ordered-set aggregate), and min/max
+# can't drop rows from a moving frame, they rescan it for every row (O(rows x window))
+CLIENT_STATISTICS = ['median', 'max', 'min', 'range']
+
+
+""" ******************* Window query ******************* """
+
+def get_window_frame(window_size):
+    """
+    Returns the frame of a time window, pandas style: (t - w, t].
+
+    RANGE ... PRECEDING includes the row exactly w before, timestamptz has microsecond
+    resolution, so the frame starts one microsecond later (e.g. '05:59:59.999999').
+    """
+    return (f"(PARTITION BY variable ORDER BY dt RANGE BETWEEN INTERVAL '{window_size - 1:02d}:59:59.999999' "
+            f"PRECEDING AND CURRENT ROW)")
+
+
+def get_sql_statistics(statistics):
+    """
+    Returns the {window_size: [statistic]} PostgreSQL computes for a plan's statistics
+    ({column: {window_size: [statistic]}}): all the columns share one query, so the union.
+    The crossings count reads the 6h mean, which is added for it.
+    """
+    sql_statistics = {}
+    for windows in statistics.values():
+        for window_size, stats in windows.items():
+            wanted = sql_statistics.setdefault(window_size, [])
+            for stat in stats + (['mean'] if prep.CROSSINGS in stats else []):
+                if stat in SQL_STATISTICS and stat not in wanted:
+                    wanted.append(stat)
+    return sql_statistics
+
+
+def get_window_query(sql_statistics, crossings):
+    """
+    Returns the query computing the window features of a tag's signals.
+
+    The minutes are averaged per signal like the current fetch, and laid out on the grid of
+    every minute any of the tag's signals has (the rows of the pivoted frame), with NULL
+    where a signal is missing: the window aggregates skip NULLs like pandas skips NaNs.
+
+    Parameters: ids/names (the tag's params and their pivoted column names), columns (the
+    columns to aggregate), lower/upper (the raw minutes read, both included) and since
+    (rows returned are after it, NULL for all).
+
+    Args:
+        sql_statistics: {window_size: [statistic]} from get_sql_statistics.
+        crossings: Whether to count the crossings of the 6h mean.
+    """
+    windows = sorted(sql_statistics)
+    if crossings and 6 not in windows:
+        windows.append(6)
+    pairs = [(stat, window_size) for window_size in sorted(sql_statistics) for stat in sql_statistics[window_size]]
+    fields = [f'{stat}_{window_size}h' for stat, window_size in pairs]
+    features = [f", {SQL_STATISTICS[stat].format(window=f'w{window_size}')} AS {stat}_{window_size}h"
+                for stat, window_size in pairs]
+    window_clause = ''
+    if windows:
+        window_clause = 'WINDOW ' + ', '.join(f"w{window_size} AS {get_window_frame(window_size)}" for window_size in windows)
+    crossings_feature = ''
+    if crossings:
+        # pandas: (value > ma) & (shift(1) < ma), a missing value never crosses
+        crossings_feature = (f", sum(coalesce((value > mean_6h AND previous < mean_6h)::integer, 0)) "
+                             f"OVER {get_window_frame(6)} AS {prep.CROSSINGS}_6h")
+        fields.append(f'{prep.CROSSINGS}_6h')
+    return f"""
+        WITH signals AS (
+            SELECT * FROM unnest(%(ids)s::integer[], %(names)s::text[]) AS s(id, variable)
+        ), minutes AS (
+            SELECT i.dt, s.variable, AVG(i.value)::float8 AS value
+            FROM {VARIABLES_SCHEMA}.inspections i
+            JOIN signals s ON s.id = i.id_param_fk
+            WHERE i.id_param_fk = ANY(%(ids)s) AND i.value IS NOT NULL
+              AND i.dt >= %(lower)s AND i.dt <= %(upper)s
+            GROUP BY i.dt, s.variable
+        ), grid AS (
+            SELECT DISTINCT dt FROM minutes
+        ), cells AS (
+            SELECT g.dt, c.variable, m.value
+            FROM grid g
+            CROSS JOIN unnest(%(columns)s::text[]) AS c(variable)
+            LEFT JOIN minutes m ON m.dt = g.dt AND m.variable = c.variable
+        ), windowed AS (
+            SELECT dt, variable, value,
+                   lag(value) OVER (PARTITION BY variable ORDER BY dt) AS previous
+                   {''.join(features)}
+            FROM cells
+            {window_clause}
+        ), counted AS (
+            SELECT * {crossings_feature}
+            FROM windowed
+        )
+        SELECT {', '.join(['dt', 'variable', 'value'] + fields)} FROM counted
+        WHERE %(since)s::timestamptz IS NULL OR dt > %(since)s::timestamptz
+        ORDER BY dt, variable
+    """
+
+
+def fetch_window_rows(cursor, query, params):
+    """
+    Runs a window query through a CSV COPY, parsed in one vectorized pass.
+
+    Returns:
+        tuple: (DataFrame of the long (dt, variable, value, features...) rows, bytes received).
+    """
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)", buffer)
+    size = buffer.tell()
+    buffer.seek(0)
+    rows = pd.read_csv(buffer, dtype={'variable': str})
+    rows['dt'] = pd.to_datetime(rows['dt'], utc=True)
+    return rows, size
+
+
+""" ******************* Feature mode ******************* """
+
+def get_tag_signals(cursor, resolver, tag_name):
+    """
+    Returns the ids of a tag's params (and the shared ones) with their pivoted column names.
+    """
+    resolver.refresh(cursor)
+    param_ids = sorted(set(resolver.get_tag_params(tag_name)) | set(resolver.get_shared_params()))
+    return param_ids, [prep.get_column_name(resolver.descriptions[param_id]) for param_id in param_ids]
+
+
+def fetch_window_features(cursor, resolver, tag_name, lower, upper, since=None, plan=None, raw_history=None):
+    """
+    Computes a tag's features with the window aggregates done by PostgreSQL.
+
+    Only the rows after since travel, with the minute values of the columns and their
+    SQL_STATISTICS; the CLIENT_STATISTICS are rolled here over raw_history followed by
+    those values.
+
+    Args:
+        lower: First raw minute the windows read (included).
+        upper: Last raw minute (included).
+        since: The rows after it are returned, None for all of them.
+        plan: A prep.build_feature_plan plan, None for every feature of create_aggregated_df.
+        raw_history: Pivoted raw rows up to since (a checkpoint's raw_tail), needed by the CLIENT_STATISTICS.
+
+    Returns:
+        tuple: (aggregated DataFrame like create_aggregated_df's rows after since,
+                the pivoted raw rows of the aggregated columns, bytes received).
+    """
+    columns_to_aggregate = prep.get_columns_to_aggregate(tag_name)
+    if plan is None:
+        plan = prep.build_feature_plan(prep.get_feature_names(columns_to_aggregate, prep.WINDOW_SIZES),
+                                       columns_to_aggregate, prep.WINDOW_SIZES)
+    param_ids, names = get_tag_signals(cursor, resolver, tag_name)
+    columns = [column for column in plan['statistics'] if column in names]
+    statistics = {column: plan['statistics'][column] for column in columns}
+    crossings = any(prep.CROSSINGS in stats for windows in statistics.values() for stats in windows.values())
+
+    query = get_window_query(get_sql_statistics(statistics), crossings)
+    params = {'ids': param_ids, 'names': names, 'columns': columns, 'lower': pd.Timestamp(lower),
+              'upper': pd.Timestamp(upper), 'since': None if since is None else pd.Timestamp(since)}
+    rows, size = fetch_window_rows(cursor, query, params)
+    if rows.empty:
+        return pd.DataFrame(columns=['Timestamp']), pd.DataFrame(columns=['Timestamp']), size
+
+    wide = rows.pivot(index='dt', columns='variable', values=[field for field in rows.columns if field not in ('dt', 'variable')])
+    timestamps = pd.DatetimeIndex(wide.index, name='Timestamp')
+    raw = pd.DataFrame({column: wide[('value', column)].to_numpy() for column in columns if ('value', column) in wide},
+                       index=timestamps).reset_index()
+
+    features = {}
+    for column in columns:
+        # A signal without any minute in the range has no features, like in the pivoted frame
+        if ('value', column) not in wide or (wide[('value', column)].isna().all()
+                                             and (raw_history is None or column not in raw_history
+                                                  or raw_history[column].isna().all())):
+            continue
+        for window_size, stats in statistics[column].items():
+            for stat in stats:
+                field = f'{stat}_{window_size}h'
+                if stat in SQL_STATISTICS or stat == prep.CROSSINGS:
+                    features[f'{column}_{field}'] = wide[(field, column)].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    client_features = [f'{column}_{stat}_{window_size}h' for column in columns if column in raw.columns
+                       for window_size, stats in statistics[column].items() for stat in stats
+                       if stat in CLIENT_STATISTICS]
+    if client_features:
+        history = prep.append_to_raw_tail({'raw_tail': raw_history} if raw_history is not None else None, raw)
+        client_plan = prep.build_feature_plan(client_features, columns_to_aggregate, prep.WINDOW_SIZES)
+        aggregated = prep.create_aggregated_df(history, columns_to_aggregate, prep.WINDOW_SIZES, client_plan)
+        if since is not None:
+            aggregated = aggregated[aggregated['Timestamp'] > pd.Timestamp(since)]
+        for feature in client_features:
+            features[feature] = aggregated[feature].to_numpy()
+
+    ordered = {feature: features[feature] for feature in plan['features'] if feature in features}
+    return pd.DataFrame({'Timestamp': timestamps, **ordered}, copy=False), raw, size
+
+
+def treat_data_pushdown(cursor, resolver, tag_name, checkpoint=None, plan=None):
+    """
+    Same as pre_processing.treat_data_incremental, with the window aggregates done by PostgreSQL.
+
+    Without a checkpoint the last data_fetch.RECENT_WINDOW of minutes is scored; with one,
+    the minutes after it, the windows reading back to the start of its raw tail.
+
+    Returns:
+        tuple: (aggregated DataFrame with only the new rows, updated checkpoint).
+    """
+    columns_to_aggregate = prep.get_columns_to_aggregate(tag_name)
+    if checkpoint is not None and (checkpoint['columns'] != list(columns_to_aggregate)
+                                   or checkpoint['window_sizes'] != list(prep.WINDOW_SIZES)):
+        print("Checkpoint was built for other columns/windows, starting cold.")
+        checkpoint = None
+
+    upper = data_fetch.get_upper_bound(cursor)
+    if upper is None:
+        return pd.DataFrame(columns=['Timestamp']), checkpoint
+    upper = pd.Timestamp(upper)
+    if checkpoint is None:
+        lower, since, raw_history = upper - data_fetch.RECENT_WINDOW, None, None
+    else:
+        raw_history = checkpoint['raw_tail']
+        lower, since = raw_history['Timestamp'].iloc[0], checkpoint['last_timestamp']
+
+    dataset, raw, size = fetch_window_features(cursor, resolver, tag_name, lower, upper, since, plan, raw_history)
+    print(f"Fetched {len(dataset)} rows of window features for {tag_name} ({size / 1024:.0f} KiB)")
+    if dataset.empty:
+        return pd.DataFrame(columns=['Timestamp']), checkpoint
+    history = prep.append_to_raw_tail(checkpoint, raw)
+    return dataset, prep.make_checkpoint(history, columns_to_aggregate, prep.WINDOW_SIZES)